@@ -11,20 +11,21 @@ import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import pandas as pd
 
+from ps import dataset_io
 from ps import logging_utils
 
 plt.rcParams['figure.figsize'] = (10, 6)
 
 
-def _read_metrics_from_file(metrics_csv_path):
-  return pd.DataFrame.from_csv(metrics_csv_path)
+def _read_metrics_from_file(metrics_path):
+  return dataset_io.load_results_frame(metrics_path)
 
 
 def _mean_value_by_metric(metrics, metric_name):
-  eild_values = metrics[metrics.metric == metric_name][[
-      'fold', 'source', 'value'
-  ]]
-  return eild_values.groupby('source').mean().value
+  # Only the numeric value column is averaged: fold reads back from parquet
+  # as a string, which pandas 2 refuses to average.
+  values = metrics[metrics.metric == metric_name][['source', 'value']]
+  return values.groupby('source').value.mean()
 
 
 def _compute_mean_metrics(metrics):
@@ -236,7 +237,8 @@ def _make_plots(mean_metrics, output_dir, front_metrics=None, extension='pdf'):
 
 def parse_args():
   p = argparse.ArgumentParser()
-  p.add_argument('metrics_csv_path')
+  p.add_argument('metrics_path',
+                 help='results file (parquet, feather or csv) or its directory')
   p.add_argument('--front_csv_path')
   p.add_argument('--fold', type=int)
   p.add_argument('--no_oracles', action='store_true')
@@ -263,10 +265,13 @@ def main():
   _setup_loggers()
   args = parse_args()
 
-  output_dir = os.path.dirname(args.metrics_csv_path)
+  if os.path.isdir(args.metrics_path):
+    output_dir = args.metrics_path
+  else:
+    output_dir = os.path.dirname(args.metrics_path)
 
-  metrics = _read_metrics_from_file(args.metrics_csv_path)
-  logging.info('Done reading metrics from CSV')
+  metrics = _read_metrics_from_file(args.metrics_path)
+  logging.info('Done reading metrics')
 
   if args.front_csv_path is None:
     logging.info('No front metrics path provided')
@@ -277,9 +282,10 @@ def main():
 
   if args.fold is not None:
     logging.info('Filtering metrics to fold %d', args.fold)
-    metrics = metrics[metrics.fold == args.fold]
+    # CSV results read folds back as ints, columnar ones keep them as strings.
+    metrics = metrics[metrics.fold.astype(str) == str(args.fold)]
 
-  logging.info('Using metrics at %s', args.metrics_csv_path)
+  logging.info('Using metrics at %s', args.metrics_path)
 
   logging.info('Computing mean metrics')
   mean_metrics = _compute_mean_metrics(metrics)
@@ -4,11 +4,26 @@ import logging
 import os
 
 from ps import gen_oracles
+from ps import dataset_io
 from ps import logging_utils
 
 def parse_args():
   p = argparse.ArgumentParser(description='Generate oracle rankings')
   p.add_argument('dataset')
+  p.add_argument('--workers', '-w', type=int, default=None,
+                 help='processes used to load files (default: one per CPU)')
+  p.add_argument('--output-formats', '-o', nargs='+',
+                 choices=dataset_io.RESULT_FORMATS,
+                 help='results formats to write (default: {})'.format(
+                     ' '.join(dataset_io.DEFAULT_RESULT_FORMATS)))
+  p.add_argument('--approximate-distances', '-a', type=int, default=None,
+                 metavar='NUM_HASHES',
+                 help='estimate item distances from MinHash signatures of '
+                 'this many hashes (more is slower and more accurate)')
+  p.add_argument('--store-distances', '-s', action='store_true',
+                 help='save the distances between all rated items in the '
+                 'dataset cache and memory-map them in later runs (takes '
+                 'n^2/2 values for n rated items)')
   return p.parse_args()
 
 
@@ -34,7 +49,11 @@ def main():
   logging.info('Saving stuff at %s', output_dir)
   logging.info('Also logging to %s', log_path)
 
-  gen_oracles.main(dataset_dir=args.dataset, output_dir=output_dir)
+  gen_oracles.main(dataset_dir=args.dataset, output_dir=output_dir,
+                   num_workers=args.workers,
+                   result_formats=args.output_formats,
+                   num_hashes=args.approximate_distances,
+                   store_distances=args.store_distances)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,106 @@
+"""Directory-backed storage for groups of named numpy arrays.
+
+Each entry is a directory with one `.npy` file per array and a signature
+describing what it was built from, so entries are reloaded memory-mapped and
+silently rebuilt once their inputs change.
+"""
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+_SIGNATURE_FILENAME = 'SIGNATURE'
+
+
+class ArrayStore(object):
+
+  def __init__(self, root_dir):
+    self.root_dir = root_dir
+
+  def _entry_dir(self, key):
+    return os.path.join(self.root_dir, key)
+
+  def load(self, key, signature, mmap_mode='r'):
+    """Returns a dict of the arrays saved under key, or None on a miss."""
+    entry_dir = self._entry_dir(key)
+    try:
+      with open(os.path.join(entry_dir, _SIGNATURE_FILENAME)) as f:
+        if f.read() != signature:
+          return None
+      return {
+          os.path.splitext(filename)[0]: _load_mapped(
+              os.path.join(entry_dir, filename), mmap_mode)
+          for filename in os.listdir(entry_dir)
+          if filename.endswith('.npy')
+      }
+    except (OSError, ValueError):
+      return None
+
+  def save(self, key, signature, arrays):
+    """Saves the arrays under key, replacing any previous entry.
+
+    Arrays set to None are skipped. Returns whether the entry was written;
+    failing to write (e.g. a read-only dataset directory) is not an error. If
+    a concurrent writer puts its entry in place first, that entry is kept.
+    """
+    staging_dir = None
+    try:
+      os.makedirs(self.root_dir, exist_ok=True)
+      staging_dir = tempfile.mkdtemp(dir=self.root_dir, prefix='.staging-')
+      for name, array in arrays.items():
+        if array is not None:
+          np.save(os.path.join(staging_dir, name + '.npy'), array)
+      with open(os.path.join(staging_dir, _SIGNATURE_FILENAME), 'w') as f:
+        f.write(signature)
+
+      entry_dir = self._entry_dir(key)
+      shutil.rmtree(entry_dir, ignore_errors=True)
+      try:
+        os.rename(staging_dir, entry_dir)
+      except OSError:
+        if not os.path.isdir(entry_dir):
+          raise
+    except OSError as e:
+      logging.warning('Could not save %s to the array store: %s', key, e)
+      return False
+    finally:
+      # Gone after a successful rename; left over after any failure.
+      if staging_dir is not None:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return True
+
+
+# The mode a pickled MappedArray is reopened in. Copy-on-write maps may hold
+# changes that are not in the file, so they are pickled by value.
+_REOPEN_MODES = {'r': 'r', 'r+': 'r+', 'w+': 'r+'}
+
+
+class MappedArray(np.memmap):
+  """A memory-mapped array that pickles as a reference to its file.
+
+  Whole mapped files are pickled by reference, so worker processes map the
+  same pages instead of receiving a copy. Views, and arrays mapped
+  copy-on-write, are pickled by value.
+  """
+
+  def __reduce__(self):
+    if (isinstance(self.base, mmap.mmap) and self.filename and
+        self.mode in _REOPEN_MODES):
+      order = 'C' if self.flags.c_contiguous else 'F'
+      return (MappedArray, (self.filename, self.dtype,
+                            _REOPEN_MODES[self.mode], self.offset, self.shape,
+                            order))
+    return np.asarray(self).__reduce__()
+
+
+def _load_mapped(path, mmap_mode):
+  array = np.load(path, mmap_mode=mmap_mode)
+  if not isinstance(array, np.memmap):
+    return array
+  order = 'C' if array.flags.c_contiguous else 'F'
+  return MappedArray(array.filename, array.dtype, mmap_mode, array.offset,
+                     array.shape, order)
@@ -0,0 +1,124 @@
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from ps import array_store
+
+
+class ArrayStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.store = array_store.ArrayStore(
+        os.path.join(self.temp_dir.name, 'store'))
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+    super().tearDown()
+
+  def test_load_missing_entry(self):
+    self.assertIsNone(self.store.load('missing', 'signature'))
+
+  def test_round_trip(self):
+    self.store.save('key', 'signature', {
+        'a': np.array([[1, 2], [3, 4]], dtype='int32'),
+        'b': np.array([0.5]),
+        'skipped': None,
+    })
+
+    arrays = self.store.load('key', 'signature')
+
+    self.assertEqual({'a', 'b'}, set(arrays))
+    self.assertEqual([[1, 2], [3, 4]], arrays['a'].tolist())
+    self.assertEqual('int32', arrays['a'].dtype)
+    self.assertIsInstance(arrays['a'], np.memmap)
+
+  def test_signature_mismatch_is_a_miss(self):
+    self.store.save('key', 'old', {'a': np.arange(3)})
+
+    self.assertIsNone(self.store.load('key', 'new'))
+
+  def test_save_replaces_entry(self):
+    self.store.save('key', 'old', {'a': np.arange(3), 'b': np.arange(2)})
+    self.store.save('key', 'new', {'a': np.arange(5)})
+
+    arrays = self.store.load('key', 'new')
+
+    self.assertEqual({'a'}, set(arrays))
+    self.assertEqual(5, len(arrays['a']))
+
+  def test_save_failure_returns_false(self):
+    blocking_file = os.path.join(self.temp_dir.name, 'file')
+    open(blocking_file, 'w').close()
+    store = array_store.ArrayStore(blocking_file)
+
+    self.assertFalse(store.save('key', 'signature', {'a': np.arange(3)}))
+
+  def test_keeps_entry_of_concurrent_writer(self):
+
+    def rename_after_other_writer(staging_dir, entry_dir):
+      os.mkdir(entry_dir)
+      with open(os.path.join(entry_dir, 'SIGNATURE'), 'w') as f:
+        f.write('other')
+      raise OSError('Directory not empty')
+
+    with mock.patch.object(
+        array_store.os, 'rename', side_effect=rename_after_other_writer):
+      self.assertTrue(
+          self.store.save('key', 'signature', {'a': np.arange(3)}))
+
+    self.assertEqual(['key'], os.listdir(self.store.root_dir))
+    self.assertEqual({}, self.store.load('key', 'other'))
+
+  def test_removes_staging_dir_on_failure(self):
+    with mock.patch.object(array_store.os, 'rename',
+                           side_effect=OSError('Cross-device link')):
+      self.assertFalse(self.store.save('key', 'signature',
+                                       {'a': np.arange(3)}))
+
+    self.assertEqual([], os.listdir(self.store.root_dir))
+
+  def test_pickles_mapped_arrays_by_reference(self):
+    array = np.arange(100000, dtype='int64')
+    self.store.save('key', 'signature', {'a': array})
+    mapped = self.store.load('key', 'signature')['a']
+
+    pickled = pickle.dumps(mapped)
+    unpickled = pickle.loads(pickled)
+
+    self.assertLess(len(pickled), array.nbytes // 10)
+    self.assertTrue((array == unpickled).all())
+
+  def test_pickles_views_by_value(self):
+    self.store.save('key', 'signature', {'a': np.arange(10)})
+    view = self.store.load('key', 'signature')['a'][2:5]
+
+    self.assertEqual([2, 3, 4], pickle.loads(pickle.dumps(view)).tolist())
+
+  def test_pickles_writable_maps_writable(self):
+    self.store.save('key', 'signature', {'a': np.arange(10)})
+    mapped = self.store.load('key', 'signature', mmap_mode='r+')['a']
+
+    unpickled = pickle.loads(pickle.dumps(mapped))
+    unpickled[0] = 7
+
+    self.assertEqual(7, mapped[0])
+
+  def test_leaves_other_memmaps_alone(self):
+    path = os.path.join(self.temp_dir.name, 'raw')
+    array = np.memmap(path, dtype='int64', mode='w+', shape=(4,))
+    array[:] = [1, 2, 3, 4]
+
+    unpickled = pickle.loads(pickle.dumps(array))
+
+    self.assertEqual([1, 2, 3, 4], unpickled.tolist())
+    self.assertIsNone(getattr(unpickled, 'filename', None))
+
+
+if __name__ == '__main__':
+  unittest.main()
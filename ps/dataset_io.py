@@ -1,11 +1,26 @@
 import collections
+import functools
+import hashlib
+import itertools
 import logging
 import re
 import os
+import time
 
 import numpy as np
 import pandas as pd
 
+from ps import array_store
+from ps import parallel
+
+try:
+  from pyarrow import csv as pyarrow_csv
+except ImportError:
+  pyarrow_csv = None
+
+_CACHE_DIRNAME = '.ps_cache'
+_CACHE_FORMAT_VERSION = 2
+
 _RANKING_SET_FILENAME_REGEX = r'u(\d+)-(\w+)\.out'
 
 RankingSetId = collections.namedtuple('RankingSetId', ('fold', 'source'))
@@ -30,60 +45,482 @@ def _yield_rating_set_filenames(dir_path):
       yield filename, fold, split
 
 
-def _parse_ranking_line(line):
-  user_id_string, ranking_string = line.split('\t')
+_MAX_ID_DIGITS = 18
+
+_TAB, _NEWLINE, _COMMA, _COLON = (ord(c) for c in '\t\n,:')
+_RANKING_OPENERS = np.array([ord(c) for c in ',{['], dtype='uint8')
+# Whitespace other than the tabs and newlines that delimit fields.
+_BLANKS = np.array([ord(c) for c in ' \r\v\f'], dtype='uint8')
+_SCORE_SEPARATORS = bytes.maketrans(b'\t\n\r{}[],:', b' ' * 9)
+
+
+def _parse_digits_before(chars, ends):
+  """Parses the unsigned integers that end right before each of the ends.
+
+  chars -- A uint8 array with the raw file contents.
+  ends -- Positions of the delimiters that follow each integer.
+
+  Returns the parsed values and the position of their first digits.
+  """
+  values = np.zeros(len(ends), dtype='int64')
+  num_digits = np.zeros(len(ends), dtype='int64')
+  active = np.ones(len(ends), dtype=bool)
+
+  # Zero bytes in front keep the look-behind in bounds for the first line.
+  padded = np.concatenate([np.zeros(_MAX_ID_DIGITS, dtype='uint8'), chars])
+  for offset in range(1, _MAX_ID_DIGITS + 1):
+    digits = padded.take(ends + _MAX_ID_DIGITS - offset) - np.uint8(ord('0'))
+    active &= digits <= 9
+    if not active.any():
+      break
+    values += np.multiply(digits, 10**(offset - 1) * active, dtype='int64')
+    num_digits += active
+
+  if not num_digits.all():
+    raise ValueError('Malformed ranking data: missing id before position '
+                     '{}'.format(ends[np.argmin(num_digits)]))
+
+  return values, ends - num_digits
+
+
+def _ranks_within_rows(lengths):
+  num_positions = int(lengths.sum())
+  return np.arange(num_positions) - np.repeat(
+      np.cumsum(lengths) - lengths, lengths)
+
+
+def _parse_scores(chars, num_users, lengths):
+  # Turning every delimiter into whitespace leaves a flat sequence of
+  # `user item score item score ...` that numpy parses in one call.
+  text = chars.tobytes().translate(_SCORE_SEPARATORS).decode()
+  values = np.fromstring(text, dtype='float64', sep=' ')
+  if len(values) != num_users + 2 * int(lengths.sum()):
+    raise ValueError('Malformed ranking data: unexpected number of scores')
+
+  row_offsets = np.cumsum(1 + 2 * lengths) - 2 * lengths
+  score_indices = (np.repeat(row_offsets, lengths) +
+                   2 * _ranks_within_rows(lengths) + 1)
+  return values[score_indices]
+
+
+def _to_padded_matrix(values, lengths, fill_value, dtype):
+  num_rows = len(lengths)
+  width = int(lengths.max()) if num_rows else 0
+
+  # Every row has the same length in the common case, so the flat values are
+  # already laid out as the matrix. Ragged files are scattered under a mask.
+  if (lengths == width).all():
+    return values.reshape(num_rows, width).astype(dtype)
+
+  matrix = np.full((num_rows, width), fill_value, dtype=dtype)
+  matrix[np.arange(width) < lengths[:, None]] = values
+  return matrix
+
+
+def _parse_rankings(text, with_scores=False, max_depth=None):
+  """Parses the contents of a ranking file in bulk.
+
+  Lines look like `user_id\t{item_id:score,item_id:score,...}`. Ids are read
+  straight from the bytes preceding each tab and colon, so scores are never
+  parsed unless with_scores is set, and positions past max_depth are never
+  parsed at all. Rows shorter than the longest ranking are padded with -1
+  (NaN for the scores). Blanks around ids and scores are ignored.
 
-  position_strings = ranking_string[1:-1].split(',')
-  item_ids_and_scores = (position_string.split(':')
-                         for position_string in position_strings)
-  item_ids = [int(item_id) for item_id, _ in item_ids_and_scores]
+  Returns a (matrix, user_ids, scores) tuple, where scores is None unless
+  with_scores is set.
+  """
+  chars = np.frombuffer(text.encode(), dtype='uint8')
+  is_blank = np.isin(chars, _BLANKS)
+  if is_blank.any():
+    chars = chars[~is_blank]
+  tabs = np.flatnonzero(chars == _TAB)
+  colons = np.flatnonzero(chars == _COLON)
 
-  return int(user_id_string), item_ids
+  user_ids, user_starts = _parse_digits_before(chars, tabs)
+  line_starts = user_starts[user_starts > 0]
+  if (chars[line_starts - 1] != _NEWLINE).any():
+    raise ValueError('Malformed ranking data: bad user id')
 
+  rows = np.searchsorted(tabs, colons) - 1
+  if len(rows) and rows[0] < 0:
+    raise ValueError('Malformed ranking data: position before first user')
+  file_lengths = np.bincount(rows, minlength=len(tabs))
+  num_commas = np.count_nonzero(chars == _COMMA)
+  if num_commas != np.maximum(file_lengths - 1, 0).sum():
+    raise ValueError('Malformed ranking data: position without a score')
+
+  lengths = file_lengths
+  is_kept = None
+  if max_depth is not None and len(colons):
+    is_kept = _ranks_within_rows(file_lengths) < max_depth
+    colons = colons[is_kept]
+    lengths = np.minimum(file_lengths, max_depth)
+
+  item_ids, item_starts = _parse_digits_before(chars, colons)
+  if not np.isin(chars[item_starts - 1], _RANKING_OPENERS).all():
+    raise ValueError('Malformed ranking data: bad item id')
+
+  scores = None
+  if with_scores:
+    flat_scores = _parse_scores(chars, len(tabs), file_lengths)
+    if is_kept is not None:
+      flat_scores = flat_scores[is_kept]
+    scores = _to_padded_matrix(flat_scores, lengths, np.nan, 'float64')
+
+  matrix = _to_padded_matrix(item_ids, lengths, -1, 'int32')
+  return matrix, user_ids, scores
+
+
+RankingSet = collections.namedtuple(
+    'RankingSet', ('id', 'matrix', 'user_ids', 'scores'), defaults=(None,))
 
-RankingSet = collections.namedtuple('RankingSet', ('id', 'matrix', 'user_ids'))
 
+def _read_ranking_file(path, with_scores=False, max_depth=None):
+  with open(path) as f:
+    return _parse_rankings(f.read(), with_scores, max_depth)
+
+
+def yield_ranking_set_paths(dir_path):
+  filenames_and_ids = sorted(
+      _yield_ranking_set_filenames(dir_path), key=lambda f: f[1])
+  for filename, ranking_set_id in filenames_and_ids:
+    yield os.path.join(dir_path, filename), ranking_set_id
 
-def _load_ranking_matrix(path):
-  user_ids = []
-  rankings = []
 
+def iter_ranking_blocks(path,
+                        ranking_set_id,
+                        block_size,
+                        with_scores=False,
+                        max_depth=None):
+  """Yields the rankings in a file as RankingSets of up to block_size users.
+
+  Only one block is parsed and held in memory at a time.
+  """
   with open(path) as f:
-    for line in f:
-      user_id, ranking = _parse_ranking_line(line)
-      user_ids.append(user_id)
-      rankings.append(ranking)
+    while True:
+      lines = list(itertools.islice(f, block_size))
+      if not lines:
+        return
+      matrix, user_ids, scores = _parse_rankings(''.join(lines), with_scores,
+                                                 max_depth)
+      if len(user_ids):
+        yield RankingSet(ranking_set_id, matrix, user_ids, scores)
+
+
+def default_cache_dir(dataset_dir):
+  return os.path.join(dataset_dir, _CACHE_DIRNAME)
+
+
+def _file_signature(path, *options):
+  stat = os.stat(path)
+  return repr((_CACHE_FORMAT_VERSION, os.path.abspath(path), stat.st_size,
+               stat.st_mtime_ns) + options)
+
+
+def _load_cached_arrays(path, key, signature_options, store, read_arrays):
+  if store is None:
+    return read_arrays(path)
+
+  signature = _file_signature(path, *signature_options)
+
+  arrays = store.load(key, signature)
+  if arrays is None:
+    arrays = read_arrays(path)
+    # Handing back the mapped copy lets worker processes return a reference
+    # to the cache entry instead of pickling the arrays.
+    if store.save(key, signature, arrays):
+      arrays = store.load(key, signature)
+
+  return arrays
+
+
+def _read_ranking_arrays(path, with_scores, max_depth):
+  matrix, user_ids, scores = _read_ranking_file(path, with_scores, max_depth)
+  return dict(matrix=matrix, user_ids=user_ids, scores=scores)
+
+
+def _ranking_file_key(path, max_depth):
+  # Each depth gets its own entry, so runs at different cutoffs (e.g. metrics
+  # and oracles) don't keep invalidating each other.
+  key = os.path.basename(path)
+  if max_depth is not None:
+    key += '@{}'.format(max_depth)
+  return key
 
-  max_ranking_length = max(len(ranking) for ranking in rankings)
 
-  rankings_matrix = np.full(
-      (len(rankings), max_ranking_length), -1, dtype='int32')
-  for i, ranking in enumerate(rankings):
-    rankings_matrix[i, :len(ranking)] = ranking
+def _load_ranking_file(path, with_scores, max_depth, store):
+  key = _ranking_file_key(path, max_depth)
+  return _load_cached_arrays(
+      path, key, (with_scores, max_depth), store,
+      functools.partial(
+          _read_ranking_arrays, with_scores=with_scores, max_depth=max_depth))
 
-  return rankings_matrix, user_ids
 
+def _make_store(cache_dir, name):
+  if cache_dir is None:
+    return None
+  return array_store.ArrayStore(os.path.join(cache_dir, name))
 
-def load_ranking_sets(dir_path):
-  ranking_set_by_id = {}
-  for filename, ranking_set_id in _yield_ranking_set_filenames(dir_path):
-    ranking_matrix, user_ids = _load_ranking_matrix(
-        os.path.join(dir_path, filename))
-    ranking_set_by_id[ranking_set_id] = RankingSet(ranking_set_id,
-                                                   ranking_matrix, user_ids)
 
-  sorted_ids_and_ranking_sets = sorted(
-      ranking_set_by_id.items(), key=lambda r: r[0])
+def load_ranking_sets(dir_path,
+                      with_scores=False,
+                      max_depth=None,
+                      cache_dir=None,
+                      num_workers=1):
+  """Loads every ranking file in dir_path, keyed by RankingSetId.
 
-  return collections.OrderedDict(sorted_ids_and_ranking_sets)
+  Only the first max_depth positions of each ranking are loaded, if set.
+  When cache_dir is set, parsed arrays are kept there and memory-mapped back
+  on later calls, as long as the ranking file is unchanged. Files are parsed
+  by num_workers processes (None for one per CPU).
+  """
+  store = _make_store(cache_dir, 'rankings')
+  paths_and_ids = list(yield_ranking_set_paths(dir_path))
+
+  arrays_list = parallel.map_parallel(
+      _load_ranking_file,
+      [(path, with_scores, max_depth, store) for path, _ in paths_and_ids],
+      num_workers)
+
+  ranking_set_by_id = collections.OrderedDict()
+  for (_, ranking_set_id), arrays in zip(paths_and_ids, arrays_list):
+    ranking_set_by_id[ranking_set_id] = RankingSet(
+        ranking_set_id, arrays['matrix'], arrays['user_ids'],
+        arrays.get('scores'))
+
+  return ranking_set_by_id
+
+
+_RATING_COLUMNS = ('user_id', 'item_id', 'rating')
+_RATING_DTYPES = ('int32', 'int32', 'float32')
 
 
 def _load_ratings(path):
-  column_names = ('user_id', 'item_id', 'rating')
+  # Only the first three columns are read, so files with timestamps work too.
   return pd.read_csv(
       path,
-      "\t",
-      names=column_names)
+      sep='\t',
+      header=None,
+      names=_RATING_COLUMNS,
+      usecols=range(len(_RATING_COLUMNS)),
+      dtype=dict(zip(_RATING_COLUMNS, _RATING_DTYPES)))
+
+
+def _load_ratings_with_arrow(path):
+  generated_names = ['f{}'.format(i) for i in range(len(_RATING_COLUMNS))]
+  table = pyarrow_csv.read_csv(
+      path,
+      read_options=pyarrow_csv.ReadOptions(autogenerate_column_names=True),
+      parse_options=pyarrow_csv.ParseOptions(delimiter='\t'),
+      convert_options=pyarrow_csv.ConvertOptions(
+          include_columns=generated_names,
+          column_types=dict(zip(generated_names, _RATING_DTYPES))))
+  return {
+      column: table.column(generated_name).to_numpy()
+      for column, generated_name in zip(_RATING_COLUMNS, generated_names)
+  }
+
+
+def _read_rating_arrays(path):
+  start = time.perf_counter()
+  # pyarrow's reader is multithreaded, but chokes on empty files.
+  if pyarrow_csv is not None and os.path.getsize(path):
+    engine = 'pyarrow'
+    arrays = _load_ratings_with_arrow(path)
+  else:
+    engine = 'pandas'
+    frame = _load_ratings(path)
+    arrays = {column: frame[column].values for column in _RATING_COLUMNS}
+
+  elapsed = time.perf_counter() - start
+  num_ratings = len(arrays['user_id'])
+  logging.info('Read %d ratings from %s with %s in %.2fs (%.0f rows/s)',
+               num_ratings, path, engine, elapsed,
+               num_ratings / max(elapsed, 1e-9))
+  return arrays
+
+
+def _load_rating_file(path, store):
+  return _load_cached_arrays(path, os.path.basename(path), (), store,
+                             _read_rating_arrays)
+
+
+class CsrIndex(object):
+  """Maps each key to the sorted array of values it appears with.
+
+  Keys are kept sorted with each key's values stored contiguously, so
+  looking a key up is a binary search (or a plain index, when the keys are
+  dense) followed by a slice.
+  """
+
+  def __init__(self, keys, indptr, values, num_keys=None):
+    self.keys = keys
+    self.indptr = indptr
+    self.values = values
+    self._dense_keys = bool(
+        len(keys) == 0 or (keys[0] == 0 and keys[-1] == len(keys) - 1))
+
+    # Keys drawn from a known range (e.g. interned ids) get a direct lookup
+    # table, even when some of them are missing from this index.
+    self._position_by_key = None
+    if num_keys is not None and not self._dense_keys:
+      self._position_by_key = np.full(num_keys, -1, dtype='int64')
+      self._position_by_key[keys] = np.arange(len(keys))
+
+    # Built on the first call to contains.
+    self._codes = None
+
+  @classmethod
+  def build(cls, keys, values, num_keys=None):
+    """Builds an index of the distinct values of each key.
+
+    Repeated (key, value) pairs, like duplicate ratings, are kept once, so
+    each key's values are a set.
+    """
+    order = np.lexsort((values, keys))
+    sorted_keys = keys[order]
+    sorted_values = values[order]
+    distinct = np.ones(len(order), dtype=bool)
+    distinct[1:] = ((sorted_keys[1:] != sorted_keys[:-1]) |
+                    (sorted_values[1:] != sorted_values[:-1]))
+    sorted_keys = sorted_keys[distinct]
+    unique_keys, starts = np.unique(sorted_keys, return_index=True)
+    indptr = np.append(starts, len(sorted_keys))
+    return cls(unique_keys, indptr, sorted_values[distinct], num_keys)
+
+  def __len__(self):
+    return len(self.keys)
+
+  def position(self, key):
+    if self._dense_keys:
+      return key if 0 <= key < len(self.keys) else None
+    if self._position_by_key is not None:
+      if not 0 <= key < len(self._position_by_key):
+        return None
+      position = self._position_by_key[key]
+      return position if position >= 0 else None
+    position = np.searchsorted(self.keys, key)
+    if position < len(self.keys) and self.keys[position] == key:
+      return position
+    return None
+
+  def positions(self, keys):
+    """Returns the position of each key, or -1 for missing keys."""
+    keys = np.asarray(keys, dtype='int64')
+    if self._dense_keys:
+      return np.where((keys >= 0) & (keys < len(self.keys)), keys, -1)
+    if self._position_by_key is not None:
+      in_range = (keys >= 0) & (keys < len(self._position_by_key))
+      return np.where(in_range,
+                      self._position_by_key[np.where(in_range, keys, 0)], -1)
+    positions = np.searchsorted(self.keys, keys)
+    found = positions < len(self.keys)
+    found[found] = self.keys[positions[found]] == keys[found]
+    return np.where(found, positions, -1)
+
+  def _pair_codes(self, positions, values):
+    # Codes sort like (position, value) pairs, so the codes of the index,
+    # whose values are sorted within each key, are sorted too.
+    return positions * self._value_span + (values - self._min_value)
+
+  def contains(self, positions, values):
+    """Returns whether each value appears with the key at each position.
+
+    positions (e.g. from positions(), where -1 matches nothing) and values
+    are broadcast against each other.
+    """
+    positions, values = np.broadcast_arrays(
+        np.asarray(positions, dtype='int64'), np.asarray(values,
+                                                         dtype='int64'))
+    if not len(self.values):
+      return np.zeros(positions.shape, dtype=bool)
+    if self._codes is None:
+      self._min_value = int(self.values.min())
+      self._value_span = int(self.values.max()) - self._min_value + 1
+      self._codes = self._pair_codes(
+          np.repeat(np.arange(len(self.keys)), self.lengths()),
+          self.values.astype('int64'))
+
+    candidates = ((positions >= 0) & (values >= self._min_value) &
+                  (values < self._min_value + self._value_span))
+    codes = self._pair_codes(positions[candidates], values[candidates])
+    found = np.searchsorted(self._codes, codes)
+    found = np.minimum(found, len(self._codes) - 1)
+    contained = np.zeros(positions.shape, dtype=bool)
+    contained[candidates] = self._codes[found] == codes
+    return contained
+
+  def get(self, key, default=None):
+    position = self.position(key)
+    if position is None:
+      return default
+    return self.values[self.indptr[position]:self.indptr[position + 1]]
+
+  def lengths(self):
+    return np.diff(self.indptr)
+
+  def items(self):
+    for position, key in enumerate(self.keys):
+      yield key, self.values[self.indptr[position]:self.indptr[position + 1]]
+
+
+class RatingSplit(object):
+  """The ratings of one split, stored as parallel columns."""
+
+  def __init__(self, user_ids, item_ids, ratings, num_users=None,
+               num_items=None):
+    self.user_ids = np.asarray(user_ids, dtype='int32')
+    self.item_ids = np.asarray(item_ids, dtype='int32')
+    self.ratings = np.asarray(ratings, dtype='float32')
+    # Sizes of the id spaces, when the ids are interned.
+    self.num_users = num_users
+    self.num_items = num_items
+    self._by_user = None
+    self._by_item = None
+
+  @classmethod
+  def from_frame(cls, frame):
+    return cls(frame.user_id.values, frame.item_id.values, frame.rating.values)
+
+  @classmethod
+  def concatenate(cls, splits):
+    return cls(
+        np.concatenate([split.user_ids for split in splits]),
+        np.concatenate([split.item_ids for split in splits]),
+        np.concatenate([split.ratings for split in splits]),
+        splits[0].num_users if splits else None,
+        splits[0].num_items if splits else None)
+
+  def __len__(self):
+    return len(self.user_ids)
+
+  def to_frame(self):
+    return pd.DataFrame(
+        {
+            'user_id': self.user_ids,
+            'item_id': self.item_ids,
+            'rating': self.ratings
+        },
+        columns=_RATING_COLUMNS)
+
+  @property
+  def by_user(self):
+    """A CsrIndex of the items rated by each user."""
+    if self._by_user is None:
+      self._by_user = CsrIndex.build(self.user_ids, self.item_ids,
+                                     self.num_users)
+    return self._by_user
+
+  @property
+  def by_item(self):
+    """A CsrIndex of the users who rated each item."""
+    if self._by_item is None:
+      self._by_item = CsrIndex.build(self.item_ids, self.user_ids,
+                                     self.num_items)
+    return self._by_item
+
+
+_SPLIT_NAMES = ('base', 'test', 'validation')
 
 
 class RatingSet(object):
@@ -91,18 +528,34 @@ class RatingSet(object):
   def __init__(self, fold):
     self.fold = fold
 
+  def __setattr__(self, name, value):
+    # Splits may still be assigned as DataFrames (e.g. in notebooks).
+    if name in _SPLIT_NAMES and isinstance(value, pd.DataFrame):
+      value = RatingSplit.from_frame(value)
+    super().__setattr__(name, value)
+
+  def splits(self):
+    return [
+        getattr(self, name) for name in _SPLIT_NAMES if hasattr(self, name)
+    ]
+
   def all_ratings(self):
-    frame = self.base.append(self.test, ignore_index=True)
-    if hasattr(self, 'validation'):
-      frame = frame.append(self.validation, ignore_index=True)
+    return RatingSplit.concatenate(self.splits())
+
 
-    return frame
+def load_ratings_for_all_folds(dir_path, cache_dir=None, num_workers=1):
+  store = _make_store(cache_dir, 'ratings')
+  filenames_folds_and_splits = list(_yield_rating_set_filenames(dir_path))
 
+  arrays_list = parallel.map_parallel(
+      _load_rating_file,
+      [(os.path.join(dir_path, filename), store)
+       for filename, _, _ in filenames_folds_and_splits], num_workers)
 
-def load_ratings_for_all_folds(dir_path):
   rating_set_by_fold = {}
-  for filename, fold, split in _yield_rating_set_filenames(dir_path):
-    ratings = _load_ratings(os.path.join(dir_path, filename))
+  for (_, fold, split), arrays in zip(filenames_folds_and_splits, arrays_list):
+    ratings = RatingSplit(arrays['user_id'], arrays['item_id'],
+                          arrays['rating'])
     rating_set = rating_set_by_fold.get(fold)
     if rating_set is None:
       rating_set = RatingSet(fold)
@@ -112,20 +565,284 @@ def load_ratings_for_all_folds(dir_path):
   return collections.OrderedDict(sorted(rating_set_by_fold.items()))
 
 
-OutputMethod = collections.namedtuple('OutputMethod', ('extension', 'function'))
+class IdVocabulary(object):
+  """Maps raw ids to dense indices in [0, n), in increasing raw id order.
+
+  Negative raw ids (ranking padding) and unknown ids map to -1, and -1 maps
+  back to -1.
+  """
+
+  def __init__(self, raw_ids):
+    self.raw_ids = np.asarray(raw_ids, dtype='int64')
+
+  @classmethod
+  def build(cls, id_arrays):
+    unique_arrays = [np.unique(ids) for ids in id_arrays]
+    raw_ids = np.unique(np.concatenate(unique_arrays or [[]]).astype('int64'))
+    return cls(raw_ids[raw_ids >= 0])
+
+  def __len__(self):
+    return len(self.raw_ids)
+
+  def to_dense(self, raw_ids):
+    raw_ids = np.asarray(raw_ids)
+    if not len(self.raw_ids):
+      return np.full(raw_ids.shape, -1, dtype='int32')
+    positions = np.searchsorted(self.raw_ids, raw_ids)
+    is_known = self.raw_ids.take(positions, mode='clip') == raw_ids
+    return np.where(is_known, positions, -1).astype('int32')
 
+  def to_raw(self, dense_ids):
+    dense_ids = np.asarray(dense_ids).astype('int64')
+    if not len(self.raw_ids):
+      return np.full(dense_ids.shape, -1, dtype='int64')
+    is_known = (dense_ids >= 0) & (dense_ids < len(self.raw_ids))
+    return np.where(is_known, self.raw_ids.take(dense_ids, mode='clip'), -1)
 
-def save_results_frame(results_frame, output_dir):
-  logging.info(results_frame)
-  logging.info('Saving the results frame to the output directory')
 
-  output_methods = [
-      OutputMethod('csv', results_frame.to_csv),
-      OutputMethod('html', results_frame.to_html),
-      OutputMethod('tex', results_frame.to_latex),
+def build_vocabularies(rating_set_by_fold, ranking_set_by_id=None):
+  """Builds the user and item vocabularies of a whole dataset.
+
+  Every fold shares the same vocabularies, so the same raw id has the same
+  index everywhere.
+  """
+  ranking_sets = list((ranking_set_by_id or {}).values())
+  splits = [
+      split for rating_set in rating_set_by_fold.values()
+      for split in rating_set.splits()
   ]
 
-  for extension, function in output_methods:
-    output_path = os.path.join(output_dir, 'output.{}'.format(extension))
+  user_vocabulary = IdVocabulary.build(
+      [split.user_ids for split in splits] +
+      [ranking_set.user_ids for ranking_set in ranking_sets])
+  item_vocabulary = IdVocabulary.build(
+      [split.item_ids for split in splits] +
+      [ranking_set.matrix for ranking_set in ranking_sets])
+
+  return user_vocabulary, item_vocabulary
+
+
+def intern_ranking_set(ranking_set, user_vocabulary, item_vocabulary):
+  return ranking_set._replace(
+      matrix=item_vocabulary.to_dense(ranking_set.matrix),
+      user_ids=user_vocabulary.to_dense(ranking_set.user_ids))
+
+
+def intern_rating_set(rating_set, user_vocabulary, item_vocabulary):
+  interned = RatingSet(rating_set.fold)
+  for name in _SPLIT_NAMES:
+    if hasattr(rating_set, name):
+      split = getattr(rating_set, name)
+      setattr(interned, name,
+              RatingSplit(
+                  user_vocabulary.to_dense(split.user_ids),
+                  item_vocabulary.to_dense(split.item_ids), split.ratings,
+                  len(user_vocabulary), len(item_vocabulary)))
+  return interned
+
+
+Dataset = collections.namedtuple('Dataset', (
+    'ranking_set_by_id', 'rating_set_by_fold', 'user_vocabulary',
+    'item_vocabulary'))
+
+
+def _dataset_signature(dir_path, max_depth):
+  """Identifies the contents of every ranking and rating file in dir_path."""
+  paths = [path for path, _ in yield_ranking_set_paths(dir_path)]
+  paths += [
+      os.path.join(dir_path, filename)
+      for filename, _, _ in _yield_rating_set_filenames(dir_path)
+  ]
+  return repr([_file_signature(path, max_depth) for path in sorted(paths)])
+
+
+def _load_vocabularies(store, signature, rating_set_by_fold,
+                       ranking_set_by_id):
+  if store is not None:
+    arrays = store.load('vocabularies', signature)
+    if arrays is not None:
+      return (IdVocabulary(arrays['user_raw_ids']),
+              IdVocabulary(arrays['item_raw_ids']))
+
+  user_vocabulary, item_vocabulary = build_vocabularies(
+      rating_set_by_fold, ranking_set_by_id)
+  if store is not None:
+    store.save(
+        'vocabularies', signature,
+        dict(
+            user_raw_ids=user_vocabulary.raw_ids,
+            item_raw_ids=item_vocabulary.raw_ids))
+  return user_vocabulary, item_vocabulary
+
+
+def _load_interned_ranking_set(ranking_set, key, signature, store,
+                               user_vocabulary, item_vocabulary):
+  """Returns ranking_set interned, mapped from store once it is cached."""
+  if store is None:
+    return intern_ranking_set(ranking_set, user_vocabulary, item_vocabulary)
+
+  arrays = store.load(key, signature)
+  if arrays is None:
+    interned = intern_ranking_set(ranking_set, user_vocabulary,
+                                  item_vocabulary)
+    arrays = dict(
+        matrix=interned.matrix,
+        user_ids=interned.user_ids,
+        scores=interned.scores)
+    if not store.save(key, signature, arrays):
+      return interned
+    arrays = store.load(key, signature)
+
+  return RankingSet(ranking_set.id, arrays['matrix'], arrays['user_ids'],
+                    arrays.get('scores'))
+
+
+def load_dataset(dir_path, max_depth=None, cache_dir=None, num_workers=1):
+  """Loads all rankings and ratings in dir_path with interned ids.
+
+  Users and items are remapped to dense int32 indices shared by every fold;
+  the returned vocabularies map them back to the raw ids. With a cache_dir,
+  the vocabularies and interned rankings are cached too, so later runs map
+  the interned matrices instead of copying them.
+  """
+  ranking_set_by_id = load_ranking_sets(
+      dir_path,
+      max_depth=max_depth,
+      cache_dir=cache_dir,
+      num_workers=num_workers)
+  rating_set_by_fold = load_ratings_for_all_folds(
+      dir_path, cache_dir=cache_dir, num_workers=num_workers)
+
+  store = _make_store(cache_dir, 'interned')
+  signature = (_dataset_signature(dir_path, max_depth)
+               if store is not None else None)
+  user_vocabulary, item_vocabulary = _load_vocabularies(
+      store, signature, rating_set_by_fold, ranking_set_by_id)
+  logging.info('Interned %d users and %d items', len(user_vocabulary),
+               len(item_vocabulary))
+
+  key_by_id = {
+      ranking_set_id: _ranking_file_key(path, max_depth)
+      for path, ranking_set_id in yield_ranking_set_paths(dir_path)
+  }
+  return Dataset(
+      collections.OrderedDict(
+          (ranking_set_id,
+           _load_interned_ranking_set(ranking_set, key_by_id[ranking_set_id],
+                                      signature, store, user_vocabulary,
+                                      item_vocabulary))
+          for ranking_set_id, ranking_set in ranking_set_by_id.items()),
+      collections.OrderedDict(
+          (fold,
+           intern_rating_set(rating_set, user_vocabulary, item_vocabulary))
+          for fold, rating_set in rating_set_by_fold.items()),
+      user_vocabulary, item_vocabulary)
+
+
+_HASH_CHUNK_BYTES = 1 << 20
+
+
+def _hash_file(path):
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(functools.partial(f.read, _HASH_CHUNK_BYTES), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+DatasetHashes = collections.namedtuple(
+    'DatasetHashes', ('ranking_hash_by_id', 'ratings_hash_by_fold'))
+
+
+def hash_dataset_files(dir_path, num_workers=1):
+  """Returns content hashes of each ranking file and of each fold's ratings.
+
+  The hash of a fold covers all of its rating files, so it changes with any
+  of its splits. Files are hashed by num_workers processes (None for one per
+  CPU).
+  """
+  ranking_paths_and_ids = list(yield_ranking_set_paths(dir_path))
+  rating_filenames = sorted(_yield_rating_set_filenames(dir_path))
+  paths = ([path for path, _ in ranking_paths_and_ids] + [
+      os.path.join(dir_path, filename) for filename, _, _ in rating_filenames
+  ])
+  hashes = parallel.map_parallel(_hash_file, [(path,) for path in paths],
+                                 num_workers)
+
+  ranking_hash_by_id = collections.OrderedDict(
+      (ranking_set_id, file_hash) for (_, ranking_set_id), file_hash in zip(
+          ranking_paths_and_ids, hashes))
+
+  digest_by_fold = {}
+  for (_, fold, split), file_hash in zip(rating_filenames,
+                                         hashes[len(ranking_paths_and_ids):]):
+    digest = digest_by_fold.setdefault(fold, hashlib.sha256())
+    digest.update('{}:{};'.format(split, file_hash).encode())
+  ratings_hash_by_fold = collections.OrderedDict(
+      (fold, digest.hexdigest())
+      for fold, digest in sorted(digest_by_fold.items()))
+
+  return DatasetHashes(ranking_hash_by_id, ratings_hash_by_fold)
+
+
+OutputMethod = collections.namedtuple('OutputMethod', ('extension', 'function'))
+
+RESULT_FORMATS = ('parquet', 'feather', 'csv', 'html', 'tex')
+
+# Columnar formats need pyarrow; without it, results fall back to CSV.
+DEFAULT_RESULT_FORMATS = (('parquet', 'csv')
+                          if pyarrow_csv is not None else ('csv',))
+
+
+def _get_output_method(results_frame, result_format):
+  # Columnar writers need a default index, which pd.concat doesn't leave.
+  columnar_frame = results_frame.reset_index(drop=True)
+  output_method_by_format = {
+      'parquet': OutputMethod('parquet', columnar_frame.to_parquet),
+      'feather': OutputMethod('feather', columnar_frame.to_feather),
+      'csv': OutputMethod('csv', results_frame.to_csv),
+      'html': OutputMethod('html', results_frame.to_html),
+      'tex': OutputMethod('tex', results_frame.to_latex),
+  }
+  return output_method_by_format[result_format]
+
+
+def save_results_frame(results_frame,
+                       output_dir,
+                       result_formats=None,
+                       name='output'):
+  """Writes the results as <name>.<extension> files in output_dir.
+
+  result_formats -- Any of RESULT_FORMATS. Defaults to
+      DEFAULT_RESULT_FORMATS; HTML and LaTeX are only written on request.
+  """
+  logging.info('Saving %d results to the output directory', len(results_frame))
+  logging.debug(results_frame)
+
+  for result_format in result_formats or DEFAULT_RESULT_FORMATS:
+    extension, function = _get_output_method(results_frame, result_format)
+    output_path = os.path.join(output_dir, '{}.{}'.format(name, extension))
     logging.info('Outputting to %s', output_path)
     function(output_path)
+
+
+def load_results_frame(path, name='output'):
+  """Loads a results frame written by save_results_frame.
+
+  path -- Either a results file or an output directory, in which case the
+      fastest format available in it for name is read.
+  """
+  if os.path.isdir(path):
+    for extension in ('parquet', 'feather', 'csv'):
+      candidate_path = os.path.join(path, '{}.{}'.format(name, extension))
+      if os.path.exists(candidate_path):
+        path = candidate_path
+        break
+    else:
+      raise FileNotFoundError('No results file in {}'.format(path))
+
+  if path.endswith('.parquet'):
+    return pd.read_parquet(path)
+  if path.endswith('.feather'):
+    return pd.read_feather(path)
+  return pd.read_csv(path, index_col=0)
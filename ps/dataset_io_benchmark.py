@@ -0,0 +1,100 @@
+"""Benchmarks the bulk ranking parser against line-by-line parsing.
+
+Usage: python -m ps.dataset_io_benchmark [--users N] [--length K]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ps import dataset_io
+
+
+def _parse_ranking_line(line):
+  user_id_string, ranking_string = line.split('\t')
+
+  position_strings = ranking_string.strip()[1:-1].split(',')
+  item_ids_and_scores = (position_string.split(':')
+                         for position_string in position_strings)
+  item_ids = [int(item_id) for item_id, _ in item_ids_and_scores]
+
+  return int(user_id_string), item_ids
+
+
+def _parse_rankings_line_by_line(text):
+  user_ids = []
+  rankings = []
+  for line in text.splitlines():
+    user_id, ranking = _parse_ranking_line(line)
+    user_ids.append(user_id)
+    rankings.append(ranking)
+
+  max_ranking_length = max(len(ranking) for ranking in rankings)
+
+  rankings_matrix = np.full(
+      (len(rankings), max_ranking_length), -1, dtype='int32')
+  for i, ranking in enumerate(rankings):
+    rankings_matrix[i, :len(ranking)] = ranking
+
+  return rankings_matrix, user_ids
+
+
+def _make_ranking_text(num_users, ranking_length, num_items, seed=0):
+  random = np.random.RandomState(seed)
+  lines = []
+  for user_id in range(1, num_users + 1):
+    item_ids = random.choice(num_items, ranking_length, replace=False)
+    scores = np.sort(random.rand(ranking_length))[::-1]
+    positions = ','.join('{}:{!r}'.format(item_id, float(score))
+                         for item_id, score in zip(item_ids, scores))
+    lines.append('{}\t{{{}}}'.format(user_id, positions))
+  return '\n'.join(lines) + '\n'
+
+
+def _best_time(function, repeat):
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def parse_args():
+  p = argparse.ArgumentParser(description='Benchmark ranking file parsing')
+  p.add_argument('--users', type=int, default=100000)
+  p.add_argument('--length', type=int, default=100)
+  p.add_argument('--items', type=int, default=20000)
+  p.add_argument('--max-depth', type=int, default=10)
+  p.add_argument('--repeat', type=int, default=3)
+  return p.parse_args()
+
+
+def main():
+  args = parse_args()
+  text = _make_ranking_text(args.users, args.length, args.items)
+
+  line_matrix, _ = _parse_rankings_line_by_line(text)
+  bulk_matrix, _, _ = dataset_io._parse_rankings(text)
+  assert (line_matrix == bulk_matrix).all()
+
+  timings = [
+      ('line-by-line', lambda: _parse_rankings_line_by_line(text)),
+      ('bulk', lambda: dataset_io._parse_rankings(text)),
+      ('bulk@{}'.format(args.max_depth),
+       lambda: dataset_io._parse_rankings(text, max_depth=args.max_depth)),
+      ('bulk+scores',
+       lambda: dataset_io._parse_rankings(text, with_scores=True)),
+  ]
+
+  print(f'{args.users} users x {args.length} positions '
+        f'({len(text) / 2**20:.1f} MiB)')
+  baseline = None
+  for name, function in timings:
+    seconds = _best_time(function, args.repeat)
+    baseline = baseline or seconds
+    print(f'{name:>14}: {seconds:8.3f}s  ({baseline / seconds:5.1f}x)')
+
+
+if __name__ == '__main__':
+  main()
@@ -1,9 +1,11 @@
 import io
 import os
+import tempfile
 import unittest
 from unittest import mock
 
 import numpy as np
+import pandas as pd
 
 from ps import dataset_io
 
@@ -39,8 +41,199 @@ class LoadRatingsTest(unittest.TestCase):
     self.assertTrue((frame.item_id == [2, 5]).all())
     self.assertTrue((frame.rating == [3, 6]).all())
 
+  def test_uses_compact_dtypes(self):
+    frame = dataset_io._load_ratings(io.StringIO('1\t2\t3.5\n'))
 
-class LoadRankingMatrixTest(unittest.TestCase):
+    self.assertEqual(['int32', 'int32', 'float32'],
+                     [str(dtype) for dtype in frame.dtypes])
+
+  def test_ignores_extra_columns(self):
+    frame = dataset_io._load_ratings(io.StringIO('1\t2\t3\t881250949\n'))
+
+    self.assertEqual([[1, 2, 3]], frame.values.tolist())
+
+
+class ReadRatingArraysTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.temp_dir.name, 'u1.base')
+    with open(self.path, 'w') as f:
+      f.write('1\t2\t3.5\t881250949\n4\t5\t1\t881250950\n')
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+    super().tearDown()
+
+  def _assert_arrays(self, arrays):
+    self.assertEqual([1, 4], arrays['user_id'].tolist())
+    self.assertEqual([2, 5], arrays['item_id'].tolist())
+    self.assertEqual([3.5, 1], arrays['rating'].tolist())
+    self.assertEqual(['int32', 'int32', 'float32'],
+                     [str(arrays[column].dtype) for column in
+                      ('user_id', 'item_id', 'rating')])
+
+  def test_reads_with_pandas(self):
+    with mock.patch.object(dataset_io, 'pyarrow_csv', None):
+      self._assert_arrays(dataset_io._read_rating_arrays(self.path))
+
+  @unittest.skipIf(dataset_io.pyarrow_csv is None, 'pyarrow not installed')
+  def test_reads_with_arrow(self):
+    self._assert_arrays(dataset_io._read_rating_arrays(self.path))
+
+  def test_reads_empty_file(self):
+    open(self.path, 'w').close()
+
+    arrays = dataset_io._read_rating_arrays(self.path)
+
+    self.assertEqual(0, len(arrays['user_id']))
+
+
+class CsrIndexTest(unittest.TestCase):
+
+  def test_groups_sorted_values_by_key(self):
+    index = dataset_io.CsrIndex.build(
+        np.array([7, 3, 7, 3, 9]), np.array([1, 5, 0, 2, 4]))
+
+    self.assertEqual([3, 7, 9], index.keys.tolist())
+    self.assertEqual([2, 2, 1], index.lengths().tolist())
+    self.assertEqual([2, 5], index.get(3).tolist())
+    self.assertEqual([0, 1], index.get(7).tolist())
+    self.assertEqual({3: [2, 5], 7: [0, 1], 9: [4]},
+                     {key: values.tolist() for key, values in index.items()})
+
+  def test_keeps_repeated_pairs_once(self):
+    index = dataset_io.CsrIndex.build(
+        np.array([7, 3, 7, 7, 3]), np.array([1, 5, 1, 0, 5]))
+
+    self.assertEqual([1, 2], index.lengths().tolist())
+    self.assertEqual([0, 1], index.get(7).tolist())
+    self.assertEqual([5], index.get(3).tolist())
+
+  def test_get_missing_key(self):
+    index = dataset_io.CsrIndex.build(np.array([3]), np.array([1]))
+
+    self.assertIsNone(index.get(4))
+    self.assertIsNone(index.get(-1))
+    self.assertEqual((), index.get(4, ()))
+
+  def test_dense_keys(self):
+    index = dataset_io.CsrIndex.build(np.array([1, 0, 2]), np.array([5, 6, 7]))
+
+    self.assertEqual([6], index.get(0).tolist())
+    self.assertEqual([7], index.get(2).tolist())
+    self.assertIsNone(index.get(3))
+    self.assertIsNone(index.get(-1))
+
+  def test_empty(self):
+    index = dataset_io.CsrIndex.build(
+        np.array([], dtype='int32'), np.array([], dtype='int32'))
+
+    self.assertEqual(0, len(index))
+    self.assertIsNone(index.get(0))
+    self.assertEqual([False], index.contains([0], [0]).tolist())
+
+  def test_positions_of_many_keys(self):
+    keys = np.array([7, 3, 7, 3, 9])
+    values = np.array([1, 5, 0, 2, 4])
+    for num_keys in [None, 10]:
+      index = dataset_io.CsrIndex.build(keys, values, num_keys=num_keys)
+
+      self.assertEqual([1, -1, 0, 2, -1, -1],
+                       index.positions([7, 4, 3, 9, -1, 12]).tolist())
+
+  def test_contains(self):
+    index = dataset_io.CsrIndex.build(
+        np.array([7, 3, 7, 3, 9]), np.array([1, 5, 0, 2, 4]))
+    positions = index.positions([3, 7, 8])
+
+    contained = index.contains(positions[:, None], [[0, 2, 5, 4, -1, 10]])
+
+    self.assertEqual([[False, True, True, False, False, False],
+                      [True, False, False, False, False, False],
+                      [False, False, False, False, False, False]],
+                     contained.tolist())
+
+
+class RatingSetTest(unittest.TestCase):
+
+  def test_converts_frames_to_splits(self):
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[(1, 2, 5), (1, 3, 4)])
+
+    self.assertIsInstance(rating_set.base, dataset_io.RatingSplit)
+    self.assertEqual('int32', rating_set.base.user_ids.dtype)
+    self.assertEqual([2, 3], rating_set.base.by_user.get(1).tolist())
+    self.assertEqual([1], rating_set.base.by_item.get(3).tolist())
+    self.assertEqual([5, 4], rating_set.base.to_frame().rating.tolist())
+
+  def test_all_ratings(self):
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = dataset_io.RatingSplit([1], [2], [5])
+    rating_set.test = dataset_io.RatingSplit([3], [4], [5])
+    rating_set.validation = dataset_io.RatingSplit([5], [6], [5])
+
+    all_ratings = rating_set.all_ratings()
+
+    self.assertEqual([1, 3, 5], all_ratings.user_ids.tolist())
+    self.assertEqual([2, 4, 6], all_ratings.item_ids.tolist())
+
+  def test_all_ratings_without_validation(self):
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = dataset_io.RatingSplit([1], [2], [5])
+    rating_set.test = dataset_io.RatingSplit([3], [4], [5])
+
+    self.assertEqual(2, len(rating_set.all_ratings()))
+
+
+class IdVocabularyTest(unittest.TestCase):
+
+  def test_round_trip(self):
+    vocabulary = dataset_io.IdVocabulary.build(
+        [np.array([40, 10]), np.array([[30, -1], [10, 20]])])
+
+    self.assertEqual(4, len(vocabulary))
+    dense = vocabulary.to_dense(np.array([[30, -1], [10, 20]]))
+    self.assertEqual([[2, -1], [0, 1]], dense.tolist())
+    self.assertEqual('int32', dense.dtype)
+    self.assertEqual([[30, -1], [10, 20]], vocabulary.to_raw(dense).tolist())
+
+  def test_unknown_ids(self):
+    vocabulary = dataset_io.IdVocabulary.build([np.array([10, 20])])
+
+    self.assertEqual([-1, -1, 1], vocabulary.to_dense([5, 50, 20]).tolist())
+    self.assertEqual([-1, 20], vocabulary.to_raw([7, 1]).tolist())
+
+  def test_empty(self):
+    vocabulary = dataset_io.IdVocabulary.build([])
+
+    self.assertEqual([-1], vocabulary.to_dense([3]).tolist())
+    self.assertEqual([-1], vocabulary.to_raw([0]).tolist())
+
+
+class InternRatingSetTest(unittest.TestCase):
+
+  def test_interns_splits(self):
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = dataset_io.RatingSplit([7, 9], [100, 300], [5, 4])
+    rating_set.test = dataset_io.RatingSplit([9], [200], [3])
+    user_vocabulary, item_vocabulary = dataset_io.build_vocabularies(
+        {'u1': rating_set})
+
+    interned = dataset_io.intern_rating_set(rating_set, user_vocabulary,
+                                            item_vocabulary)
+
+    self.assertEqual([0, 1], interned.base.user_ids.tolist())
+    self.assertEqual([0, 2], interned.base.item_ids.tolist())
+    self.assertEqual([1], interned.test.item_ids.tolist())
+    self.assertFalse(hasattr(interned, 'validation'))
+    self.assertIsNone(interned.test.by_user.get(0))
+    self.assertEqual([1], interned.test.by_user.get(1).tolist())
+
+
+class ReadRankingFileTest(unittest.TestCase):
 
   def test_load_matrix(self):
     file_contents = """1\t{2:0.63762,3:341.32871e-23}
@@ -50,11 +243,15 @@ class LoadRankingMatrixTest(unittest.TestCase):
     with mock.patch(
         'ps.dataset_io.open',
         return_value=io.StringIO(file_contents)) as mock_open:
-      rankings_matrix, user_ids = dataset_io._load_ranking_matrix('rankings.out')
+      rankings_matrix, user_ids, _ = dataset_io._read_ranking_file(
+          'rankings.out')
+
+    mock_open.assert_called_once_with('rankings.out')
 
     expected_matrix = np.array([[2, 3], [5, 6]], dtype='int32')
 
     self.assertTrue((expected_matrix == rankings_matrix).all())
+    self.assertEqual([1, 4], user_ids.tolist())
 
   def test_load_different_length_rankings(self):
     file_contents = """1\t{2:0.63762}
@@ -64,11 +261,355 @@ class LoadRankingMatrixTest(unittest.TestCase):
     with mock.patch(
         'ps.dataset_io.open',
         return_value=io.StringIO(file_contents)) as mock_open:
-      rankings_matrix, user_ids = dataset_io._load_ranking_matrix('rankings.out')
+      rankings_matrix, user_ids, _ = dataset_io._read_ranking_file(
+          'rankings.out')
+
+    mock_open.assert_called_once_with('rankings.out')
 
     expected_matrix = np.array([[2, -1], [5, 6]], dtype='int32')
 
     self.assertTrue((expected_matrix == rankings_matrix).all())
+    self.assertEqual([1, 4], user_ids.tolist())
+
+
+class ParseRankingsTest(unittest.TestCase):
+
+  def test_parses_user_ids_and_scores(self):
+    text = """7\t{2:0.5,3:-1.5e-3}
+9\t{5:4.25,6:1}
+"""
+    matrix, user_ids, scores = dataset_io._parse_rankings(
+        text, with_scores=True)
+
+    self.assertEqual([[2, 3], [5, 6]], matrix.tolist())
+    self.assertEqual([7, 9], user_ids.tolist())
+    np.testing.assert_allclose([[0.5, -1.5e-3], [4.25, 1.]], scores)
+
+  def test_skips_scores_by_default(self):
+    _, _, scores = dataset_io._parse_rankings('1\t{2:0.5}\n')
+
+    self.assertIsNone(scores)
+
+  def test_pads_ragged_rows(self):
+    text = """1\t{}
+2\t{4:0.5,5:0.25,6:0.1}
+3\t{7:1.0}
+"""
+    matrix, _, scores = dataset_io._parse_rankings(text, with_scores=True)
+
+    self.assertEqual([[-1, -1, -1], [4, 5, 6], [7, -1, -1]], matrix.tolist())
+    self.assertTrue(np.isnan(scores[0]).all())
+    self.assertTrue(np.isnan(scores[2, 1:]).all())
+
+  def test_parses_square_brackets(self):
+    matrix, _, _ = dataset_io._parse_rankings('1\t[3:2.0,4:1.0]\n')
+
+    self.assertEqual([[3, 4]], matrix.tolist())
+
+  def test_ignores_blanks_around_ids(self):
+    text = ' 1 \t[10:0.5, 20 :0.25 ]\r\n2\t{ 30:1.0}\n'
+    matrix, user_ids, scores = dataset_io._parse_rankings(
+        text, with_scores=True)
+
+    self.assertEqual([[10, 20], [30, -1]], matrix.tolist())
+    self.assertEqual([1, 2], user_ids.tolist())
+    np.testing.assert_equal([[0.5, 0.25], [1.0, np.nan]], scores)
+
+  def test_empty_file(self):
+    matrix, user_ids, _ = dataset_io._parse_rankings('')
+
+    self.assertEqual((0, 0), matrix.shape)
+    self.assertEqual(0, len(user_ids))
+
+  def test_truncates_to_max_depth(self):
+    text = """1\t{2:0.5,3:0.25,4:0.125}
+5\t{6:1.0}
+7\t{}
+"""
+    matrix, _, scores = dataset_io._parse_rankings(
+        text, with_scores=True, max_depth=2)
+
+    self.assertEqual([[2, 3], [6, -1], [-1, -1]], matrix.tolist())
+    np.testing.assert_equal([[0.5, 0.25], [1.0, np.nan], [np.nan, np.nan]],
+                            scores)
+
+  def test_max_depth_still_validates_whole_line(self):
+    with self.assertRaises(ValueError):
+      dataset_io._parse_rankings('1\t{2:0.5,3}\n', max_depth=1)
+
+  def test_malformed_item_raises(self):
+    with self.assertRaises(ValueError):
+      dataset_io._parse_rankings('1\t{2:0.5,x:0.1}\n')
+
+
+class LoadRankingSetsTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.dataset_dir = self.temp_dir.name
+    with open(os.path.join(self.dataset_dir, 'u1-Alg.out'), 'w') as f:
+      f.write('1\t{2:0.5,3:0.25}\n4\t{5:0.5}\n')
+    self.cache_dir = dataset_io.default_cache_dir(self.dataset_dir)
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+    super().tearDown()
+
+  def test_loads_without_cache(self):
+    ranking_set_by_id = dataset_io.load_ranking_sets(self.dataset_dir)
+
+    ranking_set = ranking_set_by_id[dataset_io.RankingSetId('1', 'Alg')]
+    self.assertEqual([[2, 3], [5, -1]], ranking_set.matrix.tolist())
+    self.assertEqual([1, 4], ranking_set.user_ids.tolist())
+    self.assertFalse(os.path.exists(self.cache_dir))
+
+  def test_reloads_from_cache(self):
+    dataset_io.load_ranking_sets(self.dataset_dir, cache_dir=self.cache_dir)
+
+    with mock.patch.object(dataset_io, '_parse_rankings') as mock_parse:
+      ranking_set_by_id = dataset_io.load_ranking_sets(
+          self.dataset_dir, cache_dir=self.cache_dir)
+
+    mock_parse.assert_not_called()
+    ranking_set = ranking_set_by_id[dataset_io.RankingSetId('1', 'Alg')]
+    self.assertIsInstance(ranking_set.matrix, np.memmap)
+    self.assertEqual([[2, 3], [5, -1]], ranking_set.matrix.tolist())
+    self.assertEqual([1, 4], ranking_set.user_ids.tolist())
+    self.assertIsNone(ranking_set.scores)
+
+  def test_reparses_modified_file(self):
+    dataset_io.load_ranking_sets(self.dataset_dir, cache_dir=self.cache_dir)
+    path = os.path.join(self.dataset_dir, 'u1-Alg.out')
+    with open(path, 'w') as f:
+      f.write('1\t{7:0.5}\n')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    ranking_set_by_id = dataset_io.load_ranking_sets(
+        self.dataset_dir, cache_dir=self.cache_dir)
+
+    ranking_set = ranking_set_by_id[dataset_io.RankingSetId('1', 'Alg')]
+    self.assertEqual([[7]], ranking_set.matrix.tolist())
+
+  def test_caches_each_depth_separately(self):
+    dataset_io.load_ranking_sets(
+        self.dataset_dir, max_depth=1, cache_dir=self.cache_dir)
+    dataset_io.load_ranking_sets(self.dataset_dir, cache_dir=self.cache_dir)
+
+    with mock.patch.object(dataset_io, '_parse_rankings') as mock_parse:
+      ranking_set_by_id = dataset_io.load_ranking_sets(
+          self.dataset_dir, max_depth=1, cache_dir=self.cache_dir)
+
+    mock_parse.assert_not_called()
+    ranking_set = ranking_set_by_id[dataset_io.RankingSetId('1', 'Alg')]
+    self.assertEqual([[2], [5]], ranking_set.matrix.tolist())
+
+  def test_caches_scores_separately(self):
+    dataset_io.load_ranking_sets(self.dataset_dir, cache_dir=self.cache_dir)
+
+    ranking_set_by_id = dataset_io.load_ranking_sets(
+        self.dataset_dir, with_scores=True, cache_dir=self.cache_dir)
+
+    ranking_set = ranking_set_by_id[dataset_io.RankingSetId('1', 'Alg')]
+    self.assertEqual([0.5, 0.25], ranking_set.scores[0].tolist())
+
+
+class IterRankingBlocksTest(unittest.TestCase):
+
+  def test_yields_blocks_of_users(self):
+    file_contents = """1\t{2:0.5,3:0.25}
+4\t{5:0.5}
+6\t{7:0.5,8:0.25}
+"""
+    ranking_set_id = dataset_io.RankingSetId('1', 'Alg')
+
+    with mock.patch(
+        'ps.dataset_io.open', return_value=io.StringIO(file_contents)):
+      blocks = list(
+          dataset_io.iter_ranking_blocks(
+              'rankings.out', ranking_set_id, block_size=2))
+
+    self.assertEqual(2, len(blocks))
+    self.assertEqual([[2, 3], [5, -1]], blocks[0].matrix.tolist())
+    self.assertEqual([1, 4], blocks[0].user_ids.tolist())
+    self.assertEqual([[7, 8]], blocks[1].matrix.tolist())
+    self.assertEqual([6], blocks[1].user_ids.tolist())
+    self.assertEqual(ranking_set_id, blocks[1].id)
+
+
+class LoadInParallelTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.dataset_dir = self.temp_dir.name
+    for fold in ('1', '2'):
+      for source in ('Alg', 'Other'):
+        path = os.path.join(self.dataset_dir, f'u{fold}-{source}.out')
+        with open(path, 'w') as f:
+          f.write(f'{fold}\t{{{len(source)}:0.5}}\n')
+      for split, rating in (('base', 5), ('test', 4)):
+        path = os.path.join(self.dataset_dir, f'u{fold}.{split}')
+        with open(path, 'w') as f:
+          f.write(f'{fold}\t{rating}\t{rating}\n')
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+    super().tearDown()
+
+  def _assert_ranking_sets(self, ranking_set_by_id):
+    self.assertEqual([
+        dataset_io.RankingSetId('1', 'Alg'),
+        dataset_io.RankingSetId('1', 'Other'),
+        dataset_io.RankingSetId('2', 'Alg'),
+        dataset_io.RankingSetId('2', 'Other'),
+    ], list(ranking_set_by_id))
+    for ranking_set_id, ranking_set in ranking_set_by_id.items():
+      self.assertEqual([[len(ranking_set_id.source)]],
+                       ranking_set.matrix.tolist())
+      self.assertEqual([int(ranking_set_id.fold)],
+                       ranking_set.user_ids.tolist())
+
+  def _assert_rating_sets(self, rating_set_by_fold):
+    self.assertEqual(['1', '2'], list(rating_set_by_fold))
+    for fold, rating_set in rating_set_by_fold.items():
+      self.assertEqual([int(fold)], rating_set.base.user_ids.tolist())
+      self.assertEqual([5], rating_set.base.item_ids.tolist())
+      self.assertEqual([4], rating_set.test.ratings.tolist())
+
+  def test_loads_rankings_without_cache(self):
+    self._assert_ranking_sets(
+        dataset_io.load_ranking_sets(self.dataset_dir, num_workers=2))
+
+  def test_loads_rankings_with_cache(self):
+    cache_dir = dataset_io.default_cache_dir(self.dataset_dir)
+    for _ in range(2):
+      self._assert_ranking_sets(
+          dataset_io.load_ranking_sets(
+              self.dataset_dir, cache_dir=cache_dir, num_workers=2))
+
+  def test_loads_ratings_without_cache(self):
+    self._assert_rating_sets(
+        dataset_io.load_ratings_for_all_folds(self.dataset_dir, num_workers=2))
+
+  def test_load_dataset_shares_vocabularies(self):
+    dataset = dataset_io.load_dataset(self.dataset_dir, num_workers=2)
+
+    self.assertEqual([1, 2], dataset.user_vocabulary.raw_ids.tolist())
+    self.assertEqual([3, 4, 5], dataset.item_vocabulary.raw_ids.tolist())
+    ranking_set = dataset.ranking_set_by_id[dataset_io.RankingSetId(
+        '2', 'Other')]
+    self.assertEqual([[2]], ranking_set.matrix.tolist())
+    self.assertEqual([1], ranking_set.user_ids.tolist())
+    rating_set = dataset.rating_set_by_fold['2']
+    self.assertEqual([1], rating_set.base.user_ids.tolist())
+    self.assertEqual([1], rating_set.test.item_ids.tolist())
+
+  def test_load_dataset_maps_cached_interned_rankings(self):
+    cache_dir = dataset_io.default_cache_dir(self.dataset_dir)
+    expected = dataset_io.load_dataset(self.dataset_dir, cache_dir=cache_dir)
+
+    with mock.patch.object(dataset_io, 'intern_ranking_set') as mock_intern:
+      dataset = dataset_io.load_dataset(self.dataset_dir, cache_dir=cache_dir)
+
+    mock_intern.assert_not_called()
+    self.assertEqual(expected.item_vocabulary.raw_ids.tolist(),
+                     dataset.item_vocabulary.raw_ids.tolist())
+    for ranking_set_id, ranking_set in dataset.ranking_set_by_id.items():
+      self.assertIsInstance(ranking_set.matrix, np.memmap)
+      self.assertEqual(
+          expected.ranking_set_by_id[ranking_set_id].matrix.tolist(),
+          ranking_set.matrix.tolist())
+
+  def test_loads_ratings_with_cache(self):
+    cache_dir = dataset_io.default_cache_dir(self.dataset_dir)
+    for _ in range(2):
+      self._assert_rating_sets(
+          dataset_io.load_ratings_for_all_folds(
+              self.dataset_dir, cache_dir=cache_dir, num_workers=2))
+
+
+class HashDatasetFilesTest(unittest.TestCase):
+
+  def _write(self, dataset_dir, filename, text):
+    with open(os.path.join(dataset_dir, filename), 'w') as f:
+      f.write(text)
+
+  def test_hashes_change_with_contents(self):
+    with tempfile.TemporaryDirectory() as dataset_dir:
+      self._write(dataset_dir, 'u1-Alg.out', '1\t{2:1.0}\n')
+      self._write(dataset_dir, 'u2-Alg.out', '1\t{2:1.0}\n')
+      for fold in ('1', '2'):
+        self._write(dataset_dir, 'u{}.base'.format(fold), '1\t2\t5\n')
+        self._write(dataset_dir, 'u{}.test'.format(fold), '1\t3\t5\n')
+      before = dataset_io.hash_dataset_files(dataset_dir)
+
+      self._write(dataset_dir, 'u2.test', '1\t4\t5\n')
+      after = dataset_io.hash_dataset_files(dataset_dir, num_workers=2)
+
+    ranking_set_ids = [
+        dataset_io.RankingSetId('1', 'Alg'),
+        dataset_io.RankingSetId('2', 'Alg')
+    ]
+    self.assertEqual(ranking_set_ids, list(before.ranking_hash_by_id))
+    self.assertEqual(before.ranking_hash_by_id[ranking_set_ids[0]],
+                     before.ranking_hash_by_id[ranking_set_ids[1]])
+    self.assertEqual(before.ranking_hash_by_id, after.ranking_hash_by_id)
+    self.assertEqual(before.ratings_hash_by_fold['1'],
+                     before.ratings_hash_by_fold['2'])
+    self.assertEqual(before.ratings_hash_by_fold['1'],
+                     after.ratings_hash_by_fold['1'])
+    self.assertNotEqual(before.ratings_hash_by_fold['2'],
+                        after.ratings_hash_by_fold['2'])
+
+
+class ResultsFrameTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.TemporaryDirectory()
+    self.output_dir = self._temp_dir.name
+    self.results_frame = pd.DataFrame(
+        [['1', 'Alg', 'MAP', 10, 0.25], ['2', 'Alg', 'MAP', 10, 0.5]],
+        columns=['fold', 'algorithm', 'metric', 'cutoff', 'value'])
+
+  def tearDown(self):
+    self._temp_dir.cleanup()
+
+  def test_csv_roundtrip(self):
+    dataset_io.save_results_frame(self.results_frame, self.output_dir, ['csv'])
+
+    loaded = dataset_io.load_results_frame(
+        os.path.join(self.output_dir, 'output.csv'))
+
+    self.assertEqual([0.25, 0.5], loaded.value.tolist())
+    self.assertEqual(['Alg', 'Alg'], loaded.algorithm.tolist())
+
+  @unittest.skipIf(dataset_io.pyarrow_csv is None, 'pyarrow not installed')
+  def test_loads_parquet_from_directory(self):
+    dataset_io.save_results_frame(self.results_frame, self.output_dir,
+                                  ['csv', 'parquet'])
+
+    with mock.patch.object(pd, 'read_csv') as mock_read_csv:
+      loaded = dataset_io.load_results_frame(self.output_dir)
+
+    mock_read_csv.assert_not_called()
+    pd.testing.assert_frame_equal(self.results_frame, loaded)
+
+  def test_writes_html_and_tex_only_on_request(self):
+    dataset_io.save_results_frame(self.results_frame, self.output_dir)
+    self.assertFalse(os.path.exists(
+        os.path.join(self.output_dir, 'output.html')))
+
+    dataset_io.save_results_frame(self.results_frame, self.output_dir,
+                                  ['html', 'tex'])
+    self.assertEqual(
+        {'output.html', 'output.tex'},
+        set(os.listdir(self.output_dir)) & {'output.html', 'output.tex'})
+
+  def test_missing_results_raises(self):
+    with self.assertRaises(FileNotFoundError):
+      dataset_io.load_results_frame(self.output_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,238 @@
+"""Per-fold artifacts shared by all metrics and oracles of a run.
+
+Metrics and oracles derive hits, popularity, distances, etc. from the rating
+set of each fold. A FoldContext computes each of these artifacts at most once
+per fold, when it is first asked for, and records how long that took and how
+many times the result was reused.
+"""
+import collections
+import functools
+import logging
+import time
+
+import pandas as pd
+
+from ps import item_distances
+from ps import parallel
+from ps import rating_utils
+
+
+def _from_rating_set(compute):
+
+  def compute_for_fold(context, fold):
+    return compute(context.rating_set_by_fold[fold])
+
+  return compute_for_fold
+
+
+def _compute_ranked_items(context, fold):
+  return item_distances.compute_ranked_items(
+      ranking_set for ranking_set_id, ranking_set in
+      context.ranking_set_by_id.items() if ranking_set_id.fold == fold)
+
+
+def _compute_popularity_table(context, fold):
+  popularity = context.get('popularity', fold)
+  return rating_utils.PopularityTable(popularity.index.values,
+                                      popularity.values)
+
+
+def _compute_distances(context, fold):
+  rating_set = context.rating_set_by_fold[fold]
+  if context.num_hashes is not None:
+    distances = item_distances.MinHashItemDistances(
+        rating_set, num_hashes=context.num_hashes)
+    logging.info('Fold %s approximate distances: %s', fold,
+                 item_distances.report_distance_error(distances, rating_set))
+    return distances
+  if context.distance_store is not None:
+    return context.distance_store.load(rating_set)
+  return item_distances.ItemDistances(
+      rating_set, candidate_item_ids=context.get('ranked_items', fold))
+
+
+_ARTIFACTS = {
+    'hits':
+        _from_rating_set(
+            functools.partial(
+                rating_utils._compute_rated_by_user, split_name='test')),
+    'hits_index':
+        _from_rating_set(
+            functools.partial(
+                rating_utils._compute_rated_index, split_name='test')),
+    'popularity':
+        _from_rating_set(rating_utils._compute_popularity),
+    'popularity_table':
+        _compute_popularity_table,
+    'items':
+        _from_rating_set(rating_utils._compute_items),
+    'users':
+        _from_rating_set(rating_utils._compute_users),
+    'likers':
+        _from_rating_set(rating_utils._compute_likers),
+    'ranked_items':
+        _compute_ranked_items,
+    'distances':
+        _compute_distances,
+}
+
+ARTIFACT_NAMES = tuple(sorted(_ARTIFACTS))
+
+# The artifacts each artifact reads through the context, and so needs first.
+_DEPENDENCIES = {
+    'popularity_table': ('popularity',),
+    'distances': ('ranked_items',),
+}
+
+# Only these artifacts read the rankings.
+_RANKING_ARTIFACTS = frozenset(['ranked_items'])
+
+_STATS_COLUMNS = ('artifact', 'fold', 'computed', 'reused', 'seconds')
+
+
+def _compute_timed(context, name, fold):
+  start = time.perf_counter()
+  artifact = context.get(name, fold)
+  return artifact, time.perf_counter() - start
+
+
+class _ArtifactStats(object):
+
+  def __init__(self):
+    self.computed = 0
+    self.reused = 0
+    self.seconds = 0.
+
+
+class FoldContext(object):
+  """Lazily computes and memoizes the artifacts of each fold.
+
+  ranking_set_by_id -- Optional. The rankings whose items restrict the
+      candidates of on-demand distances.
+  distance_store -- Optional item_distances.DistanceStore to load full
+      distance matrices from.
+  num_hashes -- Optional. When set, distances are estimated from MinHash
+      signatures of this many hashes instead (see
+      item_distances.MinHashItemDistances), and the distance store is unused.
+  """
+
+  def __init__(self,
+               rating_set_by_fold,
+               ranking_set_by_id=None,
+               distance_store=None,
+               num_hashes=None):
+    self.rating_set_by_fold = rating_set_by_fold
+    self.ranking_set_by_id = ranking_set_by_id or {}
+    self.distance_store = distance_store
+    self.num_hashes = num_hashes
+    self._artifacts = {}
+    self._stats = collections.OrderedDict()
+
+  def get(self, name, fold):
+    """Returns the named artifact of the fold, computing it on first use."""
+    if name not in _ARTIFACTS:
+      raise ValueError('Unknown artifact: {}'.format(name))
+
+    key = (name, fold)
+    stats = self._stats.setdefault(key, _ArtifactStats())
+    if key in self._artifacts:
+      stats.reused += 1
+      return self._artifacts[key]
+
+    start = time.perf_counter()
+    artifact = _ARTIFACTS[name](self, fold)
+    # Includes the time taken by any artifacts computed along the way.
+    stats.seconds += time.perf_counter() - start
+    stats.computed += 1
+
+    self._artifacts[key] = artifact
+    return artifact
+
+  def _dependencies(self, name):
+    # Stored and estimated distances don't restrict candidates to the ranked
+    # items.
+    if name == 'distances' and (self.num_hashes is not None or
+                                self.distance_store is not None):
+      return ()
+    return _DEPENDENCIES.get(name, ())
+
+  def _depth(self, name):
+    """Returns 0 for artifacts without dependencies, else 1 + their depth."""
+    return max(
+        (1 + self._depth(dependency)
+         for dependency in self._dependencies(name)),
+        default=0)
+
+  def _fold_context(self, name, fold):
+    """Returns a context holding only what the named artifact reads.
+
+    Rankings are only passed to the artifacts that read them, and the
+    dependencies of the artifact, already computed, are passed along.
+    """
+    ranking_set_by_id = None
+    if name in _RANKING_ARTIFACTS:
+      ranking_set_by_id = {
+          ranking_set_id: ranking_set
+          for ranking_set_id, ranking_set in self.ranking_set_by_id.items()
+          if ranking_set_id.fold == fold
+      }
+    context = FoldContext({fold: self.rating_set_by_fold[fold]},
+                          ranking_set_by_id, self.distance_store,
+                          self.num_hashes)
+    for dependency in self._dependencies(name):
+      context._artifacts[dependency, fold] = self._artifacts[dependency, fold]
+    return context
+
+  def prefetch(self, names, num_workers=1, use_threads=False):
+    """Computes the named artifacts of every fold ahead of their first use.
+
+    Folds are spread over a pool of num_workers processes (None for one per
+    CPU), or threads with use_threads; see parallel.map_parallel. The
+    artifacts the named ones depend on are prefetched first, so no worker
+    recomputes them.
+    """
+    for name in names:
+      if name not in _ARTIFACTS:
+        raise ValueError('Unknown artifact: {}'.format(name))
+
+    pending = list(names)
+    all_names = set()
+    while pending:
+      name = pending.pop()
+      if name not in all_names:
+        all_names.add(name)
+        pending.extend(self._dependencies(name))
+
+    for depth in sorted({self._depth(name) for name in all_names}):
+      keys = [(name, fold)
+              for name in sorted(all_names)
+              if self._depth(name) == depth
+              for fold in sorted(self.rating_set_by_fold)
+              if (name, fold) not in self._artifacts]
+
+      results = parallel.map_parallel(
+          _compute_timed,
+          [(self._fold_context(name, fold), name, fold) for name, fold in keys],
+          num_workers, use_threads)
+
+      for key, (artifact, seconds) in zip(keys, results):
+        stats = self._stats.setdefault(key, _ArtifactStats())
+        stats.seconds += seconds
+        stats.computed += 1
+        self._artifacts[key] = artifact
+
+  def by_fold(self, name):
+    """Returns the named artifact of every fold, sorted by fold."""
+    return collections.OrderedDict(
+        (fold, self.get(name, fold)) for fold in sorted(self.rating_set_by_fold))
+
+  def stats_frame(self):
+    """Returns what was computed and reused so far, one row per artifact."""
+    records = [(name, fold, stats.computed, stats.reused, stats.seconds)
+               for (name, fold), stats in self._stats.items()]
+    return pd.DataFrame.from_records(records, columns=_STATS_COLUMNS)
+
+  def log_stats(self):
+    for (name, fold), stats in self._stats.items():
+      logging.info('Fold %s %s: computed in %.3fs, reused %d times', fold,
+                   name, stats.seconds, stats.reused)
@@ -0,0 +1,137 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ps import dataset_io
+from ps import fold_context
+from ps import item_distances
+from ps.metrics import map as map_module
+from ps.oracles import map_oracle
+
+
+def _make_rating_set_by_fold():
+  rating_set = dataset_io.RatingSet(fold='u1')
+  rating_set.base = pd.DataFrame.from_records(
+      columns=['user_id', 'item_id', 'rating'],
+      data=[(1, 1, 5), (1, 2, 5), (2, 1, 5), (2, 3, 5), (3, 4, 5)])
+  rating_set.test = pd.DataFrame.from_records(
+      columns=['user_id', 'item_id', 'rating'], data=[(1, 3, 5), (2, 2, 5)])
+  return {'u1': rating_set}
+
+
+class FoldContextTest(unittest.TestCase):
+
+  def setUp(self):
+    self.rating_set_by_fold = _make_rating_set_by_fold()
+    self.ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=np.array([[1, 2, -1], [2, 3, 5]]),
+        user_ids=np.array([1, 2]))
+    self.context = fold_context.FoldContext(
+        self.rating_set_by_fold, {self.ranking_set.id: self.ranking_set})
+
+  def test_computes_each_artifact_once(self):
+    first = self.context.get('popularity', 'u1')
+    second = self.context.by_fold('popularity')['u1']
+
+    self.assertIs(first, second)
+    self.assertEqual({1: 2 / 3, 2: 1 / 3, 3: 1 / 3, 4: 1 / 3}, dict(first))
+
+  def test_reports_computed_and_reused(self):
+    self.context.get('hits_index', 'u1')
+    self.context.get('hits_index', 'u1')
+    self.context.get('hits_index', 'u1')
+
+    stats = self.context.stats_frame().set_index('artifact').loc['hits_index']
+
+    self.assertEqual('u1', stats.fold)
+    self.assertEqual(1, stats.computed)
+    self.assertEqual(2, stats.reused)
+    self.assertGreaterEqual(stats.seconds, 0)
+
+  def test_unknown_artifact_raises(self):
+    with self.assertRaises(ValueError):
+      self.context.get('unknown', 'u1')
+
+  def test_restricts_distances_to_ranked_items(self):
+    distances = self.context.get('distances', 'u1')
+
+    self.assertEqual([1, 2, 3], distances.item_ids.tolist())
+
+  def test_loads_distances_from_store(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      context = fold_context.FoldContext(
+          self.rating_set_by_fold,
+          distance_store=item_distances.DistanceStore(temp_dir))
+
+      distances = context.get('distances', 'u1')
+
+    self.assertIsInstance(distances, item_distances.CondensedItemDistances)
+    self.assertEqual([1, 2, 3, 4], distances.item_ids.tolist())
+
+  def test_estimates_distances_with_num_hashes(self):
+    context = fold_context.FoldContext(self.rating_set_by_fold, num_hashes=16)
+
+    distances = context.get('distances', 'u1')
+
+    self.assertIsInstance(distances, item_distances.MinHashItemDistances)
+    self.assertEqual(16, distances.num_hashes)
+
+  def test_prefetches_in_parallel(self):
+    rating_set_by_fold = dict(self.rating_set_by_fold)
+    rating_set_by_fold['u2'] = _make_rating_set_by_fold()['u1']
+    context = fold_context.FoldContext(rating_set_by_fold)
+
+    context.prefetch(['popularity', 'distances'], num_workers=2)
+    popularity_by_fold = context.by_fold('popularity')
+
+    self.assertEqual(['u1', 'u2'], list(popularity_by_fold))
+    self.assertEqual({1: 2 / 3, 2: 1 / 3, 3: 1 / 3, 4: 1 / 3},
+                     dict(popularity_by_fold['u2']))
+    self.assertEqual([1, 2, 3, 4],
+                     context.get('distances', 'u2').item_ids.tolist())
+    stats = context.stats_frame()
+    # Distances depend on the ranked items, which are prefetched first.
+    self.assertEqual(['popularity', 'ranked_items', 'distances'],
+                     stats.artifact.unique().tolist())
+    self.assertEqual([1] * 6, stats.computed.tolist())
+    popularity_stats = stats[stats.artifact == 'popularity']
+    self.assertEqual([1, 1], popularity_stats.reused.tolist())
+
+  def test_prefetches_dependencies_once(self):
+    self.context.prefetch(['popularity_table'], num_workers=1)
+
+    stats = self.context.stats_frame().set_index('artifact')
+    self.assertEqual(1, stats.loc['popularity'].computed)
+    self.assertEqual(1, stats.loc['popularity_table'].computed)
+    np.testing.assert_allclose(
+        [2 / 3, 1 / 3, 1 / 3, 1 / 3],
+        self.context.get('popularity_table', 'u1').lookup([1, 2, 3, 4]))
+
+  def test_passes_rankings_only_to_artifacts_that_read_them(self):
+    self.context.get('popularity', 'u1')
+
+    hits_context = self.context._fold_context('hits_index', 'u1')
+    table_context = self.context._fold_context('popularity_table', 'u1')
+
+    self.assertEqual({}, hits_context.ranking_set_by_id)
+    self.assertEqual([self.ranking_set.id],
+                     list(self.context._fold_context('ranked_items',
+                                                     'u1').ranking_set_by_id))
+    self.assertIs(
+        self.context.get('popularity', 'u1'),
+        table_context._artifacts['popularity', 'u1'])
+
+  def test_shared_by_metrics_and_oracles(self):
+    map_oracle.MAPOracle({}, self.rating_set_by_fold, context=self.context)
+    map_module.MAP({}, self.rating_set_by_fold, context=self.context)
+
+    stats = self.context.stats_frame().set_index('artifact').loc['hits_index']
+    self.assertEqual(1, stats.computed)
+    self.assertEqual(1, stats.reused)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,57 +1,155 @@
 import collections
-import concurrent.futures
+import functools
+import hashlib
+import inspect
 import logging
 import os.path
+import sys
+import types
 
-import numpy as np
 import pandas as pd
 
 from ps import dataset_io
+from ps import fold_context
+from ps import item_distances
 from ps import logging_utils
+from ps import parallel
+from ps import result_cache as result_cache_module
+from ps import significance
+from ps.metrics import coverage
 from ps.metrics import eild
 from ps.metrics import epc
+from ps.metrics import gini
+from ps.metrics import kernels
 from ps.metrics import map as map_module
+from ps.metrics import metric_utils
+from ps.metrics import ndcg
+from ps.metrics import recall
+from ps.metrics import serendipity
 
 
-def _run_metric_multi_process(metric, ranking_set_by_id, cutoff):
-  with concurrent.futures.ProcessPoolExecutor() as executor:
-    futures = []
-    for ranking_set in ranking_set_by_id.values():
-      future = executor.submit(metric.compute, ranking_set, num_items=cutoff)
-      futures.append(future)
+def _group_by_fold(ranking_set_by_id):
+  ranking_sets_by_fold = collections.OrderedDict()
+  for ranking_set in ranking_set_by_id.values():
+    ranking_sets_by_fold.setdefault(ranking_set.id.fold, []).append(ranking_set)
+  return ranking_sets_by_fold
 
-    return [future.result() for future in futures]
 
+def _split_source_groups(ranking_sets_by_fold, num_groups):
+  """Splits the ranking sets of each fold into at least num_groups in all.
+
+  Each fold is split into about as many groups of sources, so a pool of
+  num_groups workers is kept busy however few folds there are, while the
+  sources of each group are still evaluated in one batch.
+  """
+  groups_per_fold = max(1, -(-num_groups // max(1, len(ranking_sets_by_fold))))
+  source_groups = []
+  for ranking_sets in ranking_sets_by_fold.values():
+    group_size = max(1, -(-len(ranking_sets) // groups_per_fold))
+    source_groups.extend(
+        ranking_sets[start:start + group_size]
+        for start in range(0, len(ranking_sets), group_size))
+  return source_groups
+
+
+_RESULT_COLUMNS = ('metric', 'cutoff', 'fold', 'source', 'value')
+
+
+def _results_frame(metrics, cutoffs_by_metric, ranking_set_ids, value_by_key):
+  """Returns the results keyed by metric name, cutoff and ranking set id."""
+  result_records = [(metric.NAME, cutoff, ranking_set_id.fold,
+                     ranking_set_id.source,
+                     value_by_key[metric.NAME, cutoff, ranking_set_id])
+                    for metric, cutoffs in zip(metrics, cutoffs_by_metric)
+                    for cutoff in cutoffs
+                    for ranking_set_id in ranking_set_ids]
+  return pd.DataFrame.from_records(result_records, columns=_RESULT_COLUMNS)
+
+
+_USER_VALUE_COLUMNS = ('metric', 'cutoff', 'fold', 'source', 'user_id',
+                       'value')
 
-def _run_metric_single_process(metric, ranking_set_by_id, cutoff):
-  return [
-      metric.compute(ranking_set, num_items=cutoff)
-      for ranking_set in ranking_set_by_id.values()
-  ]
 
+def _user_values_frame(frames):
+  """Concatenates per-user values, with categorical labels to save memory."""
+  if not frames:
+    return pd.DataFrame(columns=_USER_VALUE_COLUMNS)
+  user_values_frame = pd.concat(frames, ignore_index=True)
+  for column in ('metric', 'fold', 'source'):
+    user_values_frame[column] = user_values_frame[column].astype('category')
+  return user_values_frame
 
-def _compute_metric(metric_settings, ranking_set_by_id, rating_set_by_fold):
-  metric = metric_settings.constructor(ranking_set_by_id, rating_set_by_fold)
 
-  logging.info('Computing all %s', metric.NAME)
+def _compute_metrics(metric_settings_list,
+                     ranking_set_by_id,
+                     rating_set_by_fold,
+                     context,
+                     with_user_values=False,
+                     num_workers=None):
+  """Computes several metrics for every ranking set in one pass.
 
-  metric_values_by_cutoff = {}
-  for cutoff in metric_settings.cutoffs:
-    run = (_run_metric_multi_process
-           if metric_settings.multiprocess else _run_metric_single_process)
-    metric_values_by_cutoff[cutoff] = run(metric, ranking_set_by_id, cutoff)
+  Each group of sources of a fold is evaluated by every metric, at every
+  cutoff, in one batch, so the metrics share the stacked rankings and the
+  hits and popularity looked up for them.
 
-  result_records = []
-  for cutoff, metric_values in metric_values_by_cutoff.items():
-    for ranking_set_id, value in zip(ranking_set_by_id, metric_values):
-      record = (metric.NAME, cutoff, ranking_set_id.fold, ranking_set_id.source,
-                value)
-      result_records.append(record)
+  with_user_values -- Also return the per-user values of the metrics that
+      have them, collected in the same pass (see compute_all_user_values).
+  num_workers -- Size of the process pool (None for one per CPU).
+  """
+  metrics = [
+      settings.constructor(
+          ranking_set_by_id, rating_set_by_fold, context=context)
+      for settings in metric_settings_list
+  ]
+  cutoffs_by_metric = [settings.cutoffs for settings in metric_settings_list]
+
+  logging.info('Computing all %s', ', '.join(metric.NAME for metric in metrics))
+
+  # In a process pool, folds are split into enough groups to give every
+  # worker a task.
+  ranking_sets_by_fold = _group_by_fold(ranking_set_by_id)
+  if all(settings.multiprocess for settings in metric_settings_list):
+    source_groups = _split_source_groups(ranking_sets_by_fold,
+                                         num_workers or os.cpu_count() or 1)
+  else:
+    source_groups = list(ranking_sets_by_fold.values())
+    num_workers = 1
+  # The pool shares per-user values through memory-mapped files.
+  evaluations = parallel.map_parallel(
+      metric_utils.evaluate_by_source,
+      [(metrics, cutoffs_by_metric, ranking_sets, with_user_values)
+       for ranking_sets in source_groups],
+      num_workers=num_workers)
+
+  value_by_key = {}
+  user_value_frames = []
+  for ranking_sets, evaluation in zip(source_groups, evaluations):
+    values_by_metric, user_values_by_metric = (
+        evaluation if with_user_values else (evaluation, [None] * len(metrics)))
+    for metric, values_by_source, user_values_by_source in zip(
+        metrics, values_by_metric, user_values_by_metric):
+      for ranking_set, values_by_cutoff in zip(ranking_sets, values_by_source):
+        for cutoff, value in values_by_cutoff.items():
+          value_by_key[metric.NAME, cutoff, ranking_set.id] = value
+      for ranking_set, user_values_by_cutoff in zip(
+          ranking_sets, user_values_by_source or ()):
+        for cutoff, values in user_values_by_cutoff.items():
+          user_value_frames.append(
+              pd.DataFrame({
+                  'metric': metric.NAME,
+                  'cutoff': cutoff,
+                  'fold': ranking_set.id.fold,
+                  'source': ranking_set.id.source,
+                  'user_id': values.index.values,
+                  'value': values.values,
+              }))
 
-  results = pd.DataFrame.from_records(
-      result_records, columns=('metric', 'cutoff', 'fold', 'source', 'value'))
+  results = _results_frame(metrics, cutoffs_by_metric, ranking_set_by_id,
+                           value_by_key)
 
-  logging.info('Done computing %s', metric.NAME)
+  logging.info('Done computing all metrics')
+  if with_user_values:
+    return results, _user_values_frame(user_value_frames)
   return results
 
 
@@ -62,26 +160,364 @@ _METRICS = [
     MetricSettings(constructor=epc.EPC, cutoffs=[10], multiprocess=True),
     MetricSettings(constructor=eild.EILD, cutoffs=[10], multiprocess=True),
     MetricSettings(constructor=map_module.MAP, cutoffs=[10], multiprocess=True),
+    MetricSettings(constructor=ndcg.NDCG, cutoffs=[10], multiprocess=True),
+    MetricSettings(constructor=recall.Recall, cutoffs=[10], multiprocess=True),
+    MetricSettings(
+        constructor=serendipity.Serendipity, cutoffs=[10], multiprocess=True),
+    MetricSettings(
+        constructor=coverage.Coverage, cutoffs=[10], multiprocess=True),
+    MetricSettings(constructor=gini.Gini, cutoffs=[10], multiprocess=True),
 ]
 
 
-def compute_all_metrics(ranking_set_by_id, rating_set_by_fold):
-  results_frames = []
-  for metric_settings in _METRICS:
-    frame = _compute_metric(metric_settings, ranking_set_by_id,
-                            rating_set_by_fold)
-    results_frames.append(frame)
-  return pd.concat(results_frames)
+def max_cutoff():
+  """The deepest ranking position read by any configured metric."""
+  return max(cutoff for settings in _METRICS for cutoff in settings.cutoffs)
+
+
+def metric_artifacts():
+  """The FoldContext artifacts read by any configured metric."""
+  return sorted({
+      name for settings in _METRICS for name in settings.constructor.ARTIFACTS
+  })
+
+
+# Bump when results change for a reason the source hash doesn't capture.
+_RESULTS_VERSION = 2
+
+
+def _imported_ps_modules(module):
+  """Returns module and every ps module it imports, directly or not."""
+  modules = {}
+  pending = [module]
+  while pending:
+    module = pending.pop()
+    if module.__name__ in modules:
+      continue
+    modules[module.__name__] = module
+    for value in vars(module).values():
+      if not isinstance(value, types.ModuleType):
+        value = sys.modules.get(getattr(value, '__module__', None))
+      if value is not None and value.__name__.split('.')[0] == 'ps':
+        pending.append(value)
+  return modules
+
+
+@functools.lru_cache(maxsize=None)
+def _source_hash(module_name):
+  """Hashes the source of a module and of every ps module it imports."""
+  digest = hashlib.sha256()
+  for name, module in sorted(
+      _imported_ps_modules(sys.modules[module_name]).items()):
+    source_path = inspect.getsourcefile(module)
+    if source_path is None:
+      continue
+    digest.update(name.encode())
+    with open(source_path, 'rb') as f:
+      digest.update(hashlib.sha256(f.read()).digest())
+  return digest.hexdigest()
+
+
+def _result_version(metric_settings, context):
+  """Identifies the code and settings that compute a metric's results.
+
+  The code is that of the metric's module and of every ps module it uses,
+  so changing any of them invalidates its cached results.
+  """
+  source_hash = _source_hash(metric_settings.constructor.__module__)
+  settings = (kernels.get_backend(),)
+  if 'distances' in metric_settings.constructor.ARTIFACTS:
+    store_dtype = (context.distance_store.dtype.name
+                   if context.distance_store is not None else None)
+    settings += (context.num_hashes, store_dtype)
+  return repr((_RESULTS_VERSION, source_hash) + settings)
+
+
+def _result_keys(metric_settings, ranking_set_ids, context, dataset_hashes):
+  """Returns the ResultKey of each ranking set id and cutoff."""
+  version = _result_version(metric_settings, context)
+  return {(ranking_set_id, cutoff): result_cache_module.ResultKey(
+      dataset_hashes.ranking_hash_by_id[ranking_set_id],
+      dataset_hashes.ratings_hash_by_fold[ranking_set_id.fold],
+      metric_settings.constructor.NAME, cutoff, version)
+          for ranking_set_id in ranking_set_ids
+          for cutoff in metric_settings.cutoffs}
+
+
+def _get_cached(ranking_set_by_id, context, result_cache, dataset_hashes):
+  """Looks up the cached results of every metric for every ranking set.
+
+  Returns the ResultKeys of each metric, keyed like _result_keys, and the
+  cached value of each key found.
+  """
+  keys_by_metric = [
+      _result_keys(metric_settings, ranking_set_by_id, context, dataset_hashes)
+      for metric_settings in _METRICS
+  ]
+  value_by_key = result_cache.get_many(
+      [key for keys in keys_by_metric for key in keys.values()])
+  return keys_by_metric, value_by_key
+
+
+def _find_uncached(keys_by_metric, value_by_key):
+  return {
+      ranking_set_id for keys in keys_by_metric
+      for (ranking_set_id, _), key in keys.items() if key not in value_by_key
+  }
+
+
+def find_uncached(ranking_set_by_id, context, result_cache, dataset_hashes):
+  """Returns the ids of the ranking sets missing any cached metric result."""
+  return _find_uncached(*_get_cached(ranking_set_by_id, context, result_cache,
+                                     dataset_hashes))
+
+
+def _compute_metrics_cached(ranking_set_by_id, rating_set_by_fold, context,
+                            result_cache, dataset_hashes, with_user_values,
+                            num_workers):
+  keys_by_metric, value_by_key = _get_cached(ranking_set_by_id, context,
+                                             result_cache, dataset_hashes)
+
+  # Only means are cached, so per-user values take a pass over every
+  # ranking set, whose means then refresh the cache.
+  uncached_ids = (set(ranking_set_by_id) if with_user_values else
+                  _find_uncached(keys_by_metric, value_by_key))
+  uncached_ranking_set_by_id = collections.OrderedDict(
+      (ranking_set_id, ranking_set)
+      for ranking_set_id, ranking_set in ranking_set_by_id.items()
+      if ranking_set_id in uncached_ids)
+  logging.info('Reusing cached results of %d of %d ranking sets',
+               len(ranking_set_by_id) - len(uncached_ranking_set_by_id),
+               len(ranking_set_by_id))
+
+  user_values_frame = None
+  if uncached_ranking_set_by_id:
+    frame = _compute_metrics(_METRICS, uncached_ranking_set_by_id,
+                             rating_set_by_fold, context, with_user_values,
+                             num_workers)
+    if with_user_values:
+      frame, user_values_frame = frame
+    keys_by_name = {
+        metric_settings.constructor.NAME: keys
+        for metric_settings, keys in zip(_METRICS, keys_by_metric)
+    }
+    # The None ("all items") cutoff reads back as NaN next to integer ones.
+    computed_value_by_key = {
+        keys_by_name[row.metric][dataset_io.RankingSetId(row.fold, row.source),
+                                 None if pd.isna(row.cutoff) else row.cutoff]:
+            row.value for row in frame.itertuples()
+    }
+    result_cache.put_many(computed_value_by_key)
+    value_by_key.update(computed_value_by_key)
+
+  result_records = [(metric_settings.constructor.NAME, cutoff,
+                     ranking_set_id.fold, ranking_set_id.source,
+                     value_by_key[keys[ranking_set_id, cutoff]])
+                    for metric_settings, keys in zip(_METRICS, keys_by_metric)
+                    for cutoff in metric_settings.cutoffs
+                    for ranking_set_id in ranking_set_by_id]
+  results = pd.DataFrame.from_records(result_records, columns=_RESULT_COLUMNS)
+  if with_user_values:
+    return results, (user_values_frame if user_values_frame is not None else
+                     _user_values_frame([]))
+  return results
+
+
+def compute_all_metrics(ranking_set_by_id,
+                        rating_set_by_fold,
+                        context=None,
+                        result_cache=None,
+                        dataset_hashes=None,
+                        with_user_values=False,
+                        num_workers=None):
+  """Computes every metric for every ranking set, all in one pass.
+
+  context -- Optional FoldContext shared with other metrics or oracles over
+      the same ratings.
+  result_cache -- Optional result_cache.ResultCache. Only the results it is
+      missing are computed, and they are added to it.
+  dataset_hashes -- The dataset_io.DatasetHashes of the files the ranking
+      and rating sets were loaded from. Required with result_cache.
+  with_user_values -- Also return the per-user values of every metric, as
+      compute_all_user_values does, collected in the same pass.
+  num_workers -- Size of the process pool the ranking sets are evaluated in
+      (None for one per CPU).
+  """
+  if result_cache is not None and dataset_hashes is None:
+    raise ValueError('Caching results requires dataset_hashes.')
+
+  context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                ranking_set_by_id)
+  if result_cache is None:
+    return _compute_metrics(_METRICS, ranking_set_by_id, rating_set_by_fold,
+                            context, with_user_values, num_workers)
+  return _compute_metrics_cached(ranking_set_by_id, rating_set_by_fold,
+                                 context, result_cache, dataset_hashes,
+                                 with_user_values, num_workers)
+
+
+# Per-user values are only written in formats that store them compactly.
+_USER_VALUE_FORMATS = ('parquet', 'feather')
+
+
+def compute_all_user_values(ranking_set_by_id,
+                            rating_set_by_fold,
+                            context=None,
+                            num_workers=None):
+  """Computes every metric for every user of every ranking set.
+
+  Metrics of the whole catalog, which have no per-user values, are left out.
+
+  Returns a long frame with one float32 value per metric, cutoff, ranking set
+  and user. Its labels are categorical, to keep it compact.
+  """
+  context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                ranking_set_by_id)
+  return _compute_metrics([
+      metric_settings for metric_settings in _METRICS
+      if metric_settings.constructor.HAS_USER_VALUES
+  ],
+                          ranking_set_by_id,
+                          rating_set_by_fold,
+                          context,
+                          with_user_values=True,
+                          num_workers=num_workers)[1]
+
+
+def compute_all_metrics_streaming(dataset_dir,
+                                  rating_set_by_fold,
+                                  block_size,
+                                  distance_store=None,
+                                  num_workers=1,
+                                  num_hashes=None):
+  """Computes all metrics reading block_size users of a ranking file at a time.
+
+  Gives the same results as compute_all_metrics, but ranking files are never
+  fully loaded, so peak memory is bounded by the block size. Ids are interned
+  with vocabularies built from the ratings alone; ranked items that no one
+  rated map to -1, which every metric treats like any other unrated item.
+  """
+  user_vocabulary, item_vocabulary = dataset_io.build_vocabularies(
+      rating_set_by_fold)
+  rating_set_by_fold = collections.OrderedDict(
+      (fold,
+       dataset_io.intern_rating_set(rating_set, user_vocabulary,
+                                    item_vocabulary))
+      for fold, rating_set in rating_set_by_fold.items())
+
+  context = fold_context.FoldContext(
+      rating_set_by_fold,
+      distance_store=distance_store,
+      num_hashes=num_hashes)
+  context.prefetch(metric_artifacts(), num_workers)
+  metrics = [
+      settings.constructor({}, rating_set_by_fold, context=context)
+      for settings in _METRICS
+  ]
+  cutoffs_by_metric = [settings.cutoffs for settings in _METRICS]
+
+  value_by_key = {}
+  ranking_set_ids = []
+  for path, ranking_set_id in dataset_io.yield_ranking_set_paths(dataset_dir):
+    logging.info('Streaming rankings from %s', path)
+    ranking_set_ids.append(ranking_set_id)
+
+    accumulators = [
+        metric.block_accumulator(cutoffs)
+        for metric, cutoffs in zip(metrics, cutoffs_by_metric)
+    ]
+    for block in dataset_io.iter_ranking_blocks(
+        path, ranking_set_id, block_size, max_depth=max_cutoff()):
+      block = dataset_io.intern_ranking_set(block, user_vocabulary,
+                                            item_vocabulary)
+      features = metric_utils.RankingFeatures(block)
+      for accumulator in accumulators:
+        accumulator.add(block, features)
+
+    for metric, accumulator in zip(metrics, accumulators):
+      for cutoff, value in accumulator.result().items():
+        value_by_key[metric.NAME, cutoff, ranking_set_id] = value
+
+  context.log_stats()
+  return _results_frame(metrics, cutoffs_by_metric, ranking_set_ids,
+                        value_by_key)
+
+
+def _save_user_values(dataset, user_values_frame, output_dir, result_formats):
+  """Saves per-user values, and the significance of differences in them."""
+  user_values_frame['user_id'] = dataset.user_vocabulary.to_raw(
+      user_values_frame.user_id.values)
+  user_value_formats = [
+      result_format
+      for result_format in result_formats or dataset_io.DEFAULT_RESULT_FORMATS
+      if result_format in _USER_VALUE_FORMATS
+  ] or ['csv']
+  dataset_io.save_results_frame(user_values_frame, output_dir,
+                                user_value_formats, 'user_values')
+
+  logging.info('Testing the significance of differences between sources')
+  dataset_io.save_results_frame(
+      significance.compare_all(user_values_frame), output_dir, result_formats,
+      'significance')
+
+
+def main(dataset_dir,
+         output_dir,
+         num_workers=None,
+         block_size=None,
+         result_formats=None,
+         num_hashes=None,
+         use_result_cache=True,
+         user_values=False,
+         store_distances=False):
+  cache_dir = dataset_io.default_cache_dir(dataset_dir)
+  # The store holds the distances between every pair of rated items, so by
+  # default distances are computed on demand for the ranked items only.
+  distance_store = (item_distances.default_distance_store(cache_dir)
+                    if store_distances else None)
+
+  if block_size is not None:
+    logging.info('Loading rating sets')
+    rating_set_by_fold = dataset_io.load_ratings_for_all_folds(
+        dataset_dir, cache_dir=cache_dir, num_workers=num_workers)
+    logging_utils.log_stats_for_folds(rating_set_by_fold)
+    logging.info('Streaming ranking sets in blocks of %d users', block_size)
+    results_frame = compute_all_metrics_streaming(dataset_dir,
+                                                  rating_set_by_fold,
+                                                  block_size,
+                                                  distance_store,
+                                                  num_workers, num_hashes)
+  else:
+    logging.info('Loading dataset')
+    dataset = dataset_io.load_dataset(
+        dataset_dir,
+        max_depth=max_cutoff(),
+        cache_dir=cache_dir,
+        num_workers=num_workers)
+    logging_utils.log_stats_for_folds(dataset.rating_set_by_fold)
+    logging.info('Done loading')
+    context = fold_context.FoldContext(dataset.rating_set_by_fold,
+                                       dataset.ranking_set_by_id,
+                                       distance_store, num_hashes)
 
+    result_cache = dataset_hashes = None
+    if use_result_cache:
+      result_cache = result_cache_module.default_result_cache(cache_dir)
+      dataset_hashes = dataset_io.hash_dataset_files(dataset_dir, num_workers)
 
+    if user_values or result_cache is None or find_uncached(
+        dataset.ranking_set_by_id, context, result_cache, dataset_hashes):
+      context.prefetch(metric_artifacts(), num_workers)
+    results_frame = compute_all_metrics(dataset.ranking_set_by_id,
+                                        dataset.rating_set_by_fold, context,
+                                        result_cache, dataset_hashes,
+                                        user_values, num_workers)
+    if result_cache is not None:
+      result_cache.close()
 
+    if user_values:
+      results_frame, user_values_frame = results_frame
+      _save_user_values(dataset, user_values_frame, output_dir, result_formats)
+    context.log_stats()
 
-def main(dataset_dir, output_dir):
-  logging.info('Loading ranking sets')
-  ranking_set_by_id = dataset_io.load_ranking_sets(dataset_dir)
-  logging.info('Loading rating sets')
-  rating_set_by_fold = dataset_io.load_ratings_for_all_folds(dataset_dir)
-  logging_utils.log_stats_for_folds(rating_set_by_fold)
-  logging.info('Done loading')
-  results_frame = compute_all_metrics(ranking_set_by_id, rating_set_by_fold)
-  dataset_io.save_results_frame(results_frame, output_dir)
+  dataset_io.save_results_frame(results_frame, output_dir, result_formats)
@@ -0,0 +1,237 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from ps import dataset_io
+from ps import gen_metrics
+from ps import result_cache
+from ps.metrics import kernels
+from ps.metrics import map as map_module
+
+
+def _write_dataset(dataset_dir, num_users=30, num_items=12, seed=0):
+  random = np.random.RandomState(seed)
+  for fold in ('1', '2'):
+    for split in ('base', 'test'):
+      with open(os.path.join(dataset_dir, f'u{fold}.{split}'), 'w') as f:
+        for user_id in range(1, num_users + 1):
+          for item_id in random.choice(num_items, 3, replace=False) + 1:
+            print(f'{user_id}\t{item_id}\t5', file=f)
+    for source in ('Alg', 'Other'):
+      with open(os.path.join(dataset_dir, f'u{fold}-{source}.out'), 'w') as f:
+        for user_id in range(1, num_users + 1):
+          item_ids = random.choice(num_items + 2, 10, replace=False) + 1
+          positions = ','.join(f'{item_id}:{10 - i}'
+                               for i, item_id in enumerate(item_ids))
+          print(f'{user_id}\t{{{positions}}}', file=f)
+
+
+class ComputeAllMetricsStreamingTest(unittest.TestCase):
+
+  def test_matches_in_memory_results(self):
+    with tempfile.TemporaryDirectory() as dataset_dir:
+      _write_dataset(dataset_dir)
+      ranking_set_by_id = dataset_io.load_ranking_sets(dataset_dir)
+      rating_set_by_fold = dataset_io.load_ratings_for_all_folds(dataset_dir)
+
+      expected = gen_metrics.compute_all_metrics(ranking_set_by_id,
+                                                 rating_set_by_fold)
+      streamed = gen_metrics.compute_all_metrics_streaming(
+          dataset_dir, rating_set_by_fold, block_size=7)
+
+    key_columns = ['metric', 'cutoff', 'fold', 'source']
+    self.assertEqual(expected[key_columns].values.tolist(),
+                     streamed[key_columns].values.tolist())
+    np.testing.assert_allclose(expected.value, streamed.value)
+
+
+class SplitSourceGroupsTest(unittest.TestCase):
+
+  def test_gives_every_worker_a_group(self):
+    ranking_sets_by_fold = {
+        fold: ['{}-{}'.format(fold, source) for source in range(5)]
+        for fold in ('1', '2')
+    }
+
+    groups = gen_metrics._split_source_groups(ranking_sets_by_fold, 5)
+
+    self.assertGreaterEqual(len(groups), 5)
+    self.assertEqual(
+        [ranking_set for ranking_sets in ranking_sets_by_fold.values()
+         for ranking_set in ranking_sets],
+        [ranking_set for group in groups for ranking_set in group])
+    for group in groups:
+      self.assertEqual(1, len({ranking_set[0] for ranking_set in group}))
+
+  def test_keeps_folds_whole_for_one_worker(self):
+    ranking_sets_by_fold = {'1': ['a', 'b'], '2': ['c']}
+
+    self.assertEqual([['a', 'b'], ['c']],
+                     gen_metrics._split_source_groups(ranking_sets_by_fold, 1))
+
+
+class ComputeAllMetricsTest(unittest.TestCase):
+
+  def test_interned_ids_give_the_same_results(self):
+    with tempfile.TemporaryDirectory() as dataset_dir:
+      _write_dataset(dataset_dir)
+      ranking_set_by_id = dataset_io.load_ranking_sets(dataset_dir)
+      rating_set_by_fold = dataset_io.load_ratings_for_all_folds(dataset_dir)
+      dataset = dataset_io.load_dataset(dataset_dir)
+
+    expected = gen_metrics.compute_all_metrics(ranking_set_by_id,
+                                               rating_set_by_fold)
+    interned = gen_metrics.compute_all_metrics(dataset.ranking_set_by_id,
+                                               dataset.rating_set_by_fold)
+
+    np.testing.assert_allclose(expected.value, interned.value)
+
+  def test_user_values_average_to_results(self):
+    with tempfile.TemporaryDirectory() as dataset_dir:
+      _write_dataset(dataset_dir)
+      dataset = dataset_io.load_dataset(dataset_dir)
+
+    expected = gen_metrics.compute_all_metrics(dataset.ranking_set_by_id,
+                                               dataset.rating_set_by_fold)
+    user_values = gen_metrics.compute_all_user_values(
+        dataset.ranking_set_by_id, dataset.rating_set_by_fold)
+
+    self.assertEqual(np.float32, user_values.value.dtype)
+    self.assertNotIn('Coverage', set(user_values.metric))
+    expected = expected[expected.metric.isin(set(user_values.metric))]
+    means = user_values.groupby(['metric', 'cutoff', 'fold', 'source'],
+                                observed=True).value.mean()
+    np.testing.assert_allclose(
+        expected.set_index(['metric', 'cutoff', 'fold', 'source']).value,
+        means.loc[expected.set_index(['metric', 'cutoff', 'fold',
+                                      'source']).index],
+        rtol=1e-6)
+
+  def test_sizes_the_pool_by_num_workers(self):
+    with tempfile.TemporaryDirectory() as dataset_dir:
+      _write_dataset(dataset_dir)
+      dataset = dataset_io.load_dataset(dataset_dir)
+
+    with mock.patch.object(
+        gen_metrics.parallel, 'map_parallel',
+        wraps=gen_metrics.parallel.map_parallel) as mock_map:
+      gen_metrics.compute_all_metrics(
+          dataset.ranking_set_by_id,
+          dataset.rating_set_by_fold,
+          num_workers=1)
+
+    self.assertEqual(1, mock_map.call_args.kwargs['num_workers'])
+    # One task per fold is enough for a single worker.
+    self.assertEqual(2, len(mock_map.call_args.args[1]))
+
+  def test_collects_user_values_in_the_same_pass(self):
+    with tempfile.TemporaryDirectory() as dataset_dir:
+      _write_dataset(dataset_dir)
+      dataset = dataset_io.load_dataset(dataset_dir)
+
+    with mock.patch.object(
+        gen_metrics, '_compute_metrics',
+        wraps=gen_metrics._compute_metrics) as mock_compute:
+      results, user_values = gen_metrics.compute_all_metrics(
+          dataset.ranking_set_by_id,
+          dataset.rating_set_by_fold,
+          with_user_values=True)
+    mock_compute.assert_called_once()
+
+    pd.testing.assert_frame_equal(
+        gen_metrics.compute_all_metrics(dataset.ranking_set_by_id,
+                                        dataset.rating_set_by_fold), results)
+    pd.testing.assert_frame_equal(
+        gen_metrics.compute_all_user_values(dataset.ranking_set_by_id,
+                                            dataset.rating_set_by_fold),
+        user_values)
+
+
+class ComputeAllMetricsCachedTest(unittest.TestCase):
+
+  def _compute(self, dataset_dir, cache):
+    dataset = dataset_io.load_dataset(dataset_dir)
+    return gen_metrics.compute_all_metrics(
+        dataset.ranking_set_by_id,
+        dataset.rating_set_by_fold,
+        result_cache=cache,
+        dataset_hashes=dataset_io.hash_dataset_files(dataset_dir))
+
+  def test_computes_only_new_ranking_files(self):
+    with tempfile.TemporaryDirectory() as dataset_dir:
+      _write_dataset(dataset_dir)
+      cache = result_cache.ResultCache(
+          os.path.join(dataset_dir, 'results.sqlite'))
+      first = self._compute(dataset_dir, cache)
+
+      with mock.patch.object(
+          gen_metrics, '_compute_metrics',
+          wraps=gen_metrics._compute_metrics) as mock_compute:
+        cached = self._compute(dataset_dir, cache)
+        # Results are keyed by content, so renamed files are not recomputed.
+        os.rename(
+            os.path.join(dataset_dir, 'u1-Other.out'),
+            os.path.join(dataset_dir, 'u1-Renamed.out'))
+        renamed = self._compute(dataset_dir, cache)
+        mock_compute.assert_not_called()
+
+        with open(os.path.join(dataset_dir, 'u1-New.out'), 'w') as f:
+          f.write('1\t{3:2.0,4:1.0}\n')
+        self._compute(dataset_dir, cache)
+      cache.close()
+
+    pd.testing.assert_frame_equal(first, cached)
+    self.assertEqual(
+        first[(first.fold == '1') & (first.source == 'Other')].value.tolist(),
+        renamed[renamed.source == 'Renamed'].value.tolist())
+    computed_ids = {
+        ranking_set_id for call in mock_compute.call_args_list
+        for ranking_set_id in call.args[1]
+    }
+    self.assertEqual({dataset_io.RankingSetId('1', 'New')}, computed_ids)
+
+  def test_version_covers_imported_modules_and_backend(self):
+    settings = gen_metrics.MetricSettings(
+        constructor=map_module.MAP, cutoffs=[10], multiprocess=False)
+    context = mock.Mock(distance_store=None, num_hashes=None)
+    version = gen_metrics._result_version(settings, context)
+
+    modules = gen_metrics._imported_ps_modules(map_module)
+    with mock.patch.object(kernels, 'get_backend', return_value='other'):
+      other_backend_version = gen_metrics._result_version(settings, context)
+
+    self.assertIn('ps.metrics.kernels', modules)
+    self.assertIn('ps.metrics.metric_utils', modules)
+    self.assertIn('ps.dataset_io', modules)
+    self.assertNotEqual(version, other_backend_version)
+
+  def test_requires_dataset_hashes(self):
+    with self.assertRaises(ValueError):
+      gen_metrics.compute_all_metrics({}, {}, result_cache=mock.Mock())
+
+
+class MainTest(unittest.TestCase):
+
+  def test_stores_distances_only_when_asked(self):
+    with tempfile.TemporaryDirectory() as dataset_dir, \
+        tempfile.TemporaryDirectory() as output_dir:
+      _write_dataset(dataset_dir)
+      distances_dir = os.path.join(
+          dataset_io.default_cache_dir(dataset_dir), 'distances')
+
+      gen_metrics.main(dataset_dir, output_dir, num_workers=1,
+                       result_formats=['csv'])
+      self.assertFalse(os.path.exists(distances_dir))
+
+      gen_metrics.main(dataset_dir, output_dir, num_workers=1,
+                       result_formats=['csv'], use_result_cache=False,
+                       store_distances=True)
+      self.assertTrue(os.listdir(distances_dir))
+
+
+if __name__ == '__main__':
+  unittest.main()
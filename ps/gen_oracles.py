@@ -3,7 +3,9 @@ import logging
 import os.path
 
 from ps import dataset_io
+from ps import fold_context
 from ps import gen_metrics
+from ps import item_distances
 from ps import logging_utils
 
 from ps.oracles import eild_oracle
@@ -16,27 +18,40 @@ _ORACLES = [
   map_oracle.MAPOracle,
 ]
 
+_INPUT_CUTOFF = 20
+_OUTPUT_CUTOFF = 10
+
+
+def _oracle_artifacts():
+  return sorted({
+      name for oracle_constructor in _ORACLES
+      for name in oracle_constructor.ARTIFACTS
+  })
+
 
 def _compute_oracle_rankings(oracle_constructor, ranking_set_by_id,
-                             rating_set_by_fold):
+                             rating_set_by_fold, context=None):
   logging.info('Creating oracle rankings for %s', str(oracle_constructor))
 
-  oracle = oracle_constructor(ranking_set_by_id, rating_set_by_fold)
+  oracle = oracle_constructor(ranking_set_by_id, rating_set_by_fold,
+                              context=context)
 
   folds = rating_set_by_fold.keys()
 
-  return [oracle.compute_optimal_ranking_set(fold, input_cutoff=20, output_cutoff=10)
+  return [oracle.compute_optimal_ranking_set(fold, input_cutoff=_INPUT_CUTOFF,
+                                             output_cutoff=_OUTPUT_CUTOFF)
           for fold in folds]
 
 
 
-def _compute_all_oracle_rankings(ranking_set_by_id, rating_set_by_fold):
+def _compute_all_oracle_rankings(ranking_set_by_id, rating_set_by_fold,
+                                 context=None):
   logging.info('Creating oracle rankings for all metrics')
 
   created_ranking_sets_by_id = {}
   for oracle_constructor in _ORACLES:
-    created_ranking_sets = _compute_oracle_rankings(oracle_constructor, ranking_set_by_id,
-                            rating_set_by_fold)
+    created_ranking_sets = _compute_oracle_rankings(
+        oracle_constructor, ranking_set_by_id, rating_set_by_fold, context)
     for ranking_set in created_ranking_sets:
       created_ranking_sets_by_id[ranking_set.id] = ranking_set
   return created_ranking_sets_by_id
@@ -57,23 +72,53 @@ def _save_ranking_set_to_file(ranking_set, f):
     print(row_string, file=f)
 
 
-def _save_ranking_sets(ranking_set_by_id, output_dir):
+def _save_ranking_sets(ranking_set_by_id, output_dir, user_vocabulary,
+                       item_vocabulary):
   for ranking_set_id, ranking_set in ranking_set_by_id.items():
     output_path = os.path.join(
         output_dir, f'u{ranking_set_id.fold}-{ranking_set_id.source}.out')
+    raw_ranking_set = ranking_set._replace(
+        matrix=item_vocabulary.to_raw(ranking_set.matrix),
+        user_ids=user_vocabulary.to_raw(ranking_set.user_ids))
     with open(output_path, 'w') as f:
-      _save_ranking_set_to_file(ranking_set, f)
-
-
-def main(dataset_dir, output_dir):
-  logging.info('Loading ranking sets')
-  ranking_set_by_id = dataset_io.load_ranking_sets(dataset_dir)
-  logging.info('Loading rating sets')
-  rating_set_by_fold = dataset_io.load_ratings_for_all_folds(dataset_dir)
+      _save_ranking_set_to_file(raw_ranking_set, f)
+
+
+def main(dataset_dir,
+         output_dir,
+         num_workers=None,
+         result_formats=None,
+         num_hashes=None,
+         store_distances=False):
+  logging.info('Loading dataset')
+  cache_dir = dataset_io.default_cache_dir(dataset_dir)
+  dataset = dataset_io.load_dataset(
+      dataset_dir,
+      max_depth=_INPUT_CUTOFF,
+      cache_dir=cache_dir,
+      num_workers=num_workers)
+  # Shared by the oracles and the metrics computed on their rankings, so each
+  # fold's hits, popularity and distances are computed once.
+  distance_store = (item_distances.default_distance_store(cache_dir)
+                    if store_distances else None)
+  context = fold_context.FoldContext(dataset.rating_set_by_fold,
+                                     dataset.ranking_set_by_id, distance_store,
+                                     num_hashes)
+  context.prefetch(
+      sorted(set(_oracle_artifacts()) | set(gen_metrics.metric_artifacts())),
+      num_workers)
+  ranking_set_by_id = dataset.ranking_set_by_id
+  rating_set_by_fold = dataset.rating_set_by_fold
   logging_utils.log_stats_for_folds(rating_set_by_fold)
   logging.info('Done loading')
-  created_ranking_sets_by_id = _compute_all_oracle_rankings(ranking_set_by_id, rating_set_by_fold)
-  _save_ranking_sets(created_ranking_sets_by_id, output_dir)
-  results_frame = gen_metrics.compute_all_metrics(created_ranking_sets_by_id, rating_set_by_fold)
-  dataset_io.save_results_frame(results_frame, output_dir)
-
+  created_ranking_sets_by_id = _compute_all_oracle_rankings(
+      ranking_set_by_id, rating_set_by_fold, context)
+  _save_ranking_sets(created_ranking_sets_by_id, output_dir,
+                     dataset.user_vocabulary, dataset.item_vocabulary)
+  results_frame = gen_metrics.compute_all_metrics(
+      created_ranking_sets_by_id,
+      rating_set_by_fold,
+      context,
+      num_workers=num_workers)
+  context.log_stats()
+  dataset_io.save_results_frame(results_frame, output_dir, result_formats)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ps import dataset_io
+from ps import gen_oracles
+
+
+def _write_dataset(dataset_dir, num_users=20, num_items=15, seed=0):
+  random = np.random.RandomState(seed)
+  for fold in ('1', '2'):
+    for split in ('base', 'test'):
+      with open(os.path.join(dataset_dir, f'u{fold}.{split}'), 'w') as f:
+        for user_id in range(1, num_users + 1):
+          for item_id in random.choice(num_items, 4, replace=False) + 1:
+            print(f'{user_id}\t{item_id}\t5', file=f)
+    with open(os.path.join(dataset_dir, f'u{fold}-Alg.out'), 'w') as f:
+      for user_id in range(1, num_users + 1):
+        item_ids = random.choice(num_items, 12, replace=False) + 1
+        positions = ','.join(f'{item_id}:{12 - i}'
+                             for i, item_id in enumerate(item_ids))
+        print(f'{user_id}\t[{positions}]', file=f)
+
+
+class MainTest(unittest.TestCase):
+
+  def test_saves_oracle_rankings_and_their_metrics(self):
+    with tempfile.TemporaryDirectory() as dataset_dir, \
+        tempfile.TemporaryDirectory() as output_dir:
+      _write_dataset(dataset_dir)
+
+      gen_oracles.main(dataset_dir, output_dir, num_workers=1,
+                       result_formats=['csv'])
+
+      reloaded = dataset_io.load_ranking_sets(output_dir)
+      results = pd.read_csv(os.path.join(output_dir, 'output.csv'))
+
+    self.assertEqual(
+        {dataset_io.RankingSetId(fold, oracle.__name__)
+         for fold in ('1', '2') for oracle in gen_oracles._ORACLES},
+        set(reloaded))
+    self.assertEqual({oracle.__name__ for oracle in gen_oracles._ORACLES},
+                     set(results.source))
+    self.assertFalse(results.value.isna().any())
+
+
+class SaveRankingSetsTest(unittest.TestCase):
+
+  def test_saves_raw_ids(self):
+    user_vocabulary = dataset_io.IdVocabulary([7, 9])
+    item_vocabulary = dataset_io.IdVocabulary([100, 200, 300])
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('1', 'MAPOracle'),
+        matrix=np.array([[2., 0.], [1., 2.]]),
+        user_ids=[0, 1])
+
+    with tempfile.TemporaryDirectory() as output_dir:
+      gen_oracles._save_ranking_sets({ranking_set.id: ranking_set}, output_dir,
+                                     user_vocabulary, item_vocabulary)
+      reloaded = dataset_io.load_ranking_sets(output_dir)
+
+    reloaded_set = reloaded[dataset_io.RankingSetId('1', 'MAPOracle')]
+    self.assertEqual([7, 9], reloaded_set.user_ids.tolist())
+    self.assertEqual([[300, 100], [200, 300]], reloaded_set.matrix.tolist())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,418 @@
+"""Cosine distances between the likers of pairs of items.
+
+Metrics look distances up by item id through pair_distances and
+distance_sums (or, to map item ids to positions once, through positions and
+distances_at), so they work the same with a precomputed matrix
+(DenseItemDistances or, in half the space, CondensedItemDistances) and with
+distances computed on demand (ItemDistances), exactly or estimated from
+MinHash signatures (MinHashItemDistances). A DistanceStore keeps precomputed
+distances on disk, so metrics, oracles and later runs over the same ratings
+share them.
+"""
+import collections
+import hashlib
+import os
+
+import numpy as np
+from scipy import sparse
+
+from ps import array_store
+from ps import rating_utils
+
+_STORE_FORMAT_VERSION = 2
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def _find_positions(sorted_item_ids, item_ids):
+  """Returns the position of each item id in sorted_item_ids, or -1."""
+  item_ids = np.asarray(item_ids)
+  if not len(sorted_item_ids):
+    return np.full(item_ids.shape, -1, dtype='int64')
+  positions = np.searchsorted(sorted_item_ids, item_ids)
+  positions = np.minimum(positions, len(sorted_item_ids) - 1)
+  return np.where(sorted_item_ids[positions] == item_ids, positions, -1)
+
+
+def _compute_normalized_likers_matrix(rating_set, dtype):
+  """Returns the item x user matrix with unit rows, and the item ids."""
+  likers_matrix, item_ids = rating_utils._compute_likers_matrix(
+      rating_set, dtype)
+  norms = np.sqrt(likers_matrix.getnnz(axis=1)).astype(dtype)
+  inverse_norms = 1 / np.where(norms > 0, norms, 1)
+  return sparse.csr_matrix(sparse.diags(inverse_norms) @ likers_matrix), item_ids
+
+
+def _compute_distance_sums(rows, normalized_matrix):
+  # The distances from an item to all n rated items add up to n minus the
+  # dot product of its normalized likers with the sum of all of them.
+  liker_totals = np.asarray(normalized_matrix.sum(axis=0)).ravel()
+  return normalized_matrix.shape[0] - rows @ liker_totals
+
+
+class _ItemDistances(object):
+  """Looks distances up by item id.
+
+  Subclasses set item_ids (sorted), dtype and _sums, the sum of the distances
+  from each item to every rated item, and implement _known_distances.
+  """
+
+  def _known_distances(self, a_positions, b_positions):
+    raise NotImplementedError
+
+  def positions(self, item_ids):
+    """Returns the position of each item id, or -1 if it has no distances."""
+    return _find_positions(self.item_ids, item_ids)
+
+  def distances_at(self, a_positions, b_positions):
+    """Returns the distances between the items at a and b positions.
+
+    The positions are broadcast against each other. Position -1 is at
+    distance 0 from everything.
+    """
+    a_positions, b_positions = np.broadcast_arrays(a_positions, b_positions)
+    known = (a_positions >= 0) & (b_positions >= 0)
+    distances = np.zeros(a_positions.shape, dtype=self.dtype)
+    distances[known] = self._known_distances(a_positions[known],
+                                             b_positions[known])
+    return distances
+
+  def pair_distances(self, a_item_ids, b_item_ids):
+    """Returns the distance between a_item_ids[i] and b_item_ids[i].
+
+    Items without distances (e.g. that no one rated) are at distance 0 from
+    everything.
+    """
+    return self.distances_at(
+        self.positions(a_item_ids), self.positions(b_item_ids))
+
+  def distance_sums(self, item_ids):
+    """Returns the sum of the distances from each item to every rated item."""
+    positions = self.positions(item_ids)
+    known = positions >= 0
+    sums = np.zeros(positions.shape, dtype=self.dtype)
+    sums[known] = self._sums[positions[known]]
+    return sums
+
+
+class DenseItemDistances(_ItemDistances):
+  """Looks distances up in a precomputed items x items matrix."""
+
+  def __init__(self, matrix, item_ids):
+    # Memory-mapped matrices stay mapped, so they pickle as a file reference.
+    self.matrix = np.asanyarray(matrix)
+    self.dtype = self.matrix.dtype
+    item_ids = np.asarray(item_ids)
+    self._order = np.argsort(item_ids, kind='stable')
+    self.item_ids = item_ids[self._order]
+
+  @property
+  def _sums(self):
+    return self.matrix.sum(axis=0)
+
+  def positions(self, item_ids):
+    positions = _find_positions(self.item_ids, item_ids)
+    return np.where(positions >= 0, self._order[positions], -1)
+
+  def _known_distances(self, a_positions, b_positions):
+    return self.matrix[a_positions, b_positions]
+
+
+class ItemDistances(_ItemDistances):
+  """Computes distances on demand, in square blocks of items.
+
+  Only candidate items (by default, every rated item) can be looked up, so
+  restricting them to the items that are actually ranked keeps the blocks
+  that get computed dense with useful pairs. Up to max_cached_blocks blocks
+  are kept, least recently used first out, so memory stays bounded by
+  max_cached_blocks * block_size**2 values however large the catalog is.
+  """
+
+  def __init__(self,
+               rating_set,
+               candidate_item_ids=None,
+               dtype='float64',
+               block_size=1024,
+               max_cached_blocks=32):
+    normalized_matrix, rated_item_ids = _compute_normalized_likers_matrix(
+        rating_set, dtype)
+
+    if candidate_item_ids is None:
+      positions = np.arange(len(rated_item_ids))
+    else:
+      positions = _find_positions(rated_item_ids,
+                                  np.unique(candidate_item_ids))
+      positions = positions[positions >= 0]
+    self.item_ids = rated_item_ids[positions]
+    self._rows = sparse.csr_matrix(normalized_matrix[positions])
+    self._sums = _compute_distance_sums(self._rows, normalized_matrix)
+
+    self.dtype = np.dtype(dtype)
+    self.block_size = block_size
+    self.max_cached_blocks = max_cached_blocks
+    self._num_blocks = max(1, -(-len(self.item_ids) // block_size))
+    self._blocks = collections.OrderedDict()
+
+  def __getstate__(self):
+    # Worker processes fill their own cache.
+    state = self.__dict__.copy()
+    state['_blocks'] = collections.OrderedDict()
+    return state
+
+  def _compute_block(self, row_block, column_block):
+    size = self.block_size
+    rows = self._rows[row_block * size:(row_block + 1) * size]
+    columns = self._rows[column_block * size:(column_block + 1) * size]
+
+    block = (rows @ columns.T).toarray()
+    np.subtract(1, block, out=block)
+    np.maximum(block, 0, out=block)
+    if row_block == column_block:
+      np.fill_diagonal(block, 0)
+    return block
+
+  def _block(self, row_block, column_block):
+    key = (row_block, column_block)
+    block = self._blocks.get(key)
+    if block is not None:
+      self._blocks.move_to_end(key)
+      return block
+
+    block = self._compute_block(row_block, column_block)
+    self._blocks[key] = block
+    if len(self._blocks) > self.max_cached_blocks:
+      self._blocks.popitem(last=False)
+    return block
+
+  def _known_distances(self, a_positions, b_positions):
+    # Distances are symmetric, so only blocks on or above the diagonal are
+    # ever computed.
+    low_positions = np.minimum(a_positions, b_positions)
+    high_positions = np.maximum(a_positions, b_positions)
+    row_blocks, row_offsets = np.divmod(low_positions, self.block_size)
+    column_blocks, column_offsets = np.divmod(high_positions, self.block_size)
+
+    block_keys = row_blocks * self._num_blocks + column_blocks
+    unique_keys, block_indices = np.unique(block_keys, return_inverse=True)
+    order = np.argsort(block_indices, kind='stable')
+    bounds = np.searchsorted(block_indices[order],
+                             np.arange(len(unique_keys) + 1))
+
+    values = np.empty(len(block_keys), dtype=self.dtype)
+    for i, block_key in enumerate(unique_keys):
+      selected = order[bounds[i]:bounds[i + 1]]
+      block = self._block(*divmod(int(block_key), self._num_blocks))
+      values[selected] = block[row_offsets[selected], column_offsets[selected]]
+
+    return values
+
+
+class MinHashItemDistances(_ItemDistances):
+  """Estimates distances from MinHash signatures of the likers of each item.
+
+  The fraction of the num_hashes min-hashes two items share estimates the
+  Jaccard similarity J of their likers, which the set sizes turn into a
+  cosine similarity: |A & B| = J * (|A| + |B|) / (1 + J). The standard error
+  of J is about sqrt(J * (1 - J) / num_hashes), so fewer hashes trade
+  accuracy for speed. Signatures take num_hashes * 4 bytes per item, and
+  building them reads each rating num_hashes times.
+
+  Distance sums are cheap to get exactly, so they are not estimated.
+  """
+
+  def __init__(self, rating_set, num_hashes=128, seed=0, chunk_size=1 << 16):
+    normalized_matrix, self.item_ids = _compute_normalized_likers_matrix(
+        rating_set, 'float64')
+    self.dtype = np.dtype('float64')
+    self.num_hashes = num_hashes
+    self.chunk_size = chunk_size
+    self._num_likers = normalized_matrix.getnnz(axis=1).astype('float64')
+    self._sums = _compute_distance_sums(normalized_matrix, normalized_matrix)
+
+    random = np.random.RandomState(seed)
+    multipliers = random.randint(1, _MERSENNE_PRIME, num_hashes, 'int64')
+    increments = random.randint(0, _MERSENNE_PRIME, num_hashes, 'int64')
+    user_columns = np.arange(normalized_matrix.shape[1], dtype='int64')
+    starts = normalized_matrix.indptr[:-1]
+
+    self._signatures = np.empty((len(self.item_ids), num_hashes),
+                                dtype='uint32')
+    if len(self.item_ids):
+      for h in range(num_hashes):
+        user_hashes = (multipliers[h] * user_columns +
+                       increments[h]) % _MERSENNE_PRIME
+        self._signatures[:, h] = np.minimum.reduceat(
+            user_hashes[normalized_matrix.indices], starts)
+
+  def _known_distances(self, a_positions, b_positions):
+    shared = np.empty(len(a_positions))
+    for start in range(0, len(a_positions), self.chunk_size):
+      stop = start + self.chunk_size
+      shared[start:stop] = np.count_nonzero(
+          self._signatures[a_positions[start:stop]] ==
+          self._signatures[b_positions[start:stop]],
+          axis=1)
+    jaccard = shared / self.num_hashes
+
+    a_sizes = self._num_likers[a_positions]
+    b_sizes = self._num_likers[b_positions]
+    intersection = jaccard * (a_sizes + b_sizes) / (1 + jaccard)
+    cosine = np.minimum(intersection / np.sqrt(a_sizes * b_sizes), 1)
+    return np.where(a_positions == b_positions, 0, 1 - cosine)
+
+
+DistanceErrorReport = collections.namedtuple(
+    'DistanceErrorReport', ('num_pairs', 'mean_absolute_error',
+                            'root_mean_squared_error', 'max_absolute_error'))
+
+
+def report_distance_error(distances, rating_set, num_pairs=10000, seed=0):
+  """Compares distances with the exact ones on random pairs of rated items.
+
+  distances -- Any of the distance classes in this module, usually an
+      approximate one.
+  """
+  normalized_matrix, item_ids = _compute_normalized_likers_matrix(
+      rating_set, 'float64')
+  if not len(item_ids):
+    return DistanceErrorReport(0, 0., 0., 0.)
+
+  random = np.random.RandomState(seed)
+  a_positions = random.randint(len(item_ids), size=num_pairs)
+  b_positions = random.randint(len(item_ids), size=num_pairs)
+
+  cosine = np.asarray(normalized_matrix[a_positions].multiply(
+      normalized_matrix[b_positions]).sum(axis=1)).ravel()
+  exact = np.where(a_positions == b_positions, 0,
+                   1 - np.minimum(cosine, 1))
+  errors = np.abs(
+      distances.pair_distances(item_ids[a_positions], item_ids[b_positions]) -
+      exact)
+
+  return DistanceErrorReport(num_pairs, errors.mean(),
+                             np.sqrt((errors**2).mean()), errors.max())
+
+
+def _condensed_offsets(rows, num_items):
+  """Returns where the pairs (i, j > i) of each row i start in the vector."""
+  rows = np.asarray(rows, dtype='int64')
+  return rows * num_items - rows * (rows + 1) // 2
+
+
+class CondensedItemDistances(_ItemDistances):
+  """Keeps each distance between two different items once.
+
+  The distance between the i-th and j-th items, i < j, is at position
+  i * n - i * (i + 1) / 2 + j - i - 1 of a vector of n * (n - 1) / 2 values,
+  the same layout as scipy.spatial.distance.squareform.
+  """
+
+  def __init__(self, values, item_ids, sums):
+    self.values = values
+    self.dtype = values.dtype
+    self.item_ids = np.asarray(item_ids)
+    self._sums = sums
+
+  @classmethod
+  def from_rating_set(cls, rating_set, dtype='float32', block_size=1024):
+    """Computes the distances of the base ratings, block_size rows at a time.
+
+    Each block only multiplies its rows by the items from its first row on,
+    so every pair is computed once.
+    """
+    normalized_matrix, item_ids = _compute_normalized_likers_matrix(
+        rating_set, dtype)
+    num_items = len(item_ids)
+    values = np.empty(num_items * (num_items - 1) // 2, dtype=dtype)
+    sums = np.zeros(num_items)
+
+    for start in range(0, num_items, block_size):
+      stop = min(start + block_size, num_items)
+      block = (normalized_matrix[start:stop] @ normalized_matrix[start:].T)
+      block = block.toarray()
+      np.subtract(1, block, out=block)
+      np.maximum(block, 0, out=block)
+      # Only pairs (i, j > i) are kept; the rest of the block is zeroed so
+      # that it doesn't count towards the sums either. Rows are copied one
+      # slice at a time, to avoid index arrays as large as the block.
+      offsets = _condensed_offsets(range(start, stop + 1), num_items)
+      for r in range(stop - start):
+        block[r, :r + 1] = 0
+        values[offsets[r]:offsets[r + 1]] = block[r, r + 1:]
+      sums[start:stop] += block.sum(axis=1, dtype='float64')
+      sums[start:] += block.sum(axis=0, dtype='float64')
+
+    return cls(values, item_ids, sums)
+
+  def _known_distances(self, a_positions, b_positions):
+    distances = np.zeros(len(a_positions), dtype=self.dtype)
+    different = a_positions != b_positions
+    low_positions = np.minimum(a_positions, b_positions)[different]
+    high_positions = np.maximum(a_positions, b_positions)[different]
+    distances[different] = self.values[
+        _condensed_offsets(low_positions, len(self.item_ids)) +
+        high_positions - low_positions - 1]
+    return distances
+
+  def to_matrix(self):
+    """Returns the square matrix of all distances, and its item ids."""
+    num_items = len(self.item_ids)
+    matrix = np.zeros((num_items, num_items), dtype=self.values.dtype)
+    upper_indices = np.triu_indices(num_items, k=1)
+    matrix[upper_indices] = self.values
+    matrix.T[upper_indices] = self.values
+    return matrix, self.item_ids.tolist()
+
+
+def _hash_likers(rating_set):
+  by_item = rating_set.base.by_item
+  digest = hashlib.sha256()
+  for array in (by_item.keys, by_item.indptr, by_item.values):
+    digest.update(np.ascontiguousarray(array, dtype='int64').tobytes())
+  return digest.hexdigest()
+
+
+class DistanceStore(object):
+  """Saves the distances of each set of base ratings on disk.
+
+  Distances are keyed by a hash of the ratings they are computed from and
+  loaded memory-mapped, so they are computed once for all metrics, oracles
+  and runs, and worker processes share the mapped pages. They are kept
+  condensed, in n * (n - 1) / 2 values for n rated items.
+  """
+
+  def __init__(self, root_dir, dtype='float32'):
+    self._store = array_store.ArrayStore(root_dir)
+    self.dtype = np.dtype(dtype)
+
+  def load(self, rating_set):
+    """Returns the CondensedItemDistances of the base ratings of rating_set."""
+    key = '{}-{}'.format(_hash_likers(rating_set), self.dtype.name)
+    signature = repr((_STORE_FORMAT_VERSION, key))
+
+    arrays = self._store.load(key, signature)
+    if arrays is None:
+      distances = CondensedItemDistances.from_rating_set(
+          rating_set, self.dtype)
+      arrays = {
+          'values': distances.values,
+          'item_ids': distances.item_ids,
+          'sums': distances._sums
+      }
+      if self._store.save(key, signature, arrays):
+        arrays = self._store.load(key, signature)
+
+    return CondensedItemDistances(arrays['values'], arrays['item_ids'],
+                                  arrays['sums'])
+
+
+def default_distance_store(cache_dir):
+  return DistanceStore(os.path.join(cache_dir, 'distances'))
+
+
+def compute_ranked_items(ranking_sets):
+  """Returns the sorted ids of all items in the rankings, or None if empty."""
+  item_ids = [np.unique(ranking_set.matrix) for ranking_set in ranking_sets]
+  if not item_ids:
+    return None
+  return np.unique(np.concatenate(item_ids))
@@ -0,0 +1,297 @@
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from ps import dataset_io
+from ps import item_distances
+from ps import rating_utils
+
+
+def _make_rating_set(num_users=40, num_items=30, seed=0):
+  random = np.random.RandomState(seed)
+  data = [(user_id, item_id, 5)
+          for user_id in range(1, num_users)
+          for item_id in random.choice(num_items, random.randint(1, 10))]
+  rating_set = dataset_io.RatingSet(fold='u1')
+  rating_set.base = pd.DataFrame.from_records(
+      columns=['user_id', 'item_id', 'rating'], data=data)
+  return rating_set
+
+
+def _compute_distance_matrix(rating_set):
+  """Computes the distances one pair of liker sets at a time, as reference."""
+  likers_by_item = rating_utils._compute_likers(rating_set)
+  item_ids = sorted(likers_by_item)
+  matrix = np.array([[
+      1 - rating_utils._cosine_similarity(likers_by_item[item_i],
+                                          likers_by_item[item_j])
+      for item_j in item_ids
+  ] for item_i in item_ids]).reshape(len(item_ids), len(item_ids))
+  return matrix, item_ids
+
+
+class ItemDistancesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.rating_set = _make_rating_set()
+    self.matrix, self.item_ids = _compute_distance_matrix(
+        self.rating_set)
+    self.dense_distances = item_distances.DenseItemDistances(
+        self.matrix, self.item_ids)
+
+  def _all_pairs(self):
+    a_item_ids, b_item_ids = np.meshgrid(self.item_ids, self.item_ids)
+    return a_item_ids.ravel(), b_item_ids.ravel()
+
+  def test_matches_dense_matrix(self):
+    distances = item_distances.ItemDistances(
+        self.rating_set, block_size=4, max_cached_blocks=3)
+    a_item_ids, b_item_ids = self._all_pairs()
+
+    np.testing.assert_allclose(
+        self.dense_distances.pair_distances(a_item_ids, b_item_ids),
+        distances.pair_distances(a_item_ids, b_item_ids),
+        atol=1e-12)
+    self.assertLessEqual(len(distances._blocks), 3)
+
+  def test_matches_dense_matrix_in_float32(self):
+    distances = item_distances.ItemDistances(
+        self.rating_set, dtype='float32', block_size=8)
+    a_item_ids, b_item_ids = self._all_pairs()
+
+    values = distances.pair_distances(a_item_ids, b_item_ids)
+
+    self.assertEqual(np.float32, values.dtype)
+    np.testing.assert_allclose(
+        self.dense_distances.pair_distances(a_item_ids, b_item_ids),
+        values,
+        atol=1e-6)
+
+  def test_restricts_to_candidates(self):
+    candidate_item_ids = np.array([-1, self.item_ids[3], self.item_ids[1]])
+    distances = item_distances.ItemDistances(
+        self.rating_set, candidate_item_ids=candidate_item_ids)
+
+    self.assertEqual([self.item_ids[1], self.item_ids[3]],
+                     distances.item_ids.tolist())
+    self.assertAlmostEqual(
+        self.matrix[1, 3],
+        distances.pair_distances([self.item_ids[3]], [self.item_ids[1]])[0])
+    self.assertEqual(
+        0, distances.pair_distances([self.item_ids[0]], [self.item_ids[1]])[0])
+
+  def test_unknown_items_are_at_distance_zero(self):
+    distances = item_distances.ItemDistances(self.rating_set)
+
+    values = distances.pair_distances([-1, 1000, self.item_ids[0]],
+                                      [self.item_ids[1], self.item_ids[0], -1])
+
+    self.assertEqual([0, 0, 0], values.tolist())
+
+  def test_distance_sums_cover_all_rated_items(self):
+    candidate_item_ids = self.item_ids[::2]
+    distances = item_distances.ItemDistances(
+        self.rating_set, candidate_item_ids=candidate_item_ids)
+
+    np.testing.assert_allclose(
+        self.matrix.sum(axis=0)[::2],
+        distances.distance_sums(candidate_item_ids),
+        atol=1e-9)
+
+  def test_broadcasts_positions(self):
+    distances = item_distances.ItemDistances(self.rating_set, block_size=4)
+    positions = distances.positions([[self.item_ids[0], -1, self.item_ids[2]]])
+
+    values = distances.distances_at(positions[:, :, None], positions[:, None, :])
+
+    self.assertEqual((1, 3, 3), values.shape)
+    np.testing.assert_allclose(
+        [[self.matrix[0, 0], 0, self.matrix[0, 2]], [0, 0, 0],
+         [self.matrix[2, 0], 0, self.matrix[2, 2]]],
+        values[0],
+        atol=1e-12)
+
+  def test_pickles_without_cached_blocks(self):
+    distances = item_distances.ItemDistances(self.rating_set)
+    distances.pair_distances(self.item_ids, self.item_ids[::-1])
+
+    unpickled = pickle.loads(pickle.dumps(distances))
+
+    self.assertFalse(unpickled._blocks)
+    np.testing.assert_allclose(
+        distances.pair_distances(self.item_ids, self.item_ids[::-1]),
+        unpickled.pair_distances(self.item_ids, self.item_ids[::-1]))
+
+
+class CondensedItemDistancesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.rating_set = _make_rating_set()
+    self.matrix, self.item_ids = _compute_distance_matrix(
+        self.rating_set)
+
+  def test_matches_dense_matrix(self):
+    for dtype, tolerance in [('float64', 1e-12), ('float32', 1e-6)]:
+      distances = item_distances.CondensedItemDistances.from_rating_set(
+          self.rating_set, dtype=dtype, block_size=7)
+      num_items = len(self.item_ids)
+
+      self.assertEqual(num_items * (num_items - 1) // 2,
+                       len(distances.values))
+      self.assertEqual(dtype, distances.values.dtype)
+      matrix, item_ids = distances.to_matrix()
+      self.assertEqual(self.item_ids, item_ids)
+      np.testing.assert_allclose(self.matrix, matrix, atol=tolerance)
+
+  def test_gathers_pairs(self):
+    distances = item_distances.CondensedItemDistances.from_rating_set(
+        self.rating_set, dtype='float64', block_size=4)
+    a_item_ids, b_item_ids = np.meshgrid(self.item_ids + [-1, 1000],
+                                         self.item_ids + [-1])
+
+    values = distances.pair_distances(a_item_ids, b_item_ids)
+
+    expected = item_distances.DenseItemDistances(
+        self.matrix, self.item_ids).pair_distances(a_item_ids, b_item_ids)
+    self.assertEqual(a_item_ids.shape, values.shape)
+    np.testing.assert_allclose(expected, values, atol=1e-12)
+
+  def test_sums_rows(self):
+    distances = item_distances.CondensedItemDistances.from_rating_set(
+        self.rating_set, block_size=4)
+
+    np.testing.assert_allclose(
+        self.matrix.sum(axis=0),
+        distances.distance_sums(self.item_ids),
+        rtol=1e-6)
+    self.assertEqual([0], distances.distance_sums([-1]).tolist())
+
+  def test_empty_ratings(self):
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[])
+
+    distances = item_distances.CondensedItemDistances.from_rating_set(
+        rating_set)
+
+    self.assertEqual([0], distances.pair_distances([1], [2]).tolist())
+    self.assertEqual((0, 0), distances.to_matrix()[0].shape)
+
+
+class MinHashItemDistancesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.rating_set = _make_rating_set()
+    self.matrix, self.item_ids = _compute_distance_matrix(
+        self.rating_set)
+
+  def test_identical_likers_are_at_distance_zero(self):
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'],
+        data=[(1, 1, 5), (2, 1, 5), (1, 2, 5), (2, 2, 5), (3, 3, 5)])
+
+    distances = item_distances.MinHashItemDistances(rating_set, num_hashes=16)
+
+    self.assertEqual([0., 1., 0., 0.],
+                     distances.pair_distances([1, 1, 1, 1],
+                                              [2, 3, 1, 4]).tolist())
+
+  def test_more_hashes_are_more_accurate(self):
+    errors = [
+        item_distances.report_distance_error(
+            item_distances.MinHashItemDistances(
+                self.rating_set, num_hashes=num_hashes),
+            self.rating_set).root_mean_squared_error
+        for num_hashes in [4, 512]
+    ]
+
+    self.assertLess(errors[1], errors[0])
+    self.assertLess(errors[1], 0.05)
+
+  def test_sums_are_exact(self):
+    distances = item_distances.MinHashItemDistances(
+        self.rating_set, num_hashes=8)
+
+    np.testing.assert_allclose(
+        self.matrix.sum(axis=0), distances.distance_sums(self.item_ids))
+
+  def test_chunks_pairs(self):
+    a_item_ids, b_item_ids = np.meshgrid(self.item_ids, self.item_ids)
+    distances = item_distances.MinHashItemDistances(
+        self.rating_set, num_hashes=32)
+    expected = distances.pair_distances(a_item_ids, b_item_ids)
+
+    distances.chunk_size = 7
+    np.testing.assert_array_equal(
+        expected, distances.pair_distances(a_item_ids, b_item_ids))
+
+
+class ReportDistanceErrorTest(unittest.TestCase):
+
+  def test_exact_distances_have_no_error(self):
+    rating_set = _make_rating_set()
+    distances = item_distances.CondensedItemDistances.from_rating_set(
+        rating_set, dtype='float64')
+
+    report = item_distances.report_distance_error(
+        distances, rating_set, num_pairs=500)
+
+    self.assertEqual(500, report.num_pairs)
+    self.assertAlmostEqual(0, report.max_absolute_error)
+
+
+class DistanceStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.TemporaryDirectory()
+    self.store = item_distances.DistanceStore(self._temp_dir.name)
+    self.rating_set = _make_rating_set()
+
+  def tearDown(self):
+    self._temp_dir.cleanup()
+
+  def test_loads_saved_distances_memory_mapped(self):
+    expected_matrix, expected_item_ids = _compute_distance_matrix(
+        self.rating_set)
+    self.store.load(self.rating_set)
+
+    with mock.patch.object(item_distances.CondensedItemDistances,
+                           'from_rating_set') as mock_compute:
+      distances = self.store.load(self.rating_set)
+
+    mock_compute.assert_not_called()
+    self.assertIsInstance(distances.values, np.memmap)
+    matrix, item_ids = distances.to_matrix()
+    np.testing.assert_allclose(expected_matrix, matrix, atol=1e-6)
+    self.assertEqual(expected_item_ids, item_ids)
+
+  def test_pickles_as_file_reference(self):
+    self.store.load(self.rating_set)
+    distances = self.store.load(self.rating_set)
+
+    unpickled = pickle.loads(pickle.dumps(distances))
+
+    self.assertIsInstance(unpickled.values, np.memmap)
+    self.assertEqual(distances.values.filename, unpickled.values.filename)
+
+  def test_keyed_by_base_ratings(self):
+    other_rating_set = _make_rating_set(seed=1)
+    self.store.load(self.rating_set)
+
+    distances = self.store.load(other_rating_set)
+
+    expected_matrix, _ = _compute_distance_matrix(
+        other_rating_set)
+    np.testing.assert_allclose(
+        expected_matrix, distances.to_matrix()[0], atol=1e-6)
+    self.assertEqual(2, len(os.listdir(self._temp_dir.name)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,13 @@
+import numpy as np
+
+from ps.metrics import metric_utils
+
+
+class Coverage(metric_utils.CatalogMetric):
+  """Fraction of the catalog recommended to at least one user."""
+  NAME = 'Coverage'
+
+  def compute_from_counts(self, counts):
+    if not len(counts):
+      return 0.
+    return np.count_nonzero(counts) / len(counts)
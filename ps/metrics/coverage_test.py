@@ -0,0 +1,61 @@
+import unittest
+
+from ps.metrics import coverage
+from ps import dataset_io
+
+import numpy as np
+import pandas as pd
+
+
+class CoverageComputeTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'],
+        data=[(1, 1, 5), (1, 2, 5), (2, 3, 5), (2, 4, 5)])
+    rating_set.test = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[(1, 5, 5)])
+    rating_set_by_fold = {'u1': rating_set}
+
+    self.coverage = coverage.Coverage(
+        ranking_set_by_id={}, rating_set_by_fold=rating_set_by_fold)
+
+  def test_counts_catalog_items_recommended(self):
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=np.array([[1, 2, 9], [1, 3, -1]]),
+        user_ids=np.array([1, 2]))
+
+    value_by_cutoff = self.coverage.compute_by_cutoff(ranking_set, [1, 2, 3])
+
+    self.assertEqual([1, 2, 3], list(value_by_cutoff))
+    self.assertAlmostEqual(1 / 5, value_by_cutoff[1])
+    self.assertAlmostEqual(3 / 5, value_by_cutoff[2])
+    self.assertAlmostEqual(3 / 5, value_by_cutoff[3])
+
+  def test_accumulates_blocks(self):
+    blocks = [
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', 'Alg'),
+            matrix=np.array(matrix),
+            user_ids=np.array([1])) for matrix in [[[1, 2]], [[4, 5]]]
+    ]
+
+    self.assertAlmostEqual(4 / 5, self.coverage.compute_over_blocks(blocks))
+
+  def test_has_no_user_values(self):
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=np.array([[1]]),
+        user_ids=np.array([1]))
+
+    self.assertFalse(coverage.Coverage.HAS_USER_VALUES)
+    with self.assertRaises(NotImplementedError):
+      self.coverage.compute_user_values(ranking_set)
+
+
+if __name__ == '__main__':
+  unittest.main()
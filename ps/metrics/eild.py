@@ -1,71 +1,76 @@
 import collections
+import functools
 import logging
 import math
 
-import pandas as pd
+import numpy as np
 
-from ps import rating_utils
+from ps import fold_context
+from ps.metrics import kernels
+from ps.metrics import metric_utils
 
+# Bounds the users x num_items x num_items distances gathered at once.
+_MAX_CHUNK_PAIRS = 1 << 20
 
-class EILD(object):
-  NAME = 'EILD'
-
-  def __init__(self, ranking_set_by_id, rating_set_by_fold):
-    logging.info('Computing distances')
-    self.distances_by_fold = rating_utils.compute_distances_by_fold(rating_set_by_fold)
-    logging.info('Done computing distances')
-
-  def compute(self, ranking_set, num_items=None):
-    distance_matrix, item_ids = self.distances_by_fold[ranking_set.id.fold]
-    index_by_item_id = {item_id: i for i, item_id in enumerate(item_ids)}
-
-    matrix = ranking_set.matrix
-
-    if num_items is not None:
-      matrix = matrix[:, :num_items]
-    else:
-      num_items = matrix.shape[1]
 
-    total_eild = 0
-    normalizing_constant = 0
+def _relative_discount(num_items):
+  """Returns the discount of the distance from the item at k to that at l."""
+  ranks = np.arange(num_items)
+  relative_discount = 0.85**np.maximum(0, ranks[None, :] - ranks[:, None] - 1)
+  np.fill_diagonal(relative_discount, 0)
+  return relative_discount
 
-    for k in range(num_items):
-      k_items = matrix[:, k]
-      k_eild = 0
-      k_normalizing_constant = 0
 
-      for l in range(num_items):
-        if k == l:
-          continue
+@functools.lru_cache(maxsize=None)
+def _rank_weights(num_items):
+  """Returns the weight of the discounted distances from each k to all l.
 
-        l_items = matrix[:, l]
+  Both the relative discounts of each k and the absolute discounts 0.85**k
+  are normalized to sum to 1 over the first num_items items.
+  """
+  k_normalizing_constant = _relative_discount(num_items).sum(axis=1)
+  k_normalizing_constant[k_normalizing_constant == 0] = 1
 
-        distances = []
-        for k_item, l_item in zip(k_items, l_items):
-          k_index = index_by_item_id.get(k_item)
-          l_index = index_by_item_id.get(l_item)
+  absolute_discount = 0.85**np.arange(num_items)
+  absolute_discount /= max(absolute_discount.sum(), 1)
+  weights = absolute_discount / k_normalizing_constant
+  weights.setflags(write=False)
+  return weights
 
-          # If an item appears in the rankings, but not in any rating.
-          if k_index is None or l_index is None:
-            distances.append(0.)
-          else:
-            distances.append(distance_matrix[k_index, l_index])
 
-        mean_distance = sum(distances) / len(distances)
-
-        relative_discount = 0.85**max(0, l - k - 1)
-        k_eild += mean_distance * relative_discount
-        k_normalizing_constant += relative_discount
-
-      if k_normalizing_constant != 0:
-        k_eild /= k_normalizing_constant
-
-      absolute_discount = 0.85**k
-      total_eild += absolute_discount * k_eild
-
-      normalizing_constant += absolute_discount
+class EILD(metric_utils.Metric):
+  NAME = 'EILD'
+  ARTIFACTS = ('distances',)
 
-    if normalizing_constant != 0:
-      total_eild /= normalizing_constant
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                  ranking_set_by_id)
+    logging.info('Computing distances')
+    self.distances_by_fold = context.by_fold('distances')
+    logging.info('Done computing distances')
 
-    return total_eild
+  def compute_user_values_by_cutoff(self, ranking_set, cutoffs, features=None):
+    distances = self.distances_by_fold[ranking_set.id.fold]
+
+    depths = metric_utils.cutoff_depths(ranking_set, cutoffs)
+    num_items = max(depths, default=0)
+    matrix = ranking_set.matrix[:, :num_items]
+
+    relative_discount = _relative_discount(num_items)
+    weights = np.zeros((len(depths), num_items))
+    for j, depth in enumerate(depths):
+      weights[j, :depth] = _rank_weights(depth)
+    # Items that appear in the rankings, but not in any rating, are at
+    # distance 0.
+    positions = distances.positions(matrix)
+
+    eild_sums = np.zeros((len(depths), len(matrix)))
+    chunk_size = max(1, _MAX_CHUNK_PAIRS // max(1, num_items * num_items))
+    for start in range(0, len(matrix), chunk_size):
+      chunk = positions[start:start + chunk_size]
+      pair_distances = distances.distances_at(chunk[:, :, None],
+                                              chunk[:, None, :])
+      eild_sums[:, start:start + chunk_size] = kernels.eild_sums(
+          pair_distances, relative_discount, depths, weights)
+
+    return collections.OrderedDict(zip(cutoffs, eild_sums))
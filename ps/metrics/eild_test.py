@@ -1,17 +1,37 @@
 import math
 import unittest
+from unittest import mock
 
 from ps.metrics import eild
+from ps.metrics import kernels
 from ps import dataset_io
+from ps import item_distances
 
 import numpy as np
 import pandas as pd
 
 
+def _pairwise_eild(distances, ranking_matrix):
+  num_items = ranking_matrix.shape[1]
+  total_eild = np.zeros(len(ranking_matrix))
+  for k in range(num_items):
+    k_eild = sum(
+        distances.pair_distances(ranking_matrix[:, k], ranking_matrix[:, l]) *
+        0.85**max(0, l - k - 1) for l in range(num_items) if l != k)
+    k_eild /= sum(
+        0.85**max(0, l - k - 1) for l in range(num_items) if l != k) or 1
+    total_eild += 0.85**k * k_eild
+  return total_eild / sum(0.85**k for k in range(num_items))
+
+
 class EildComputeTest(unittest.TestCase):
+  BACKEND = 'numpy'
 
   def setUp(self):
     super().setUp()
+    backend = kernels.get_backend()
+    kernels.set_backend(self.BACKEND)
+    self.addCleanup(kernels.set_backend, backend)
 
     rating_set = dataset_io.RatingSet(fold='u1')
     rating_set.base = pd.DataFrame.from_records(
@@ -37,7 +57,8 @@ class EildComputeTest(unittest.TestCase):
     distance_matrix = np.array([
         [1]
     ])
-    self.eild.distances_by_fold = {'u1': (distance_matrix, item_ids)}
+    self.eild.distances_by_fold = {'u1': item_distances.DenseItemDistances(
+        distance_matrix, item_ids)}
     ranking_matrix = np.array([[1, 2]])
     ranking_set = dataset_io.RankingSet(
         id=dataset_io.RankingSetId('u1', 'Alg'),
@@ -53,7 +74,8 @@ class EildComputeTest(unittest.TestCase):
         [2 / math.sqrt(6), 1, 1 / math.sqrt(2)],
         [1 / math.sqrt(3), 1 / math.sqrt(2), 1],
     ])
-    self.eild.distances_by_fold = {'u1': (distance_matrix, item_ids)}
+    self.eild.distances_by_fold = {'u1': item_distances.DenseItemDistances(
+        distance_matrix, item_ids)}
 
     ranking_matrix = np.array([[1, 2, 3]])
     ranking_set = dataset_io.RankingSet(
@@ -77,7 +99,8 @@ class EildComputeTest(unittest.TestCase):
         [2 / math.sqrt(6), 1, 1 / math.sqrt(2)],
         [1 / math.sqrt(3), 1 / math.sqrt(2), 1],
     ])
-    self.eild.distances_by_fold = {'u1': (distance_matrix, item_ids)}
+    self.eild.distances_by_fold = {'u1': item_distances.DenseItemDistances(
+        distance_matrix, item_ids)}
 
     ranking_matrix = np.array([[1, 2], [2, 3]])
     ranking_set = dataset_io.RankingSet(
@@ -95,6 +118,46 @@ class EildComputeTest(unittest.TestCase):
 
     self.assertAlmostEqual(expected_eild, self.eild.compute(ranking_set))
 
+  def _make_random_rankings(self):
+    random = np.random.RandomState(0)
+    item_ids = np.arange(1, 21)
+    distance_matrix = random.uniform(size=(20, 20))
+    distance_matrix = (distance_matrix + distance_matrix.T) / 2
+    distances = item_distances.DenseItemDistances(distance_matrix, item_ids)
+    self.eild.distances_by_fold = {'u1': distances}
+    ranking_matrix = random.randint(-1, 25, size=(7, 5))
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=ranking_matrix,
+        user_ids=[])
+    return distances, ranking_set
+
+  def test_matches_pairwise_loop_in_chunks(self):
+    distances, ranking_set = self._make_random_rankings()
+
+    with mock.patch.object(eild, '_MAX_CHUNK_PAIRS', 50):
+      values = self.eild.compute_user_values(ranking_set)
+
+    np.testing.assert_allclose(
+        _pairwise_eild(distances, ranking_set.matrix), values)
+
+  def test_computes_many_cutoffs(self):
+    distances, ranking_set = self._make_random_rankings()
+
+    with mock.patch.object(eild, '_MAX_CHUNK_PAIRS', 50):
+      values_by_cutoff = self.eild.compute_user_values_by_cutoff(
+          ranking_set, [2, 3, 5])
+
+    self.assertEqual([2, 3, 5], list(values_by_cutoff))
+    for cutoff, values in values_by_cutoff.items():
+      np.testing.assert_allclose(
+          _pairwise_eild(distances, ranking_set.matrix[:, :cutoff]), values)
+
+
+@unittest.skipIf(kernels.numba is None, 'numba not installed')
+class EildComputeNumbaTest(EildComputeTest):
+  BACKEND = 'numba'
+
 
 if __name__ == '__main__':
   unittest.main()
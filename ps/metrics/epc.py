@@ -2,35 +2,39 @@ import collections
 import logging
 
 import numpy as np
-import pandas as pd
 
-from ps import rating_utils
+from ps import fold_context
+from ps.metrics import metric_utils
 
 
-class EPC(object):
+class EPC(metric_utils.Metric):
   NAME = 'EPC'
+  ARTIFACTS = ('popularity_table',)
 
-  def __init__(self, ranking_set_by_id, rating_set_by_fold):
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                  ranking_set_by_id)
     logging.info('Computing popularity')
-    self.popularity_by_fold = rating_utils.compute_popularity_by_fold(rating_set_by_fold)
+    self.popularity_by_fold = context.by_fold('popularity_table')
     logging.info('Done computing popularity')
 
-  def compute(self, ranking_set, num_items=None):
-    item_popularity = self.popularity_by_fold[ranking_set.id.fold]
+  def compute_user_values_by_cutoff(self, ranking_set, cutoffs, features=None):
+    depths = metric_utils.cutoff_depths(ranking_set, cutoffs)
+    matrix = ranking_set.matrix[:, :max(depths, default=0)]
 
-    matrix = ranking_set.matrix
+    discount = 0.85**np.arange(matrix.shape[1])
 
-    if num_items is not None:
-      matrix = matrix[:, :num_items]
-    else:
-      num_items = matrix.shape[1]
+    features = features or metric_utils.RankingFeatures(ranking_set)
+    popularity_matrix = features.popularity(
+        self.popularity_by_fold[ranking_set.id.fold])[:, :matrix.shape[1]]
 
-    discount = 0.85**np.arange(num_items)
+    # Column d holds the discounted novelty of the first d items.
+    novelty_sums = np.zeros((len(matrix), matrix.shape[1] + 1))
+    np.cumsum((1 - popularity_matrix) * discount,
+              axis=1,
+              out=novelty_sums[:, 1:])
+    discount_sums = np.concatenate([[0.], np.cumsum(discount)])
 
-    popularity_for_item = np.vectorize(
-        lambda item_id: item_popularity.get(item_id, 0.), otypes=[np.float])
-    popularity_matrix = popularity_for_item(matrix)
-
-    epcs_for_rankings = (1 - popularity_matrix).dot(discount) / discount.sum()
-
-    return epcs_for_rankings.mean()
+    return collections.OrderedDict(
+        (cutoff, novelty_sums[:, depth] / discount_sums[depth])
+        for cutoff, depth in zip(cutoffs, depths))
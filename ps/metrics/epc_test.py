@@ -63,6 +63,23 @@ class EpcComputeTest(unittest.TestCase):
     expected_value = (0.5 + 0.7) / 2
     self.assertAlmostEqual(expected_value, value)
 
+  def test_computes_many_cutoffs(self):
+    ranking_matrix = np.array([[1, 2, 3], [3, 4, 1]])
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=ranking_matrix,
+        user_ids=[])
+
+    self.epc.popularity_by_fold = {'u1': pd.Series({1: 0.5, 2: 0.3, 3: 0.1})}
+
+    value_by_cutoff = self.epc.compute_by_cutoff(ranking_set, [1, 2, 5])
+
+    self.assertEqual([1, 2, 5], list(value_by_cutoff))
+    self.assertAlmostEqual((0.5 + 0.9) / 2, value_by_cutoff[1])
+    self.assertAlmostEqual(
+        (0.5 + 0.7 * 0.85 + 0.9 + 1 * 0.85) / 2 / 1.85, value_by_cutoff[2])
+    self.assertAlmostEqual(self.epc.compute(ranking_set), value_by_cutoff[5])
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,21 @@
+import numpy as np
+
+from ps.metrics import metric_utils
+
+
+class Gini(metric_utils.CatalogMetric):
+  """Gini index of how recommendations concentrate on catalog items.
+
+  0 when every item is recommended equally often, approaching 1 as they
+  concentrate on a single item.
+  """
+  NAME = 'Gini'
+
+  def compute_from_counts(self, counts):
+    total = counts.sum()
+    if not total:
+      return 0.
+    sorted_counts = np.sort(counts)
+    n = len(counts)
+    weights = 2 * np.arange(1, n + 1) - n - 1
+    return float(weights @ sorted_counts / (n * total))
@@ -0,0 +1,54 @@
+import unittest
+
+from ps.metrics import gini
+from ps import dataset_io
+
+import numpy as np
+import pandas as pd
+
+
+class GiniComputeTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'],
+        data=[(1, 1, 5), (1, 2, 5), (2, 3, 5), (2, 4, 5)])
+    rating_set.test = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[])
+    rating_set_by_fold = {'u1': rating_set}
+
+    self.gini = gini.Gini(
+        ranking_set_by_id={}, rating_set_by_fold=rating_set_by_fold)
+
+  def _ranking_set(self, matrix):
+    return dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=np.array(matrix),
+        user_ids=np.arange(len(matrix)))
+
+  def test_equal_counts_are_zero(self):
+    self.assertAlmostEqual(
+        0, self.gini.compute(self._ranking_set([[1, 2], [3, 4]])))
+
+  def test_single_item_approaches_one(self):
+    self.assertAlmostEqual(
+        3 / 4, self.gini.compute(self._ranking_set([[1], [1], [1]])))
+
+  def test_matches_mean_absolute_difference(self):
+    counts = np.array([0, 3, 1, 2])
+
+    value = self.gini.compute_from_counts(counts)
+
+    expected = np.abs(counts[:, None] - counts[None, :]).sum() / (
+        2 * len(counts) * counts.sum())
+    self.assertAlmostEqual(expected, value)
+
+  def test_no_recommendations_are_zero(self):
+    self.assertEqual(0, self.gini.compute_from_counts(np.zeros(4)))
+
+
+if __name__ == '__main__':
+  unittest.main()
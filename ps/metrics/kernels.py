@@ -0,0 +1,119 @@
+"""Inner loops of the metrics, with a NumPy and an optional Numba backend.
+
+The NumPy kernels are vectorized, at the cost of temporaries as large as
+their inputs (users x k for MAP, users x k x k for EILD). The Numba kernels
+compile the plain loops below, which only keep running sums, and release
+the GIL. Numba is used when it is installed; set_backend overrides that.
+Both backends give the same results.
+"""
+import numpy as np
+
+try:
+  import numba
+except ImportError:
+  numba = None
+
+BACKENDS = ('numpy', 'numba')
+
+_backend = 'numba' if numba is not None else 'numpy'
+
+
+def get_backend():
+  return _backend
+
+
+def set_backend(backend):
+  """Selects the backend of every kernel, one of BACKENDS."""
+  global _backend
+  if backend not in BACKENDS:
+    raise ValueError('Unknown backend: {}'.format(backend))
+  if backend == 'numba' and numba is None:
+    raise ValueError('The numba backend needs numba installed.')
+  _backend = backend
+
+
+def _precision_sums_numpy(is_hit):
+  precision_sums = np.zeros((len(is_hit), is_hit.shape[1] + 1))
+  precisions = np.cumsum(is_hit, axis=1) / np.arange(1, is_hit.shape[1] + 1)
+  np.cumsum(precisions * is_hit, axis=1, out=precision_sums[:, 1:])
+  return precision_sums
+
+
+def _precision_sums_loops(is_hit):
+  num_users, num_items = is_hit.shape
+  precision_sums = np.zeros((num_users, num_items + 1))
+  for u in range(num_users):
+    num_hits = 0
+    total = 0.
+    for i in range(num_items):
+      if is_hit[u, i]:
+        num_hits += 1
+        total += num_hits / (i + 1)
+      precision_sums[u, i + 1] = total
+  return precision_sums
+
+
+def _eild_sums_numpy(pair_distances, relative_discount, depths, weights):
+  # [u, k, l] is the discounted distance from the item at k to the items up
+  # to l, so each depth reads its k x depth prefix off the last column.
+  k_eild = np.cumsum(pair_distances * relative_discount, axis=2)
+  eild_sums = np.zeros((len(depths), len(pair_distances)))
+  for j, depth in enumerate(depths):
+    if depth:
+      eild_sums[j] = k_eild[:, :depth, depth - 1] @ weights[j, :depth]
+  return eild_sums
+
+
+def _eild_sums_loops(pair_distances, relative_discount, depths, weights):
+  num_users, num_items = pair_distances.shape[:2]
+  eild_sums = np.zeros((len(depths), num_users))
+  for u in range(num_users):
+    for k in range(num_items):
+      k_eild = 0.
+      for l in range(num_items):
+        k_eild += pair_distances[u, k, l] * relative_discount[k, l]
+        for j in range(len(depths)):
+          if depths[j] == l + 1 and k < depths[j]:
+            eild_sums[j, u] += weights[j, k] * k_eild
+  return eild_sums
+
+
+if numba is not None:
+  _KERNELS = {
+      'numpy': (_precision_sums_numpy, _eild_sums_numpy),
+      'numba': (numba.njit(nogil=True, cache=True)(_precision_sums_loops),
+                numba.njit(nogil=True, cache=True)(_eild_sums_loops)),
+  }
+else:
+  _KERNELS = {'numpy': (_precision_sums_numpy, _eild_sums_numpy)}
+
+
+def precision_sums(is_hit):
+  """Returns the sums of the precisions at each hit among the first items.
+
+  is_hit -- A users x k boolean matrix.
+
+  Column d of the users x (k + 1) result holds the sum over the first d
+  items.
+  """
+  return _KERNELS[_backend][0](np.ascontiguousarray(is_hit))
+
+
+def eild_sums(pair_distances, relative_discount, depths, weights):
+  """Returns the weighted, discounted distances of each user at each depth.
+
+  pair_distances -- A users x k x k array of the distances between the items
+      at each pair of ranks.
+  relative_discount -- The k x k discount of the distance from rank k to l.
+  depths -- How many items to read at each depth.
+  weights -- A len(depths) x k array of the weight of each rank k at each
+      depth; only the first depth weights of a depth are read.
+
+  Row j of the result holds, for each user, the sum over k < depths[j] of
+  weights[j, k] times the discounted distances from k to every l < depths[j].
+  """
+  return _KERNELS[_backend][1](
+      np.ascontiguousarray(pair_distances),
+      np.ascontiguousarray(relative_discount, dtype='float64'),
+      np.asarray(depths, dtype='int64'),
+      np.ascontiguousarray(weights, dtype='float64'))
@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+
+from ps.metrics import eild
+from ps.metrics import kernels
+
+
+class KernelsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.random = np.random.RandomState(0)
+
+  def test_precision_sums_loops_match_numpy(self):
+    is_hit = self.random.rand(6, 5) < 0.4
+
+    np.testing.assert_allclose(
+        kernels._precision_sums_numpy(is_hit),
+        kernels._precision_sums_loops(is_hit))
+
+  def test_eild_sums_loops_match_numpy(self):
+    pair_distances = self.random.rand(4, 5, 5).astype('float32')
+    depths = np.array([0, 2, 5, 5])
+    weights = np.zeros((len(depths), 5))
+    for j, depth in enumerate(depths):
+      weights[j, :depth] = eild._rank_weights(depth)
+    args = (pair_distances, eild._relative_discount(5), depths, weights)
+
+    np.testing.assert_allclose(
+        kernels._eild_sums_numpy(*args), kernels._eild_sums_loops(*args),
+        rtol=1e-6)
+
+  def test_set_backend(self):
+    backend = kernels.get_backend()
+    self.addCleanup(kernels.set_backend, backend)
+
+    kernels.set_backend('numpy')
+
+    self.assertEqual('numpy', kernels.get_backend())
+    with self.assertRaises(ValueError):
+      kernels.set_backend('fortran')
+
+  @unittest.skipIf(kernels.numba is not None, 'numba installed')
+  def test_numba_backend_needs_numba(self):
+    with self.assertRaises(ValueError):
+      kernels.set_backend('numba')
+
+
+if __name__ == '__main__':
+  unittest.main()
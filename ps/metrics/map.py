@@ -1,14 +1,14 @@
 import collections
-import functools
 
 import numpy as np
 
-from ps import dataset_io
-from ps import rating_utils
+from ps import fold_context
+from ps.metrics import kernels
+from ps.metrics import metric_utils
 
 
 def _precision(ranking, hits):
-  if not hits:
+  if not len(hits):
     return 0
 
   if len(ranking) == 0:  # Can't check for truthiness -- numpy array.
@@ -25,29 +25,36 @@ def _precision(ranking, hits):
   return total / min(len(ranking), len(hits))
 
 
-class MAP(object):
+class MAP(metric_utils.Metric):
   NAME = 'MAP'
+  ARTIFACTS = ('hits_index',)
 
-  def __init__(self, ranking_set_by_id, rating_set_by_fold):
-    self.hits_by_fold = rating_utils.compute_hits_by_fold(rating_set_by_fold)
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                  ranking_set_by_id)
+    self.hits_by_fold = context.by_fold('hits_index')
 
-  def compute(self, ranking_set, num_items=None):
+  def compute_user_values_by_cutoff(self, ranking_set, cutoffs, features=None):
     hits_by_user = self.hits_by_fold[ranking_set.id.fold]
 
-    matrix = ranking_set.matrix
-
-    if num_items is not None:
-      matrix = matrix[:, :num_items]
-    else:
-      num_items = matrix.shape[1]
-
-    total = 0
-    for user_ranking, user_id in zip(matrix, ranking_set.user_ids):
-      user_hits = hits_by_user.get(user_id)
-      if user_hits is None:
-        user_hits = set()
-      total += _precision(user_ranking, user_hits)
-
-    return total / len(ranking_set.user_ids)
-
-
+    depths = metric_utils.cutoff_depths(ranking_set, cutoffs)
+    matrix = ranking_set.matrix[:, :max(depths, default=0)]
+
+    features = features or metric_utils.RankingFeatures(ranking_set)
+    is_hit, num_hits = features.hits(hits_by_user)
+    is_hit = is_hit[:, :matrix.shape[1]]
+
+    # Column d holds the sum of the precisions at each hit among the first d
+    # items.
+    precision_sums = kernels.precision_sums(is_hit)
+
+    precisions_by_cutoff = collections.OrderedDict()
+    for cutoff, depth in zip(cutoffs, depths):
+      if depth == 0 and num_hits.any():
+        raise ValueError('Empty ranking.')
+      precisions_by_cutoff[cutoff] = np.divide(
+          precision_sums[:, depth],
+          np.minimum(depth, num_hits),
+          out=np.zeros(len(matrix)),
+          where=num_hits > 0)
+    return precisions_by_cutoff
@@ -1,6 +1,7 @@
 import unittest
 
 from ps.metrics import map as map_module
+from ps.metrics import kernels
 from ps import dataset_io
 
 import numpy as np
@@ -8,9 +9,13 @@ import pandas as pd
 
 
 class MapComputeTest(unittest.TestCase):
+  BACKEND = 'numpy'
 
   def setUp(self):
     super().setUp()
+    backend = kernels.get_backend()
+    kernels.set_backend(self.BACKEND)
+    self.addCleanup(kernels.set_backend, backend)
 
     rating_set = dataset_io.RatingSet(fold='u1')
     rating_set.base = pd.DataFrame.from_records(
@@ -86,6 +91,70 @@ class MapComputeTest(unittest.TestCase):
 
     self.assertAlmostEqual(0.5, self.map.compute(ranking_set))
 
+  def test_computes_many_cutoffs(self):
+    random = np.random.RandomState(0)
+    hits_by_user = {
+        user_id: set(random.choice(10, random.randint(0, 4), replace=False))
+        for user_id in range(8)
+    }
+    self.map.hits_by_fold = {'u1': hits_by_user}
+    ranking_matrix = np.array(
+        [random.choice(10, 6, replace=False) for _ in range(8)])
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=ranking_matrix,
+        user_ids=list(range(8)))
+
+    values_by_cutoff = self.map.compute_user_values_by_cutoff(
+        ranking_set, [1, 3, 6, None])
+
+    for cutoff, values in values_by_cutoff.items():
+      expected = [
+          map_module._precision(ranking[:cutoff], hits_by_user[user_id])
+          for user_id, ranking in enumerate(ranking_matrix)
+      ]
+      np.testing.assert_allclose(expected, values)
+
+  def test_computes_sources_in_one_batch(self):
+    self.map.hits_by_fold = {'u1': {1: {1, 3}, 2: {2}, 3: {4, 5}}}
+    ranking_sets = [
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', 'A'),
+            matrix=np.array([[1, 2, 3], [2, 4, 5]]),
+            user_ids=np.array([1, 2])),
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', 'B'),
+            matrix=np.array([[5, 4, 3], [3, 2, 1], [6, 7, 2]]),
+            user_ids=np.array([3, 1, 2])),
+    ]
+
+    values = self.map.compute_by_source(ranking_sets, [1, 3])
+
+    self.assertEqual(
+        [self.map.compute_by_cutoff(ranking_set, [1, 3])
+         for ranking_set in ranking_sets], values)
+
+  def test_reads_hits_from_index(self):
+    self.map.hits_by_fold = {
+        'u1':
+            dataset_io.CsrIndex.build(
+                np.array([1, 1, 1, 3]), np.array([1, 3, 4, 2]), num_keys=5)
+    }
+
+    ranking_matrix = np.array([[1, 2, 5, 3], [1, 2, 3, -1], [2, 1, -1, -1]])
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=ranking_matrix,
+        user_ids=np.array([1, 2, 3]))
+
+    np.testing.assert_allclose([(1 + 2 / 4) / 3, 0, 1],
+                               self.map.compute_user_values(ranking_set))
+
+
+@unittest.skipIf(kernels.numba is None, 'numba not installed')
+class MapComputeNumbaTest(MapComputeTest):
+  BACKEND = 'numba'
+
 
 if __name__ == '__main__':
   unittest.main()
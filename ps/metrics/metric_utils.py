@@ -0,0 +1,426 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+from ps import dataset_io
+from ps import fold_context
+from ps import rating_utils
+
+# Bounds the sources x users x items ranking cells evaluated at once.
+_MAX_BATCH_CELLS = 1 << 22
+
+
+class MeanAccumulator(object):
+
+  def __init__(self):
+    self.total = 0.
+    self.count = 0
+
+  def add(self, values):
+    self.total += float(np.sum(values))
+    self.count += len(values)
+
+  def mean(self):
+    if not self.count:
+      raise ValueError('No values to average.')
+    return self.total / self.count
+
+
+def cutoff_depths(ranking_set, cutoffs):
+  """Returns how many ranked items are read at each cutoff (None for all)."""
+  width = ranking_set.matrix.shape[1]
+  return [width if cutoff is None else min(cutoff, width) for cutoff in cutoffs]
+
+
+def _as_csr_index(hits_by_user):
+  """Returns hits_by_user as a dataset_io.CsrIndex, e.g. from a dict of sets."""
+  if isinstance(hits_by_user, dataset_io.CsrIndex):
+    return hits_by_user
+  user_ids = [user_id for user_id, hits in hits_by_user.items() for _ in hits]
+  item_ids = [item_id for hits in hits_by_user.values() for item_id in hits]
+  return dataset_io.CsrIndex.build(
+      np.array(user_ids, dtype='int64'), np.array(item_ids, dtype='int64'))
+
+
+def compute_hits(hits_by_user, user_ids, matrix):
+  """Returns which ranked items are hits, and how many hits each user has.
+
+  hits_by_user -- The hits_index artifact of the fold (or a dict of sets).
+  user_ids -- The user of each row of matrix.
+  """
+  hits_index = _as_csr_index(hits_by_user)
+  user_positions = hits_index.positions(user_ids)
+  is_hit = hits_index.contains(user_positions[:, None], matrix)
+  # Users without hits are at position -1, which reads the appended 0.
+  num_hits = np.append(hits_index.lengths(), 0)[user_positions]
+  return is_hit, num_hits
+
+
+def prefix_sums(matrix):
+  """Returns the sums of the first 0, 1, ..., k columns of each row."""
+  sums = np.zeros((len(matrix), matrix.shape[1] + 1))
+  np.cumsum(matrix, axis=1, out=sums[:, 1:])
+  return sums
+
+
+class RankingFeatures(object):
+  """Per-item lookups of a ranking set, shared by the metrics evaluated on it.
+
+  Each lookup is computed once over the whole ranking matrix, and keyed by
+  the fold artifact it reads, so metrics reading the same hits or popularity
+  reuse it. Metrics slice off the columns they need.
+  """
+
+  def __init__(self, ranking_set):
+    self.ranking_set = ranking_set
+    # Each value keeps its artifact alive, so its id is not reused.
+    self._hits = {}
+    self._popularity = {}
+
+  def hits(self, hits_by_user):
+    """Returns compute_hits of the whole ranking matrix."""
+    key = id(hits_by_user)
+    if key not in self._hits:
+      self._hits[key] = (hits_by_user,) + compute_hits(
+          hits_by_user, self.ranking_set.user_ids, self.ranking_set.matrix)
+    return self._hits[key][1:]
+
+  def popularity(self, popularity):
+    """Returns the popularity of each ranked item, 0 if no one rated it.
+
+    popularity -- The popularity_table artifact of the fold, or anything
+        rating_utils.PopularityTable.from_popularity takes.
+    """
+    key = id(popularity)
+    if key not in self._popularity:
+      table = rating_utils.PopularityTable.from_popularity(popularity)
+      self._popularity[key] = (popularity,
+                               table.lookup(self.ranking_set.matrix))
+    return self._popularity[key][1]
+
+
+def _align_users(ranking_sets):
+  """Returns the users of all ranking sets and each set's row of each user.
+
+  Rows are -1 for the users a ranking set does not rank.
+  """
+  user_ids = np.unique(
+      np.concatenate([np.asarray(rs.user_ids) for rs in ranking_sets]))
+  rows = np.full((len(ranking_sets), len(user_ids)), -1, dtype='int64')
+  for i, ranking_set in enumerate(ranking_sets):
+    rows[i, np.searchsorted(user_ids, ranking_set.user_ids)] = np.arange(
+        len(ranking_set.user_ids))
+  return user_ids, rows
+
+
+def _stack_rankings(ranking_sets, user_ids, rows):
+  """Stacks the rows of each ranking set into a sources x users x k array.
+
+  Users a ranking set does not rank get an empty (-1) ranking.
+  """
+  width = ranking_sets[0].matrix.shape[1]
+  dtype = np.result_type(*[rs.matrix for rs in ranking_sets])
+  matrix = np.full(rows.shape + (width,), -1, dtype=dtype)
+  for i, ranking_set in enumerate(ranking_sets):
+    ranked = rows[i] >= 0
+    matrix[i, ranked] = ranking_set.matrix[rows[i, ranked]]
+  return dataset_io.RankingSet(
+      id=dataset_io.RankingSetId(ranking_sets[0].id.fold, None),
+      matrix=matrix.reshape(-1, width),
+      user_ids=np.tile(user_ids, len(ranking_sets)))
+
+
+class _UserMeanAccumulator(object):
+  """Averages the user values of a metric at each cutoff over blocks."""
+
+  def __init__(self, metric, cutoffs):
+    self._metric = metric
+    self._accumulators = collections.OrderedDict(
+        (cutoff, MeanAccumulator()) for cutoff in cutoffs)
+
+  def add(self, ranking_set, features=None):
+    values_by_cutoff = self._metric.compute_user_values_by_cutoff(
+        ranking_set, list(self._accumulators), features)
+    for cutoff, values in values_by_cutoff.items():
+      self._accumulators[cutoff].add(values)
+
+  def result(self):
+    return collections.OrderedDict(
+        (cutoff, accumulator.mean())
+        for cutoff, accumulator in self._accumulators.items())
+
+
+class Metric(object):
+  """Base class for metrics that are a mean over the ranking of each user.
+
+  Subclasses implement compute_user_values, which returns one value per row
+  of the ranking matrix, or compute_user_values_by_cutoff to share the work
+  of several cutoffs, and of several metrics through its RankingFeatures.
+  Since the metric is a plain mean, it can be accumulated over blocks of
+  users without holding the whole ranking set.
+  """
+  NAME = None
+  # The FoldContext artifacts the constructor reads.
+  ARTIFACTS = ()
+  # Whether the metric is a mean of user values.
+  HAS_USER_VALUES = True
+
+  def compute_user_values(self, ranking_set, num_items=None):
+    return self.compute_user_values_by_cutoff(ranking_set,
+                                              [num_items])[num_items]
+
+  def compute_user_values_by_cutoff(self, ranking_set, cutoffs, features=None):
+    """Returns the user values at each cutoff, keyed by cutoff.
+
+    features -- Optional RankingFeatures of ranking_set, shared with other
+        metrics.
+    """
+    return collections.OrderedDict(
+        (cutoff, self.compute_user_values(ranking_set, cutoff))
+        for cutoff in cutoffs)
+
+  def compute(self, ranking_set, num_items=None):
+    return self.compute_user_values(ranking_set, num_items).mean()
+
+  def compute_by_cutoff(self, ranking_set, cutoffs):
+    """Returns the metric at each cutoff, keyed by cutoff."""
+    return collections.OrderedDict(
+        (cutoff, values.mean()) for cutoff, values in
+        self.compute_user_values_by_cutoff(ranking_set, cutoffs).items())
+
+  def compute_by_source(self, ranking_sets, cutoffs):
+    """Returns compute_by_cutoff of each ranking set, all from the same fold.
+
+    Every source is evaluated in the same batched calls; see
+    evaluate_by_source.
+    """
+    return evaluate_by_source([self], [cutoffs], ranking_sets)[0]
+
+  def compute_user_values_by_source(self, ranking_sets, cutoffs):
+    """Returns the user values of each ranking set, all from the same fold.
+
+    Each ranking set gets the float32 values of the users it ranks at each
+    cutoff, as Series indexed by user id and keyed by cutoff.
+    """
+    return evaluate_by_source([self], [cutoffs],
+                              ranking_sets,
+                              with_user_values=True)[1][0]
+
+  def block_accumulator(self, cutoffs):
+    """Returns an accumulator of the metric over blocks of users.
+
+    Its add method takes each block, as a RankingSet, and its result method
+    returns the metric at each cutoff, keyed by cutoff.
+    """
+    return _UserMeanAccumulator(self, cutoffs)
+
+  def compute_over_blocks(self, ranking_set_blocks, num_items=None):
+    accumulator = self.block_accumulator([num_items])
+    for ranking_set in ranking_set_blocks:
+      accumulator.add(ranking_set)
+    return accumulator.result()[num_items]
+
+
+class _ItemCountAccumulator(object):
+  """Sums how often each catalog item is recommended over blocks."""
+
+  def __init__(self, metric, cutoffs):
+    self._metric = metric
+    self._cutoffs = cutoffs
+    self._counts_by_cutoff = None
+
+  def add(self, ranking_set, features=None):
+    counts_by_cutoff = self._metric.compute_item_counts_by_cutoff(
+        ranking_set, self._cutoffs)
+    if self._counts_by_cutoff is None:
+      self._counts_by_cutoff = counts_by_cutoff
+    else:
+      for cutoff, counts in counts_by_cutoff.items():
+        self._counts_by_cutoff[cutoff] += counts
+
+  def result(self):
+    if self._counts_by_cutoff is None:
+      raise ValueError('No rankings to count.')
+    return collections.OrderedDict(
+        (cutoff, self._metric.compute_from_counts(counts))
+        for cutoff, counts in self._counts_by_cutoff.items())
+
+
+class CatalogMetric(Metric):
+  """Base class for metrics of how recommendations spread over the catalog.
+
+  The catalog of a fold is every item in its ratings. Subclasses implement
+  compute_from_counts, which gets how many times each catalog item is
+  recommended; since counts add up, the metric can still be accumulated over
+  blocks of users, but it has no per-user values.
+  """
+  ARTIFACTS = ('items',)
+  HAS_USER_VALUES = False
+
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                  ranking_set_by_id)
+    self.items_by_fold = context.by_fold('items')
+
+  def compute_from_counts(self, counts):
+    raise NotImplementedError
+
+  def compute_item_counts_by_cutoff(self, ranking_set, cutoffs):
+    """Returns how many times each catalog item is in the first items.
+
+    Items outside the catalog, like padding (-1), are not counted.
+    """
+    items = self.items_by_fold[ranking_set.id.fold]
+    depths = cutoff_depths(ranking_set, cutoffs)
+    matrix = ranking_set.matrix[:, :max(depths, default=0)]
+
+    positions = np.searchsorted(items, matrix)
+    in_catalog = positions < len(items)
+    in_catalog[in_catalog] = items[positions[in_catalog]] == matrix[in_catalog]
+    positions = np.where(in_catalog, positions, len(items))
+
+    # Counts are accumulated column by column, so deeper cutoffs extend the
+    # counts of shallower ones.
+    counts_by_depth = {}
+    counts = np.zeros(len(items) + 1, dtype='int64')
+    done = 0
+    for depth in sorted(set(depths)):
+      counts += np.bincount(
+          positions[:, done:depth].ravel(), minlength=len(items) + 1)
+      counts_by_depth[depth] = counts[:-1].copy()
+      done = depth
+    return collections.OrderedDict(
+        (cutoff, counts_by_depth[depth].copy())
+        for cutoff, depth in zip(cutoffs, depths))
+
+  def compute_user_values_by_cutoff(self, ranking_set, cutoffs, features=None):
+    raise NotImplementedError('{} has no per-user values.'.format(self.NAME))
+
+  def block_accumulator(self, cutoffs):
+    return _ItemCountAccumulator(self, cutoffs)
+
+  def compute_by_cutoff(self, ranking_set, cutoffs):
+    accumulator = self.block_accumulator(cutoffs)
+    accumulator.add(ranking_set)
+    return accumulator.result()
+
+  def compute(self, ranking_set, num_items=None):
+    return self.compute_by_cutoff(ranking_set, [num_items])[num_items]
+
+  def compute_by_source(self, ranking_sets, cutoffs):
+    return [
+        self.compute_by_cutoff(ranking_set, cutoffs)
+        for ranking_set in ranking_sets
+    ]
+
+
+def _iter_stacked_chunks(ranking_sets):
+  """Stacks ranking sets of one fold together, chunk by chunk.
+
+  Ranking sets of the same depth are aligned on a shared user index and
+  chunked over users. Yields the indices of the ranking sets in the chunk,
+  its user ids, each set's row of each user (-1 if it doesn't rank the
+  user), and the stacked RankingSet.
+  """
+  indices_by_width = collections.defaultdict(list)
+  for i, ranking_set in enumerate(ranking_sets):
+    indices_by_width[ranking_set.matrix.shape[1]].append(i)
+
+  for width, indices in indices_by_width.items():
+    group = [ranking_sets[i] for i in indices]
+    user_ids, rows = _align_users(group)
+    chunk_size = max(1, _MAX_BATCH_CELLS // max(1, len(group) * width))
+    for start in range(0, len(user_ids), chunk_size):
+      chunk_user_ids = user_ids[start:start + chunk_size]
+      chunk_rows = rows[:, start:start + chunk_size]
+      yield indices, chunk_user_ids, chunk_rows, _stack_rankings(
+          group, chunk_user_ids, chunk_rows)
+
+
+class _SourceValues(object):
+  """Collects the values of a metric on stacked sources, source by source."""
+
+  def __init__(self, num_sources, cutoffs, with_user_values):
+    self._cutoffs = cutoffs
+    self._accumulators = [{cutoff: MeanAccumulator()
+                           for cutoff in cutoffs}
+                          for _ in range(num_sources)]
+    self._parts = None
+    if with_user_values:
+      self._parts = [{cutoff: ([], []) for cutoff in cutoffs}
+                     for _ in range(num_sources)]
+
+  def add(self, indices, user_ids, ranked, values_by_cutoff):
+    for cutoff, values in values_by_cutoff.items():
+      values = values.reshape(ranked.shape)
+      for j, i in enumerate(indices):
+        self._accumulators[i][cutoff].add(values[j][ranked[j]])
+        if self._parts is not None:
+          self._parts[i][cutoff][0].append(user_ids[ranked[j]])
+          self._parts[i][cutoff][1].append(
+              values[j][ranked[j]].astype('float32'))
+
+  def means(self):
+    return [
+        collections.OrderedDict((cutoff, accumulator_by_cutoff[cutoff].mean())
+                                for cutoff in self._cutoffs)
+        for accumulator_by_cutoff in self._accumulators
+    ]
+
+  def user_values(self):
+    return [
+        collections.OrderedDict(
+            (cutoff,
+             pd.Series(
+                 np.concatenate(parts_by_cutoff[cutoff][1] or
+                                [np.zeros(0, dtype='float32')]),
+                 index=np.concatenate(parts_by_cutoff[cutoff][0] or
+                                      [np.zeros(0, dtype='int64')])))
+            for cutoff in self._cutoffs) for parts_by_cutoff in self._parts
+    ]
+
+
+def evaluate_by_source(metrics,
+                       cutoffs_by_metric,
+                       ranking_sets,
+                       with_user_values=False):
+  """Evaluates several metrics on the ranking sets of one fold in one pass.
+
+  The ranking sets are stacked chunk by chunk, and every metric evaluates
+  each chunk from the same RankingFeatures, so the hits and popularity of
+  the ranked items are looked up once for all metrics. Catalog metrics count
+  the items of each ranking set instead.
+
+  Returns, for each metric, compute_by_source of the ranking sets, and, if
+  with_user_values, compute_user_values_by_source of each metric with user
+  values (None for the others).
+  """
+  collectors = [
+      _SourceValues(len(ranking_sets), cutoffs, with_user_values)
+      if metric.HAS_USER_VALUES else None
+      for metric, cutoffs in zip(metrics, cutoffs_by_metric)
+  ]
+  if any(collectors):
+    for indices, user_ids, rows, stacked in _iter_stacked_chunks(ranking_sets):
+      features = RankingFeatures(stacked)
+      for metric, cutoffs, collector in zip(metrics, cutoffs_by_metric,
+                                            collectors):
+        if collector is not None:
+          collector.add(
+              indices, user_ids, rows >= 0,
+              metric.compute_user_values_by_cutoff(stacked, cutoffs, features))
+
+  values_by_metric = [
+      collector.means()
+      if collector is not None else metric.compute_by_source(
+          ranking_sets, cutoffs)
+      for metric, cutoffs, collector in zip(metrics, cutoffs_by_metric,
+                                            collectors)
+  ]
+  if not with_user_values:
+    return values_by_metric
+  return values_by_metric, [
+      collector.user_values() if collector is not None else None
+      for collector in collectors
+  ]
@@ -0,0 +1,175 @@
+import collections
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from ps import dataset_io
+from ps.metrics import metric_utils
+
+
+class _FirstItemMetric(metric_utils.Metric):
+  NAME = 'FirstItem'
+
+  def compute_user_values(self, ranking_set, num_items=None):
+    return ranking_set.matrix[:, 0].astype(float)
+
+
+class _HitCountMetric(metric_utils.Metric):
+  NAME = 'HitCount'
+
+  def __init__(self, hits_by_user):
+    self.hits_by_user = hits_by_user
+
+  def compute_user_values_by_cutoff(self, ranking_set, cutoffs, features=None):
+    features = features or metric_utils.RankingFeatures(ranking_set)
+    is_hit, _ = features.hits(self.hits_by_user)
+    depths = metric_utils.cutoff_depths(ranking_set, cutoffs)
+    return collections.OrderedDict(
+        (cutoff, is_hit[:, :depth].sum(axis=1).astype(float))
+        for cutoff, depth in zip(cutoffs, depths))
+
+
+class ComputeHitsTest(unittest.TestCase):
+
+  def test_marks_hits_of_each_user(self):
+    is_hit, num_hits = metric_utils.compute_hits({
+        1: {2, 3},
+        2: {1}
+    }, np.array([1, 3, 2]), np.array([[1, 2, 3], [1, 2, 3], [2, -1, -1]]))
+
+    self.assertEqual(
+        [[False, True, True], [False, False, False], [False, False, False]],
+        is_hit.tolist())
+    self.assertEqual([2, 0, 1], num_hits.tolist())
+
+
+class EvaluateBySourceTest(unittest.TestCase):
+
+  def test_metrics_share_hits(self):
+    hits_by_user = {1: {2, 3}, 2: {1}}
+    metrics = [
+        _HitCountMetric(hits_by_user),
+        _HitCountMetric(hits_by_user),
+        _FirstItemMetric()
+    ]
+    cutoffs_by_metric = [[1, 2], [2], [1]]
+    ranking_sets = [
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', source),
+            matrix=np.array(matrix),
+            user_ids=np.array(user_ids))
+        for source, matrix, user_ids in (('A', [[1, 2], [2, 3]], [2, 1]),
+                                         ('B', [[3, 1]], [1]))
+    ]
+
+    with mock.patch.object(
+        metric_utils, 'compute_hits',
+        wraps=metric_utils.compute_hits) as mock_compute_hits:
+      values_by_metric, user_values_by_metric = (
+          metric_utils.evaluate_by_source(
+              metrics, cutoffs_by_metric, ranking_sets, with_user_values=True))
+
+    mock_compute_hits.assert_called_once()
+    self.assertEqual(
+        [[metric.compute_by_cutoff(ranking_set, cutoffs)
+          for ranking_set in ranking_sets]
+         for metric, cutoffs in zip(metrics, cutoffs_by_metric)],
+        values_by_metric)
+    self.assertEqual({1: 2., 2: 1.},
+                     user_values_by_metric[0][0][2].to_dict())
+
+
+class MeanAccumulatorTest(unittest.TestCase):
+
+  def test_accumulates_mean(self):
+    accumulator = metric_utils.MeanAccumulator()
+    accumulator.add(np.array([1., 2.]))
+    accumulator.add(np.array([6.]))
+
+    self.assertAlmostEqual(3, accumulator.mean())
+
+  def test_empty_raises(self):
+    with self.assertRaises(ValueError):
+      metric_utils.MeanAccumulator().mean()
+
+
+class MetricTest(unittest.TestCase):
+
+  def _make_ranking_set(self, matrix):
+    return dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=np.array(matrix),
+        user_ids=np.arange(len(matrix)))
+
+  def test_compute_averages_user_values(self):
+    ranking_set = self._make_ranking_set([[1], [2], [6]])
+
+    self.assertAlmostEqual(3, _FirstItemMetric().compute(ranking_set))
+
+  def test_compute_over_blocks_weights_by_user(self):
+    blocks = [
+        self._make_ranking_set([[1], [2]]),
+        self._make_ranking_set([[6]]),
+    ]
+
+    self.assertAlmostEqual(3, _FirstItemMetric().compute_over_blocks(blocks))
+
+  def test_compute_by_cutoff_defaults_to_each_cutoff(self):
+    ranking_set = self._make_ranking_set([[1, 5], [2, 5], [6, 5]])
+
+    self.assertEqual({
+        1: 3,
+        2: 3
+    }, _FirstItemMetric().compute_by_cutoff(ranking_set, [1, 2]))
+
+  def test_compute_by_source_aligns_users(self):
+    ranking_sets = [
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', 'A'),
+            matrix=np.array([[1, 0], [2, 0], [6, 0]]),
+            user_ids=np.array([3, 1, 2])),
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', 'B'),
+            matrix=np.array([[4, 0], [8, 0]]),
+            user_ids=np.array([5, 1])),
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', 'C'),
+            matrix=np.array([[10]]),
+            user_ids=np.array([1])),
+    ]
+
+    with mock.patch.object(metric_utils, '_MAX_BATCH_CELLS', 4):
+      values = _FirstItemMetric().compute_by_source(ranking_sets, [1, 2])
+
+    self.assertEqual([{1: 3, 2: 3}, {1: 6, 2: 6}, {1: 10, 2: 10}], values)
+
+  def test_compute_user_values_by_source(self):
+    ranking_sets = [
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', 'A'),
+            matrix=np.array([[1], [2], [6]]),
+            user_ids=np.array([3, 1, 2])),
+        dataset_io.RankingSet(
+            id=dataset_io.RankingSetId('u1', 'B'),
+            matrix=np.array([[4], [8]]),
+            user_ids=np.array([5, 1])),
+    ]
+
+    with mock.patch.object(metric_utils, '_MAX_BATCH_CELLS', 2):
+      values = _FirstItemMetric().compute_user_values_by_source(
+          ranking_sets, [1])
+
+    self.assertEqual([{1: 2., 2: 6., 3: 1.}, {1: 8., 5: 4.}],
+                     [values_by_cutoff[1].to_dict() for values_by_cutoff in values])
+    self.assertEqual(np.float32, values[0][1].dtype)
+
+  def test_cutoff_depths(self):
+    ranking_set = self._make_ranking_set([[1, 2, 3]])
+
+    self.assertEqual([1, 3, 3],
+                     metric_utils.cutoff_depths(ranking_set, [1, 5, None]))
+
+
+if __name__ == '__main__':
+  unittest.main()
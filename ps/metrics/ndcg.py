@@ -0,0 +1,41 @@
+import collections
+
+import numpy as np
+
+from ps import fold_context
+from ps.metrics import metric_utils
+
+
+class NDCG(metric_utils.Metric):
+  """Normalized discounted cumulative gain, with binary relevance."""
+  NAME = 'nDCG'
+  ARTIFACTS = ('hits_index',)
+
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                  ranking_set_by_id)
+    self.hits_by_fold = context.by_fold('hits_index')
+
+  def compute_user_values_by_cutoff(self, ranking_set, cutoffs, features=None):
+    hits_by_user = self.hits_by_fold[ranking_set.id.fold]
+
+    depths = metric_utils.cutoff_depths(ranking_set, cutoffs)
+    matrix = ranking_set.matrix[:, :max(depths, default=0)]
+
+    features = features or metric_utils.RankingFeatures(ranking_set)
+    is_hit, num_hits = features.hits(hits_by_user)
+    is_hit = is_hit[:, :matrix.shape[1]]
+
+    discount = 1 / np.log2(np.arange(2, matrix.shape[1] + 2))
+    # Column d holds the gain of the first d items, and the gain of d hits.
+    dcg_sums = metric_utils.prefix_sums(is_hit * discount)
+    ideal_sums = np.concatenate([[0.], np.cumsum(discount)])
+
+    ndcg_by_cutoff = collections.OrderedDict()
+    for cutoff, depth in zip(cutoffs, depths):
+      ndcg_by_cutoff[cutoff] = np.divide(
+          dcg_sums[:, depth],
+          ideal_sums[np.minimum(depth, num_hits)],
+          out=np.zeros(len(matrix)),
+          where=(num_hits > 0) & (depth > 0))
+    return ndcg_by_cutoff
@@ -0,0 +1,71 @@
+import unittest
+
+from ps.metrics import ndcg
+from ps import dataset_io
+
+import numpy as np
+import pandas as pd
+
+
+def _ndcg(ranking, hits):
+  dcg = sum(1 / np.log2(i + 2)
+            for i, item_id in enumerate(ranking)
+            if item_id in hits)
+  idcg = sum(1 / np.log2(i + 2) for i in range(min(len(ranking), len(hits))))
+  return dcg / idcg if idcg else 0
+
+
+class NdcgComputeTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[])
+    rating_set.test = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[])
+    rating_set_by_fold = {'u1': rating_set}
+
+    self.ndcg = ndcg.NDCG(
+        ranking_set_by_id={}, rating_set_by_fold=rating_set_by_fold)
+
+  def test_discounts_hits_by_position(self):
+    self.ndcg.hits_by_fold = {'u1': {1: {2, 4}, 2: set()}}
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=np.array([[1, 2, 3], [1, 2, 3]]),
+        user_ids=np.array([1, 2]))
+
+    values = self.ndcg.compute_user_values(ranking_set)
+
+    np.testing.assert_allclose([(1 / np.log2(3)) / (1 + 1 / np.log2(3)), 0],
+                               values)
+
+  def test_matches_reference_at_many_cutoffs(self):
+    random = np.random.RandomState(0)
+    hits_by_user = {
+        user_id: set(random.choice(10, random.randint(0, 4), replace=False))
+        for user_id in range(8)
+    }
+    self.ndcg.hits_by_fold = {'u1': hits_by_user}
+    ranking_matrix = np.array(
+        [random.choice(10, 6, replace=False) for _ in range(8)])
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=ranking_matrix,
+        user_ids=list(range(8)))
+
+    values_by_cutoff = self.ndcg.compute_user_values_by_cutoff(
+        ranking_set, [0, 1, 3, None])
+
+    for cutoff, values in values_by_cutoff.items():
+      expected = [
+          _ndcg(ranking[:cutoff], hits_by_user[user_id])
+          for user_id, ranking in enumerate(ranking_matrix)
+      ]
+      np.testing.assert_allclose(expected, values)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from ps.metrics import recall
+from ps import dataset_io
+
+import numpy as np
+import pandas as pd
+
+
+class RecallComputeTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[])
+    rating_set.test = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[])
+    rating_set_by_fold = {'u1': rating_set}
+
+    self.recall = recall.Recall(
+        ranking_set_by_id={}, rating_set_by_fold=rating_set_by_fold)
+
+  def test_computes_many_cutoffs(self):
+    self.recall.hits_by_fold = {'u1': {1: {2, 3, 7}, 2: {1}}}
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=np.array([[1, 2, 3], [4, 5, -1], [1, 2, 3]]),
+        user_ids=np.array([1, 2, 3]))
+
+    values_by_cutoff = self.recall.compute_user_values_by_cutoff(
+        ranking_set, [1, 2, None])
+
+    self.assertEqual([1, 2, None], list(values_by_cutoff))
+    np.testing.assert_allclose([0, 0, 0], values_by_cutoff[1])
+    np.testing.assert_allclose([1 / 3, 0, 0], values_by_cutoff[2])
+    np.testing.assert_allclose([2 / 3, 0, 0], values_by_cutoff[None])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,38 @@
+import collections
+
+from ps import fold_context
+from ps.metrics import metric_utils
+
+
+class Serendipity(metric_utils.Metric):
+  """Mean unexpectedness of the hits among the first items.
+
+  A hit counts 1 minus its item's popularity: relevant recommendations of
+  items that most users already like are not serendipitous.
+  """
+  NAME = 'Serendipity'
+  ARTIFACTS = ('hits_index', 'popularity_table')
+
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                  ranking_set_by_id)
+    self.hits_by_fold = context.by_fold('hits_index')
+    self.popularity_by_fold = context.by_fold('popularity_table')
+
+  def compute_user_values_by_cutoff(self, ranking_set, cutoffs, features=None):
+    hits_by_user = self.hits_by_fold[ranking_set.id.fold]
+
+    depths = metric_utils.cutoff_depths(ranking_set, cutoffs)
+    matrix = ranking_set.matrix[:, :max(depths, default=0)]
+
+    features = features or metric_utils.RankingFeatures(ranking_set)
+    is_hit, _ = features.hits(hits_by_user)
+    popularity_matrix = features.popularity(
+        self.popularity_by_fold[ranking_set.id.fold])
+    width = matrix.shape[1]
+    surprise_sums = metric_utils.prefix_sums(
+        is_hit[:, :width] * (1 - popularity_matrix[:, :width]))
+
+    return collections.OrderedDict(
+        (cutoff, surprise_sums[:, depth] / max(depth, 1))
+        for cutoff, depth in zip(cutoffs, depths))
@@ -0,0 +1,45 @@
+import unittest
+
+from ps.metrics import serendipity
+from ps import dataset_io
+
+import numpy as np
+import pandas as pd
+
+
+class SerendipityComputeTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+
+    rating_set = dataset_io.RatingSet(fold='u1')
+    rating_set.base = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[])
+    rating_set.test = pd.DataFrame.from_records(
+        columns=['user_id', 'item_id', 'rating'], data=[])
+    rating_set_by_fold = {'u1': rating_set}
+
+    self.serendipity = serendipity.Serendipity(
+        ranking_set_by_id={}, rating_set_by_fold=rating_set_by_fold)
+
+  def test_weights_hits_by_unpopularity(self):
+    self.serendipity.hits_by_fold = {'u1': {1: {1, 3}, 2: {2}}}
+    self.serendipity.popularity_by_fold = {
+        'u1': pd.Series({1: 0.5, 2: 0.3, 3: 0.1})
+    }
+    ranking_set = dataset_io.RankingSet(
+        id=dataset_io.RankingSetId('u1', 'Alg'),
+        matrix=np.array([[1, 2, 3], [1, 2, 3], [1, 2, 3]]),
+        user_ids=np.array([1, 2, 3]))
+
+    values_by_cutoff = self.serendipity.compute_user_values_by_cutoff(
+        ranking_set, [0, 1, 3])
+
+    np.testing.assert_allclose([0, 0, 0], values_by_cutoff[0])
+    np.testing.assert_allclose([0.5, 0, 0], values_by_cutoff[1])
+    np.testing.assert_allclose([(0.5 + 0.9) / 3, 0.7 / 3, 0],
+                               values_by_cutoff[3])
+
+
+if __name__ == '__main__':
+  unittest.main()
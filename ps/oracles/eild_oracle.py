@@ -5,20 +5,21 @@ import numpy as np
 import pandas as pd
 
 from ps import dataset_io
-from ps import rating_utils
 from ps.oracles import oracle_utils
 
 
 class EILDOracle(oracle_utils.Oracle):
+  ARTIFACTS = ('distances',)
 
-  def __init__(self, ranking_set_by_id, rating_set_by_fold):
-    super().__init__(ranking_set_by_id, rating_set_by_fold)
-    self.distances_by_fold = rating_utils.compute_distances_by_fold(rating_set_by_fold)
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    super().__init__(ranking_set_by_id, rating_set_by_fold, context)
+    self.distances_by_fold = self.context.by_fold('distances')
 
   def compute_optimal_ranking_set(self, fold, input_cutoff, output_cutoff):
-    distance_matrix, item_ids = self.distances_by_fold[fold]
+    distances = self.distances_by_fold[fold]
 
-    mean_distance_by_item = pd.Series(distance_matrix.sum(axis=0), index=item_ids)
+    mean_distance_by_item = pd.Series(
+        distances.distance_sums(distances.item_ids), index=distances.item_ids)
 
     recommended_to_user = self._compute_recommended_in_fold(fold, input_cutoff)
 
@@ -2,6 +2,7 @@ import unittest
 
 from ps.oracles import eild_oracle
 from ps import dataset_io
+from ps import item_distances
 
 import numpy as np
 import pandas as pd
@@ -30,7 +31,8 @@ class EILDOracleTest(unittest.TestCase):
       [[0, 0.5, 0.2],
        [0.5, 0, 0.9],
        [0.2, 0.9, 0]])
-    oracle.distances_by_fold = {'u1': (distance_matrix, [1, 2, 3])}
+    oracle.distances_by_fold = {
+        'u1': item_distances.DenseItemDistances(distance_matrix, [1, 2, 3])}
 
     optimal_ranking_set = oracle.compute_optimal_ranking_set(
       'u1', input_cutoff=3, output_cutoff=2)
@@ -1,6 +1,3 @@
-import functools
-import heapq
-
 import numpy as np
 
 from ps import dataset_io
@@ -9,13 +6,15 @@ from ps.oracles import oracle_utils
 
 
 class EPCOracle(oracle_utils.Oracle):
+  ARTIFACTS = ('popularity_table',)
 
-  def __init__(self, ranking_set_by_id, rating_set_by_fold):
-    super().__init__(ranking_set_by_id, rating_set_by_fold)
-    self.popularity_by_fold = rating_utils.compute_popularity_by_fold(rating_set_by_fold)
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    super().__init__(ranking_set_by_id, rating_set_by_fold, context)
+    self.popularity_by_fold = self.context.by_fold('popularity_table')
 
   def compute_optimal_ranking_set(self, fold, input_cutoff, output_cutoff):
-    popularity_by_item = self.popularity_by_fold[fold]
+    popularity_table = rating_utils.PopularityTable.from_popularity(
+        self.popularity_by_fold[fold])
     recommended_to_user = self._compute_recommended_in_fold(fold, input_cutoff)
 
     matrix = np.ndarray((len(recommended_to_user), output_cutoff))
@@ -24,8 +23,11 @@ class EPCOracle(oracle_utils.Oracle):
     for i, (user_id, recommended_to_user) in enumerate(recommended_to_user.items()):
       user_ids.append(user_id)
 
-      matrix[i, :] = heapq.nsmallest(output_cutoff, recommended_to_user,
-              lambda i: popularity_by_item.get(i, 99999999.))
+      # Like heapq.nsmallest, the sort is stable and unrated items go last.
+      item_ids = np.fromiter(recommended_to_user, dtype='int64')
+      popularity = popularity_table.lookup(item_ids, default=np.inf)
+      order = np.argsort(popularity, kind='stable')
+      matrix[i, :] = item_ids[order[:output_cutoff]]
 
     ranking_set_id = dataset_io.RankingSetId(fold, 'EPCOracle')
     ranking_set = dataset_io.RankingSet(ranking_set_id, matrix, user_ids)
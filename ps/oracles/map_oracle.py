@@ -1,14 +1,14 @@
 import numpy as np
 
 from ps import dataset_io
-from ps import rating_utils
 from ps.oracles import oracle_utils
 
 class MAPOracle(oracle_utils.Oracle):
+  ARTIFACTS = ('hits_index',)
 
-  def __init__(self, ranking_set_by_id, rating_set_by_fold):
-    super().__init__(ranking_set_by_id, rating_set_by_fold)
-    self.hits_by_fold = rating_utils.compute_hits_by_fold(rating_set_by_fold)
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
+    super().__init__(ranking_set_by_id, rating_set_by_fold, context)
+    self.hits_by_fold = self.context.by_fold('hits_index')
 
   def compute_optimal_ranking_set(self, fold, input_cutoff, output_cutoff):
     hits_by_user = self.hits_by_fold[fold]
@@ -19,17 +19,18 @@ class MAPOracle(oracle_utils.Oracle):
 
     for user_index, (user_id, recommended_items) in enumerate(recommended_to_user.items()):
       user_ids.append(user_id)
+      user_hits = hits_by_user.get(user_id, ())
 
       rank = 0
       for item_id in recommended_items:
-        if item_id in hits_by_user[user_id]:
+        if item_id in user_hits:
           matrix[user_index, rank] = item_id
           rank += 1
           if rank == output_cutoff:
             break
       else:
         for item_id in recommended_items:
-          if item_id not in hits_by_user[user_id]:
+          if item_id not in user_hits:
             matrix[user_index, rank] = item_id
             rank += 1
             if rank == output_cutoff:
@@ -1,11 +1,18 @@
 import collections
 
+from ps import fold_context
+
+
 class Oracle(object):
+  # The FoldContext artifacts the constructor reads.
+  ARTIFACTS = ()
 
-  def __init__(self, ranking_set_by_id, rating_set_by_fold):
+  def __init__(self, ranking_set_by_id, rating_set_by_fold, context=None):
     super().__init__()
     self.ranking_set_by_id = ranking_set_by_id
     self.rating_set_by_fold = rating_set_by_fold
+    self.context = context or fold_context.FoldContext(rating_set_by_fold,
+                                                       ranking_set_by_id)
 
   def _yield_ranking_set_in_fold(self, fold):
     for ranking_set in self.ranking_set_by_id.values():
@@ -0,0 +1,103 @@
+"""Runs a function over many inputs in a process or thread pool.
+
+Results computed in worker processes are pickled with their large buffers
+(e.g. numpy arrays) kept out of band: each buffer is written to a file in
+shared memory and mapped back by the parent, so big results are not pushed
+through the pool's pipe.
+"""
+import concurrent.futures
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+# Buffers smaller than this are returned inline with the pickled result.
+SHARED_BUFFER_MIN_BYTES = 1 << 16
+
+_SHARED_MEMORY_DIR = '/dev/shm'
+
+
+def _shared_dir():
+  if os.path.isdir(_SHARED_MEMORY_DIR) and os.access(_SHARED_MEMORY_DIR,
+                                                     os.W_OK):
+    return _SHARED_MEMORY_DIR
+  return tempfile.gettempdir()
+
+
+def _dump_shared(result):
+  """Pickles result, writing its large buffers to shared memory files.
+
+  Returns the pickled bytes and, for each out-of-band buffer, either its
+  bytes or the path of the file holding it.
+  """
+  buffers = []
+  payload = pickle.dumps(result, protocol=5, buffer_callback=buffers.append)
+
+  buffer_specs = []
+  try:
+    for buffer in buffers:
+      raw = buffer.raw()
+      if raw.nbytes < SHARED_BUFFER_MIN_BYTES:
+        buffer_specs.append((None, bytes(raw)))
+        continue
+      fd, path = tempfile.mkstemp(prefix='ps-', dir=_shared_dir())
+      buffer_specs.append((path, raw.nbytes))
+      with os.fdopen(fd, 'wb') as f:
+        f.write(raw)
+  except BaseException:
+    _remove_buffer_files(buffer_specs)
+    raise
+
+  return payload, buffer_specs
+
+
+def _remove_buffer_files(buffer_specs):
+  for path, _ in buffer_specs:
+    if path is not None:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+
+def _load_shared(payload, buffer_specs):
+  """Unpickles a result from _dump_shared, mapping its buffer files."""
+  try:
+    # Copy-on-write keeps the arrays writable without touching the files,
+    # which are unlinked right away; the mappings outlive their names.
+    buffers = [
+        np.memmap(path, dtype='uint8', mode='c', shape=(spec,))
+        if path is not None else spec for path, spec in buffer_specs
+    ]
+  finally:
+    _remove_buffer_files(buffer_specs)
+  return pickle.loads(payload, buffers=buffers)
+
+
+def _call_and_dump_shared(function, args):
+  return _dump_shared(function(*args))
+
+
+def map_parallel(function, args_list, num_workers=1, use_threads=False):
+  """Returns [function(*args) for args in args_list], computed in a pool.
+
+  num_workers -- Size of the pool (None for one per CPU). With 1, everything
+      runs in the calling thread.
+  use_threads -- Use a thread pool instead of a process pool. Threads share
+      results directly, but only help when function releases the GIL.
+  """
+  if num_workers == 1 or len(args_list) <= 1:
+    return [function(*args) for args in args_list]
+
+  if use_threads:
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+      futures = [executor.submit(function, *args) for args in args_list]
+      return [future.result() for future in futures]
+
+  with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+    futures = [
+        executor.submit(_call_and_dump_shared, function, args)
+        for args in args_list
+    ]
+    return [_load_shared(*future.result()) for future in futures]
@@ -0,0 +1,72 @@
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from ps import parallel
+
+
+def _make_arrays(size, value):
+  return {'large': np.full(size, value), 'small': np.arange(3)}
+
+
+class MapParallelTest(unittest.TestCase):
+
+  def _assert_results(self, results):
+    self.assertEqual(2, len(results))
+    for value, result in zip([1, 2], results):
+      np.testing.assert_array_equal(np.full(100000, value), result['large'])
+      np.testing.assert_array_equal([0, 1, 2], result['small'])
+
+  def test_runs_in_calling_thread(self):
+    self._assert_results(
+        parallel.map_parallel(_make_arrays, [(100000, 1), (100000, 2)]))
+
+  def test_runs_in_threads(self):
+    self._assert_results(
+        parallel.map_parallel(
+            _make_arrays, [(100000, 1), (100000, 2)],
+            num_workers=2,
+            use_threads=True))
+
+  def test_runs_in_processes(self):
+    self._assert_results(
+        parallel.map_parallel(
+            _make_arrays, [(100000, 1), (100000, 2)], num_workers=2))
+
+
+class SharedResultTest(unittest.TestCase):
+
+  def test_maps_large_buffers_from_shared_files(self):
+    payload, buffer_specs = parallel._dump_shared(_make_arrays(100000, 7))
+    paths = [path for path, _ in buffer_specs if path is not None]
+
+    result = parallel._load_shared(payload, buffer_specs)
+
+    self.assertEqual(1, len(paths))
+    self.assertFalse(os.path.exists(paths[0]))
+    np.testing.assert_array_equal(np.full(100000, 7), result['large'])
+    np.testing.assert_array_equal([0, 1, 2], result['small'])
+    result['large'][0] = 0  # Stays writable.
+
+  def test_removes_files_when_dump_fails(self):
+    created_paths = []
+    original_mkstemp = parallel.tempfile.mkstemp
+
+    def mkstemp(**kwargs):
+      fd, path = original_mkstemp(**kwargs)
+      created_paths.append(path)
+      return fd, path
+
+    with mock.patch.object(parallel.tempfile, 'mkstemp', side_effect=mkstemp):
+      with mock.patch.object(parallel.os, 'fdopen', side_effect=OSError):
+        with self.assertRaises(OSError):
+          parallel._dump_shared(_make_arrays(100000, 7))
+
+    self.assertEqual(1, len(created_paths))
+    self.assertFalse(os.path.exists(created_paths[0]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,25 +3,50 @@ import functools
 import math
 
 import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ps import parallel
+
 
 def _compute_by_fold(f):
+  """Makes f, a function of one RatingSet, compute over all folds.
+
+  The wrapped function takes a dict of rating sets by fold, plus num_workers
+  and use_threads to spread the folds over a pool (see
+  parallel.map_parallel), and returns the results sorted by fold.
+  """
 
   @functools.wraps(f)
-  def wrapped(rating_set_by_fold, *args, **kwargs):
-    results_by_fold = {
-        fold: f(rating_set, *args, **kwargs)
-        for fold, rating_set in rating_set_by_fold.items()
-    }
-    return collections.OrderedDict(sorted(results_by_fold.items()))
+  def wrapped(rating_set_by_fold,
+              *args,
+              num_workers=1,
+              use_threads=False,
+              **kwargs):
+    folds = sorted(rating_set_by_fold)
+    results = parallel.map_parallel(
+        functools.partial(f, **kwargs),
+        [(rating_set_by_fold[fold],) + args for fold in folds], num_workers,
+        use_threads)
+    return collections.OrderedDict(zip(folds, results))
 
   return wrapped
 
 
+def _compute_rated_index(rating_set, split_name):
+  return getattr(rating_set, split_name).by_user
+
+
+compute_rated_index_by_fold = _compute_by_fold(_compute_rated_index)
+
+compute_hits_index_by_fold = functools.partial(
+    compute_rated_index_by_fold, split_name='test')
+
+
 def _compute_rated_by_user(rating_set, split_name):
   rated_by_user = collections.defaultdict(frozenset)
-  split_frame = getattr(rating_set, split_name)
-  for user_id, user_frame in split_frame.groupby('user_id'):
-    rated_by_user[user_id] = frozenset(user_frame.item_id)
+  for user_id, item_ids in _compute_rated_index(rating_set, split_name).items():
+    rated_by_user[user_id] = frozenset(item_ids)
   return rated_by_user
 
 
@@ -32,20 +57,19 @@ compute_hits_by_fold = functools.partial(
 
 
 def _compute_items(rating_set):
-  return rating_set.all_ratings().item_id.unique()
+  return np.unique(rating_set.all_ratings().item_ids)
 
 
 _compute_items_by_fold = _compute_by_fold(_compute_items)
 
 
 def _compute_users(rating_set):
-  return rating_set.all_ratings().user_id.unique()
+  return np.unique(rating_set.all_ratings().user_ids)
 
 
 _compute_users_by_fold = _compute_by_fold(_compute_users)
 
 
-
 def _compute_popularity(rating_set):
   """Computes the popularity of the items in the ratings.
 
@@ -54,37 +78,76 @@ def _compute_popularity(rating_set):
   Returns a Series of the popularity indexed by item_id. Popularity values
   range from 0 to 1.
   """
-  num_users = len(rating_set.base.user_id.unique()) or 1  # No ratings.
-  return rating_set.base.item_id.value_counts() / num_users
+  num_users = len(rating_set.base.by_user) or 1  # No ratings.
+  by_item = rating_set.base.by_item
+  return pd.Series(by_item.lengths() / num_users, index=by_item.keys)
 
 
 compute_popularity_by_fold = _compute_by_fold(_compute_popularity)
 
 
+class PopularityTable(object):
+  """Looks item popularity up in a dense array indexed by item id.
+
+  Lookups are a single gather over any array of item ids, so they suit whole
+  ranking matrices.
+  """
+
+  def __init__(self, item_ids, popularity, dtype='float32'):
+    item_ids = np.asarray(item_ids, dtype='int64')
+    size = int(item_ids.max()) + 1 if len(item_ids) else 0
+    # NaN marks the ids that no one rated.
+    self.values = np.full(size, np.nan, dtype=dtype)
+    self.values[item_ids] = popularity
+
+  @classmethod
+  def from_popularity(cls, popularity, dtype='float32'):
+    """Builds a table from a Series (or dict) of popularity by item id."""
+    if isinstance(popularity, cls):
+      return popularity
+    popularity = pd.Series(popularity, dtype='float64')
+    return cls(popularity.index.values, popularity.values, dtype)
+
+  def lookup(self, item_ids, default=0.):
+    """Returns the popularity of each item id, or default if no one rated it.
+
+    Ids outside the table, e.g. -1 for padding, count as unrated. Ids may
+    come in a float matrix, like the rankings of the oracles.
+    """
+    item_ids = np.asarray(item_ids).astype('int64', copy=False)
+    in_table = (item_ids >= 0) & (item_ids < len(self.values))
+    popularity = np.full(item_ids.shape, default, dtype=self.values.dtype)
+    popularity[in_table] = self.values[item_ids[in_table]]
+    popularity[np.isnan(popularity)] = default
+    return popularity
+
+
 def _compute_likers(rating_set):
   return {
-      item_id: frozenset(item_frame.user_id)
-      for item_id, item_frame in rating_set.base.groupby(['item_id'])
+      item_id: frozenset(user_ids)
+      for item_id, user_ids in rating_set.base.by_item.items()
   }
 
 
 _compute_likers_by_fold = _compute_by_fold(_compute_likers)
 
+
 def _cosine_similarity(a, b):
   return len(a & b) / ((math.sqrt(len(a)) * math.sqrt(len(b))) or 1)
 
 
-def _compute_distance_matrix(rating_set):
-  likers_by_item = _compute_likers(rating_set)
-  item_ids = sorted(likers_by_item.keys())
-  num_items = len(item_ids)
-  matrix = np.zeros((num_items, num_items))
-  for i, item_i in enumerate(item_ids):
-    for j, item_j in enumerate(item_ids):
-      i_likers = likers_by_item.get(item_i, frozenset())
-      j_likers = likers_by_item.get(item_j, frozenset())
-      matrix[i][j] = 1 - _cosine_similarity(i_likers, j_likers)
+def _compute_likers_matrix(rating_set, dtype='float64'):
+  """Builds the binary item x user matrix of the base ratings.
 
-  return matrix, item_ids
-
-compute_distances_by_fold = _compute_by_fold(_compute_distance_matrix)
+  Returns the matrix in CSR format and the item id of each of its rows.
+  """
+  by_item = rating_set.base.by_item
+  user_ids, user_columns = np.unique(by_item.values, return_inverse=True)
+  likers_matrix = sparse.csr_matrix(
+      (np.ones(len(user_columns), dtype=dtype), user_columns, by_item.indptr),
+      shape=(len(by_item), len(user_ids)))
+  # Repeated ratings of an item by the same user count once, as in
+  # _compute_likers.
+  likers_matrix.sum_duplicates()
+  likers_matrix.data[:] = 1
+  return likers_matrix, by_item.keys
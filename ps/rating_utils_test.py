@@ -55,6 +55,37 @@ class ComputeHitsTest(unittest.TestCase):
     self.assertDictEqual(expected_rated, rated)
 
 
+class ComputeByFoldTest(unittest.TestCase):
+
+  def _make_rating_set_by_fold(self):
+    rating_set_by_fold = {}
+    for fold in ['u2', 'u1', 'u3']:
+      rating_set = dataset_io.RatingSet(fold=fold)
+      rating_set.base = pd.DataFrame.from_records(
+          columns=['user_id', 'item_id', 'rating'],
+          data=[(1, 1, 5), (1, int(fold[1]) + 1, 5), (2, 1, 5)])
+      rating_set_by_fold[fold] = rating_set
+    return rating_set_by_fold
+
+  def test_results_sorted_by_fold(self):
+    popularity_by_fold = rating_utils.compute_popularity_by_fold(
+        self._make_rating_set_by_fold())
+
+    self.assertEqual(['u1', 'u2', 'u3'], list(popularity_by_fold))
+
+  def test_parallel_matches_sequential(self):
+    rating_set_by_fold = self._make_rating_set_by_fold()
+    expected = rating_utils.compute_popularity_by_fold(rating_set_by_fold)
+
+    for use_threads in [False, True]:
+      popularity_by_fold = rating_utils.compute_popularity_by_fold(
+          rating_set_by_fold, num_workers=2, use_threads=use_threads)
+
+      self.assertEqual(list(expected), list(popularity_by_fold))
+      for fold, popularity in expected.items():
+        pd.testing.assert_series_equal(popularity, popularity_by_fold[fold])
+
+
 class ComputePopularityTest(unittest.TestCase):
 
   def test_compute_popularity(self):
@@ -67,7 +98,6 @@ class ComputePopularityTest(unittest.TestCase):
             (2, 1, 5),
             (2, 3, 5),
         ])
-    rating_set_by_fold = {'u1': rating_set}
 
     expected_popularity = {(1, 1.), (2, 0.5), (3, 0.5)}
     popularity = set(rating_utils._compute_popularity(rating_set).items())
@@ -75,6 +105,29 @@ class ComputePopularityTest(unittest.TestCase):
     self.assertEqual(expected_popularity, popularity)
 
 
+class PopularityTableTest(unittest.TestCase):
+
+  def test_looks_up_matrix(self):
+    table = rating_utils.PopularityTable([1, 4], [0.5, 0.25])
+
+    popularity = table.lookup(np.array([[1, 4, 2], [-1, 7, 1]]))
+
+    self.assertEqual(np.float32, popularity.dtype)
+    self.assertEqual([[0.5, 0.25, 0], [0, 0, 0.5]], popularity.tolist())
+
+  def test_default_for_unrated_items(self):
+    table = rating_utils.PopularityTable.from_popularity({2: 0.5})
+
+    self.assertEqual([np.inf, 0.5, np.inf],
+                     table.lookup([-1, 2, 1], default=np.inf).tolist())
+
+  def test_empty(self):
+    table = rating_utils.PopularityTable.from_popularity(
+        pd.Series([], dtype='float64'))
+
+    self.assertEqual([0, 0], table.lookup([0, 1]).tolist())
+
+
 class ComputeLikersTest(unittest.TestCase):
 
   def test_computes_likers(self):
@@ -107,50 +160,6 @@ class ComputeLikersTest(unittest.TestCase):
     self.assertDictEqual({}, likers_by_item_id)
 
 
-class ComputeDistanceMatrixTest(unittest.TestCase):
-
-  def test_computes_distances(self):
-    rating_set = dataset_io.RatingSet(fold='u1')
-    rating_set.base = pd.DataFrame.from_records(
-        columns=['user_id', 'item_id', 'rating'],
-        data=[(1, 2, 5), (2, 2, 5), (4, 2, 5), (2, 3, 5), (3, 3, 5), (4, 3, 5)])
-    rating_set_by_fold = {'u1': rating_set}
-
-    distance_by_fold = rating_utils.compute_distances_by_fold(rating_set_by_fold)
-    self.assertIn('u1', distance_by_fold)
-
-    distance_matrix, item_ids = distance_by_fold['u1']
-
-    expected_matrix = np.array([[0., 1/3], [1/3, 0.]])
-    error_matrix = np.abs(distance_matrix - expected_matrix)
-    are_almost_equal = (error_matrix < 1e-8).all()
-
-    self.assertTrue(are_almost_equal)
-
-    self.assertSequenceEqual([2, 3], item_ids)
-
-  def test_ignores_test_and_validation(self):
-    rating_set = dataset_io.RatingSet(fold='u1')
-    rating_set.base = pd.DataFrame.from_records(
-        columns=['user_id', 'item_id', 'rating'], data=[])
-    rating_set.test = pd.DataFrame.from_records(
-        columns=['user_id', 'item_id', 'rating'], data=[(2, 3, 5)])
-    rating_set.validation = pd.DataFrame.from_records(
-        columns=['user_id', 'item_id', 'rating'], data=[(1, 3, 5)])
-    rating_set_by_fold = {'u1': rating_set}
-
-    distance_by_fold = rating_utils.compute_distances_by_fold(rating_set_by_fold)
-    self.assertIn('u1', distance_by_fold)
-
-    distance_matrix, item_ids = distance_by_fold['u1']
-    expected_matrix = np.array([])
-
-    are_almost_equal = ((distance_matrix - expected_matrix) < 1e-8).all()
-    self.assertTrue(are_almost_equal)
-
-    self.assertSequenceEqual([], item_ids)
-
-
 class CosineSimilarityTest(unittest.TestCase):
 
   def test_cosine_similarity_both_empty(self):
@@ -0,0 +1,112 @@
+"""SQLite-backed cache of metric results.
+
+Each result is keyed by what it was computed from: the contents of the
+ranking file and of the fold's rating files, the metric and cutoff, and a
+version of the code and settings that computed it. Runs over a dataset only
+evaluate the ranking files that changed since a previous run, or were added.
+"""
+import collections
+import logging
+import os
+import sqlite3
+
+ResultKey = collections.namedtuple(
+    'ResultKey',
+    ('ranking_hash', 'ratings_hash', 'metric', 'cutoff', 'version'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+  ranking_hash TEXT NOT NULL,
+  ratings_hash TEXT NOT NULL,
+  metric TEXT NOT NULL,
+  cutoff INTEGER NOT NULL,
+  version TEXT NOT NULL,
+  value REAL,
+  PRIMARY KEY (ranking_hash, ratings_hash, metric, cutoff, version)
+)
+"""
+
+_KEY_CONDITION = ('(ranking_hash = ? AND ratings_hash = ? AND metric = ? AND '
+                  'cutoff = ? AND version = ?)')
+
+# Keeps each lookup under SQLite's limit on bound parameters.
+_MAX_KEYS_PER_QUERY = 100
+
+# Stands for the None ("all items") cutoff, since cutoff can't be NULL.
+_ALL_ITEMS_CUTOFF = -1
+
+
+def _to_row(key):
+  return key._replace(
+      cutoff=_ALL_ITEMS_CUTOFF if key.cutoff is None else key.cutoff)
+
+
+def _from_row(row):
+  key = ResultKey(*row)
+  return key._replace(
+      cutoff=None if key.cutoff == _ALL_ITEMS_CUTOFF else key.cutoff)
+
+
+class ResultCache(object):
+  """Maps ResultKeys to metric values in an SQLite database at path.
+
+  Failing to open or write the database (e.g. in a read-only dataset
+  directory) is not an error: the cache then behaves as if it were empty.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._connection = None
+    try:
+      os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+      self._connection = sqlite3.connect(path)
+      with self._connection:
+        self._connection.execute(_SCHEMA)
+    except (OSError, sqlite3.Error) as e:
+      logging.warning('Not caching results in %s: %s', path, e)
+      self.close()
+
+  def get_many(self, keys):
+    """Returns a dict of the cached value of each key, leaving misses out."""
+    keys = list(keys)
+    values = {}
+    if self._connection is None:
+      return values
+
+    for start in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+      chunk = keys[start:start + _MAX_KEYS_PER_QUERY]
+      rows = self._connection.execute(
+          'SELECT ranking_hash, ratings_hash, metric, cutoff, version, value '
+          'FROM results WHERE ' + ' OR '.join([_KEY_CONDITION] * len(chunk)),
+          [field for key in chunk for field in _to_row(key)])
+      for row in rows:
+        values[_from_row(row[:-1])] = row[-1]
+    return values
+
+  def put_many(self, value_by_key):
+    """Stores the value of each key, replacing any cached one."""
+    if self._connection is None:
+      return
+    try:
+      with self._connection:
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+            [tuple(_to_row(key)) + (float(value),)
+             for key, value in value_by_key.items()])
+    except sqlite3.Error as e:
+      logging.warning('Not caching results in %s: %s', self.path, e)
+
+  def close(self):
+    if self._connection is not None:
+      self._connection.close()
+      self._connection = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def default_result_cache(cache_dir):
+  return ResultCache(os.path.join(cache_dir, 'results.sqlite'))
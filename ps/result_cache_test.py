@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+from ps import result_cache
+
+
+def _key(ranking_hash, cutoff=10):
+  return result_cache.ResultKey(ranking_hash, 'ratings', 'MAP', cutoff, 'v1')
+
+
+class ResultCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self._temp_dir.name, 'cache', 'results.sqlite')
+
+  def tearDown(self):
+    self._temp_dir.cleanup()
+
+  def test_returns_stored_values(self):
+    with result_cache.ResultCache(self.path) as cache:
+      cache.put_many({_key('a'): 0.5, _key('a', cutoff=5): 0.25})
+
+    with result_cache.ResultCache(self.path) as cache:
+      values = cache.get_many([_key('a'), _key('a', cutoff=5), _key('b')])
+
+    self.assertEqual({_key('a'): 0.5, _key('a', cutoff=5): 0.25}, values)
+
+  def test_stores_all_items_cutoff(self):
+    with result_cache.ResultCache(self.path) as cache:
+      cache.put_many({_key('a', cutoff=None): 0.5})
+
+      self.assertEqual({_key('a', cutoff=None): 0.5},
+                       cache.get_many([_key('a', cutoff=None), _key('a')]))
+
+  def test_replaces_values(self):
+    with result_cache.ResultCache(self.path) as cache:
+      cache.put_many({_key('a'): 0.5})
+      cache.put_many({_key('a'): 0.75})
+
+      self.assertEqual({_key('a'): 0.75}, cache.get_many([_key('a')]))
+
+  def test_looks_up_many_keys(self):
+    keys = [_key(str(i)) for i in range(250)]
+    with result_cache.ResultCache(self.path) as cache:
+      cache.put_many({key: i for i, key in enumerate(keys)})
+
+      values = cache.get_many(keys + [_key('missing')])
+
+    self.assertEqual({key: i for i, key in enumerate(keys)}, values)
+
+  def test_unusable_path_acts_empty(self):
+    with result_cache.ResultCache(self._temp_dir.name) as cache:
+      cache.put_many({_key('a'): 0.5})
+
+      self.assertEqual({}, cache.get_many([_key('a')]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,230 @@
+"""Paired significance tests between the sources of each fold.
+
+Sources are compared on the per-user values of a metric, over the users that
+every source of the fold ranks. All pairs of sources are tested at once: each
+batch of random sign flips (permutation test) or resampling counts
+(bootstrap) is drawn once. Both statistics are linear in the values, so each
+batch is applied to the values of every source with a single matrix product,
+and the pairs are differences of those sources x resamples results. Pair
+differences of the users' values are never formed all at once, so
+thousands of resamples stay fast on millions of users.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Bounds the resamples x users weights drawn at once.
+_MAX_RESAMPLE_CELLS = 1 << 23
+
+# Up to this many nonzero differences, scipy may compute exact p-values.
+_MAX_EXACT_WILCOXON_USERS = 50
+
+_COMPARISON_COLUMNS = ('source_a', 'source_b', 'num_users', 'mean_difference',
+                       't_statistic', 't_pvalue', 'wilcoxon_statistic',
+                       'wilcoxon_pvalue', 'permutation_pvalue',
+                       'bootstrap_low', 'bootstrap_high')
+
+_GROUP_COLUMNS = ('metric', 'cutoff', 'fold')
+
+
+def _resample_chunk_sizes(num_resamples, num_users):
+  chunk_size = max(1, _MAX_RESAMPLE_CELLS // max(1, num_users))
+  for start in range(0, num_resamples, chunk_size):
+    yield min(chunk_size, num_resamples - start)
+
+
+def paired_t_test(differences):
+  """Returns the t statistic and two-sided p-value of each row's mean."""
+  with np.errstate(divide='ignore', invalid='ignore'):
+    result = stats.ttest_1samp(differences, 0, axis=1)
+  return result.statistic, result.pvalue
+
+
+def _wilcoxon_normal(differences):
+  """Returns the Wilcoxon statistic and p-value of a row of differences.
+
+  Same as scipy.stats.wilcoxon with its normal approximation (zero
+  differences dropped, ties corrected), from a single sort.
+  """
+  nonzero = differences[differences != 0]
+  n = len(nonzero)
+  order = np.argsort(np.abs(nonzero))
+  sorted_abs = np.abs(nonzero[order])
+
+  starts = np.flatnonzero(np.diff(sorted_abs, prepend=-1.) != 0)
+  tie_counts = np.diff(np.append(starts, n))
+  # Tied values share the mean of their 1-based ranks.
+  ranks = np.repeat(starts + (tie_counts + 1) / 2, tie_counts)
+  r_plus = ranks[nonzero[order] > 0].sum()
+
+  statistic = min(r_plus, n * (n + 1) / 2 - r_plus)
+  tie_counts = tie_counts.astype('float64')
+  variance = (n * (n + 1) * (2 * n + 1) -
+              0.5 * (tie_counts * (tie_counts * tie_counts - 1)).sum()) / 24
+  z = (statistic - n * (n + 1) / 4) / np.sqrt(variance)
+  return statistic, 2 * stats.norm.sf(abs(z))
+
+
+def wilcoxon_test(differences):
+  """Returns the Wilcoxon signed-rank statistic and p-value of each row.
+
+  Rows whose differences are all zero get NaN.
+  """
+  statistics = np.full(len(differences), np.nan)
+  pvalues = np.full(len(differences), np.nan)
+  for i, row in enumerate(differences):
+    num_nonzero = np.count_nonzero(row)
+    if num_nonzero > _MAX_EXACT_WILCOXON_USERS:
+      statistics[i], pvalues[i] = _wilcoxon_normal(row)
+    elif num_nonzero:
+      result = stats.wilcoxon(row)
+      statistics[i], pvalues[i] = result.statistic, result.pvalue
+  return statistics, pvalues
+
+
+def _resampled(values, weights, contrasts):
+  """Returns contrasts @ values @ weights.T, computed in that order."""
+  if contrasts is None:
+    return values @ weights.T
+  return contrasts @ (values @ weights.T)
+
+
+def permutation_test(values, num_resamples=1000, random=None, contrasts=None):
+  """Returns the two-sided sign-flip p-value of each row's mean being 0.
+
+  random -- Optional numpy Generator.
+  contrasts -- Optional rows x len(values) matrix. When set, the rows tested
+      are those of contrasts @ values (e.g. pair differences), which are
+      never formed.
+  """
+  random = random or np.random.default_rng()
+  num_users = values.shape[1]
+  observed = np.abs(
+      _resampled(values, np.ones((1, num_users)), contrasts)[:, 0])
+  num_extreme = np.zeros(len(observed))
+  for chunk_size in _resample_chunk_sizes(num_resamples, num_users):
+    signs = random.integers(0, 2, size=(chunk_size, num_users), dtype='int8')
+    signs = signs.astype('float64') * 2 - 1
+    sums = np.abs(_resampled(values, signs, contrasts))
+    # The tolerance keeps flips that reproduce the observed sum from
+    # falling below it by rounding.
+    num_extreme += (sums >= observed[:, None] * (1 - 1e-9)).sum(axis=1)
+  return (num_extreme + 1) / (num_resamples + 1)
+
+
+def bootstrap_interval(values,
+                       num_resamples=1000,
+                       confidence=0.95,
+                       random=None,
+                       contrasts=None):
+  """Returns the percentile bootstrap interval of each row's mean.
+
+  random -- Optional numpy Generator.
+  contrasts -- Optional, as in permutation_test.
+
+  Returns the lower and upper bounds, one value per row each.
+  """
+  random = random or np.random.default_rng()
+  num_users = values.shape[1]
+  num_rows = len(values) if contrasts is None else len(contrasts)
+  if not num_users:
+    return np.full(num_rows, np.nan), np.full(num_rows, np.nan)
+
+  means = np.empty((num_rows, num_resamples))
+  done = 0
+  for chunk_size in _resample_chunk_sizes(num_resamples, num_users):
+    samples = random.integers(0, num_users, size=(chunk_size, num_users))
+    samples += num_users * np.arange(chunk_size)[:, None]
+    counts = np.bincount(
+        samples.ravel(), minlength=chunk_size * num_users).reshape(
+            chunk_size, num_users).astype('float64')
+    means[:, done:done + chunk_size] = _resampled(values, counts,
+                                                  contrasts) / num_users
+    done += chunk_size
+
+  tail = (1 - confidence) / 2
+  low, high = np.quantile(means, [tail, 1 - tail], axis=1)
+  return low, high
+
+
+def compare_sources(values,
+                    sources,
+                    num_resamples=1000,
+                    confidence=0.95,
+                    seed=0):
+  """Tests every pair of sources for a difference in mean value.
+
+  values -- A sources x users array, with the values of the same user in
+      each column.
+  sources -- The name of each row of values.
+
+  Returns a frame with one row per pair, in which the differences are
+  source_a minus source_b.
+  """
+  values = np.asarray(values, dtype='float64')
+  a_indices, b_indices = np.triu_indices(len(sources), k=1)
+  num_pairs = len(a_indices)
+  random = np.random.default_rng(seed)
+
+  # The rank-based and t tests need each pair's differences, which are
+  # formed one pair at a time.
+  mean_differences = np.full(num_pairs, np.nan)
+  t_statistics, t_pvalues = np.full((2, num_pairs), np.nan)
+  wilcoxon_statistics, wilcoxon_pvalues = np.full((2, num_pairs), np.nan)
+  for i, (a, b) in enumerate(zip(a_indices, b_indices)):
+    differences = (values[a] - values[b])[None]
+    if differences.size:
+      mean_differences[i] = differences.mean()
+    with np.errstate(invalid='ignore'):
+      (t_statistics[i],), (t_pvalues[i],) = paired_t_test(differences)
+    (wilcoxon_statistics[i],), (wilcoxon_pvalues[i],) = wilcoxon_test(
+        differences)
+
+  contrasts = np.zeros((num_pairs, len(values)))
+  contrasts[np.arange(num_pairs), a_indices] = 1
+  contrasts[np.arange(num_pairs), b_indices] = -1
+  permutation_pvalues = permutation_test(
+      values, num_resamples, random, contrasts=contrasts)
+  bootstrap_low, bootstrap_high = bootstrap_interval(
+      values, num_resamples, confidence, random, contrasts=contrasts)
+
+  sources = np.asarray(sources, dtype=object)
+  return pd.DataFrame(
+      dict(
+          source_a=sources[a_indices],
+          source_b=sources[b_indices],
+          num_users=np.full(num_pairs, values.shape[1]),
+          mean_difference=mean_differences,
+          t_statistic=t_statistics,
+          t_pvalue=t_pvalues,
+          wilcoxon_statistic=wilcoxon_statistics,
+          wilcoxon_pvalue=wilcoxon_pvalues,
+          permutation_pvalue=permutation_pvalues,
+          bootstrap_low=bootstrap_low,
+          bootstrap_high=bootstrap_high),
+      columns=_COMPARISON_COLUMNS)
+
+
+def compare_all(user_values_frame, num_resamples=1000, confidence=0.95,
+                seed=0):
+  """Compares the sources of each metric, cutoff and fold.
+
+  user_values_frame -- Per-user values, with metric, cutoff, fold, source,
+      user_id and value columns (see gen_metrics.compute_all_user_values).
+
+  Only the users ranked by every source of a fold are compared.
+  """
+  frames = []
+  for group_key, group in user_values_frame.groupby(
+      list(_GROUP_COLUMNS), sort=True, observed=True):
+    values = group.pivot(
+        index='user_id', columns='source', values='value').dropna()
+    frame = compare_sources(values.values.T, values.columns.tolist(),
+                            num_resamples, confidence, seed)
+    for name, value in zip(_GROUP_COLUMNS, group_key):
+      frame.insert(_GROUP_COLUMNS.index(name), name, value)
+    frames.append(frame)
+
+  if not frames:
+    return pd.DataFrame(columns=_GROUP_COLUMNS + _COMPARISON_COLUMNS)
+  return pd.concat(frames, ignore_index=True)
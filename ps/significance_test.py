@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from ps import significance
+
+
+class PairedTestsTest(unittest.TestCase):
+
+  def setUp(self):
+    random = np.random.RandomState(0)
+    self.values = random.normal(size=(3, 200))
+    self.values[1] += 0.5
+    self.differences = np.array(
+        [self.values[0] - self.values[1], self.values[0] - self.values[2]])
+
+  def test_t_test_matches_scipy(self):
+    statistics, pvalues = significance.paired_t_test(self.differences)
+
+    for i, (a, b) in enumerate([(0, 1), (0, 2)]):
+      expected = stats.ttest_rel(self.values[a], self.values[b])
+      self.assertAlmostEqual(expected.statistic, statistics[i])
+      self.assertAlmostEqual(expected.pvalue, pvalues[i])
+
+  def test_wilcoxon_matches_scipy(self):
+    differences = np.round(self.differences, 1)
+    differences[:, :10] = 0
+    small_differences = differences[:, :30]
+
+    for rows in (differences, small_differences):
+      statistics, pvalues = significance.wilcoxon_test(rows)
+
+      for i, row in enumerate(rows):
+        expected = stats.wilcoxon(row)
+        self.assertAlmostEqual(expected.statistic, statistics[i])
+        self.assertAlmostEqual(expected.pvalue, pvalues[i])
+
+  def test_zero_differences(self):
+    differences = np.zeros((1, 10))
+
+    self.assertTrue(np.isnan(significance.wilcoxon_test(differences)[1][0]))
+    self.assertEqual([1],
+                     significance.permutation_test(differences, 20).tolist())
+
+  def test_permutation_test_in_chunks(self):
+    with mock.patch.object(significance, '_MAX_RESAMPLE_CELLS', 1000):
+      pvalues = significance.permutation_test(
+          self.differences, 999, random=np.random.default_rng(0))
+
+    self.assertLess(pvalues[0], 0.01)
+    self.assertGreater(pvalues[1], 0.05)
+
+  def test_bootstrap_interval_in_chunks(self):
+    with mock.patch.object(significance, '_MAX_RESAMPLE_CELLS', 1000):
+      low, high = significance.bootstrap_interval(
+          self.differences, 500, random=np.random.default_rng(0))
+
+    means = self.differences.mean(axis=1)
+    np.testing.assert_array_less(low, means)
+    np.testing.assert_array_less(means, high)
+    self.assertLess(high[0], 0)
+
+  def test_contrasts_match_differences(self):
+    contrasts = np.array([[1., -1., 0.], [1., 0., -1.]])
+
+    for test in (significance.permutation_test,
+                 significance.bootstrap_interval):
+      expected = test(self.differences, 200, random=np.random.default_rng(0))
+      actual = test(
+          self.values,
+          200,
+          random=np.random.default_rng(0),
+          contrasts=contrasts)
+
+      np.testing.assert_allclose(expected, actual)
+
+
+class CompareAllTest(unittest.TestCase):
+
+  def test_compares_sources_of_each_fold(self):
+    records = [('MAP', 10, fold, source, user_id, value)
+               for fold in ('1', '2')
+               for source, shift in (('A', 0), ('B', 1), ('C', 2))
+               for user_id, value in enumerate(np.arange(5.) + shift)]
+    # Users ranked by only some sources are left out.
+    records.append(('MAP', 10, '1', 'A', 99, 100.))
+    frame = pd.DataFrame.from_records(
+        records,
+        columns=['metric', 'cutoff', 'fold', 'source', 'user_id', 'value'])
+
+    comparisons = significance.compare_all(frame, num_resamples=50)
+
+    self.assertEqual([('1', 'A', 'B'), ('1', 'A', 'C'), ('1', 'B', 'C'),
+                      ('2', 'A', 'B'), ('2', 'A', 'C'), ('2', 'B', 'C')],
+                     list(
+                         zip(comparisons.fold, comparisons.source_a,
+                             comparisons.source_b)))
+    self.assertEqual([5] * 6, comparisons.num_users.tolist())
+    self.assertEqual([-1, -2, -1] * 2, comparisons.mean_difference.tolist())
+
+
+if __name__ == '__main__':
+  unittest.main()